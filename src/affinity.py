@@ -0,0 +1,265 @@
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger("o3enc.affinity")
+
+# ioprio_set syscall numbers per architecture (Linux)
+IOPRIO_SYSCALLS = {"x86_64": 251, "amd64": 251, "i386": 289, "i686": 289, "aarch64": 30, "arm64": 30}
+IOPRIO_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+
+# Windows priority classes, from the most to the least favourable nice value they cover
+WINDOWS_PRIORITY_CLASSES = [(-10, 0x80), (-1, 0x8000), (0, 0x20), (14, 0x4000), (19, 0x40)]
+
+# How often a resumed job looks for a free partition again (seconds)
+LEASE_POLL_SECONDS = 0.2
+
+@dataclass(slots=True)
+class ProcessPriority:
+    nice: int = 0
+    io_class: Optional[str] = None   # realtime, best-effort, idle; None leaves I/O priority alone
+    io_level: int = 4                # 0 (highest) - 7 (lowest) within the class
+
+NORMAL_PRIORITY = ProcessPriority()
+# Unattended batch work yields to interactive encodes and previews
+BACKGROUND_PRIORITY = ProcessPriority(nice=10, io_class="best-effort", io_level=7)
+
+def parse_priority(nice: Optional[str], ionice: Optional[str],
+                   base: ProcessPriority = NORMAL_PRIORITY) -> ProcessPriority:
+    """Build a priority from config strings: nice '10', ionice 'idle' or 'best-effort:7'.
+
+    Values not given are taken from base.
+    """
+    priority = ProcessPriority(base.nice, base.io_class, base.io_level)
+    if nice:
+        priority.nice = max(-20, min(19, int(nice)))
+    if ionice:
+        io_class, _, level = ionice.strip().lower().partition(":")
+        if io_class not in IOPRIO_CLASSES:
+            raise ValueError(f"unknown ionice class: {io_class}")
+        priority.io_class = io_class
+        if level:
+            priority.io_level = max(0, min(7, int(level)))
+    return priority
+
+@dataclass(slots=True)
+class CpuSet:
+    cpus: Tuple[int, ...]
+    node: Optional[int] = None
+
+    def __str__(self) -> str:
+        where = f" on node {self.node}" if self.node is not None else ""
+        return f"{len(self.cpus)} CPU(s){where}"
+
+def _parse_cpulist(text: str) -> List[int]:
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+def _usable_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def _core_key(cpu: int) -> int:
+    """Lowest sibling of a CPU, so hyperthreads of one core end up in the same partition."""
+    siblings = Path(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list")
+    try:
+        return min(_parse_cpulist(siblings.read_text()))
+    except (OSError, ValueError):
+        return cpu
+
+def numa_nodes() -> Dict[int, List[int]]:
+    """Usable CPUs grouped by NUMA node, hyperthread siblings adjacent; one node when unknown."""
+    usable = set(_usable_cpus())
+    nodes: Dict[int, List[int]] = {}
+    node_root = Path("/sys/devices/system/node")
+    if node_root.exists():
+        for node_dir in node_root.glob("node[0-9]*"):
+            try:
+                cpus = [cpu for cpu in _parse_cpulist((node_dir / "cpulist").read_text()) if cpu in usable]
+            except (OSError, ValueError):
+                continue
+            if cpus:
+                nodes[int(node_dir.name[4:])] = cpus
+    if not nodes:
+        nodes = {0: sorted(usable)}
+    return {node: sorted(cpus, key=lambda cpu: (_core_key(cpu), cpu)) for node, cpus in sorted(nodes.items())}
+
+def partition_cpus(nodes: Dict[int, List[int]], slots: int) -> List[CpuSet]:
+    """Split the machine into one CPU set per concurrent job, never straddling NUMA nodes
+    unless there are fewer jobs than nodes."""
+    node_ids = list(nodes)
+    if slots <= len(node_ids):
+        partitions = []
+        for slot in range(slots):
+            owned = node_ids[slot::slots]
+            cpus = tuple(cpu for node in owned for cpu in nodes[node])
+            partitions.append(CpuSet(cpus, owned[0] if len(owned) == 1 else None))
+        return partitions
+
+    # Hand out slots node by node, weighted by CPU count
+    total = sum(len(cpus) for cpus in nodes.values())
+    shares = {node: max(1, round(slots * len(cpus) / total)) for node, cpus in nodes.items()}
+    while sum(shares.values()) > slots:
+        shares[max(shares, key=lambda node: shares[node])] -= 1
+    while sum(shares.values()) < slots:
+        shares[max(shares, key=lambda node: len(nodes[node]) / shares[node])] += 1
+
+    partitions = []
+    for node, count in shares.items():
+        cpus = nodes[node]
+        for index in range(count):
+            chunk = tuple(cpus[index * len(cpus) // count:(index + 1) * len(cpus) // count])
+            if chunk:
+                partitions.append(CpuSet(chunk, node))
+    return partitions
+
+class CpuAllocator:
+    """Hands each running job its own CPU partition; jobs beyond the partition count run unpinned."""
+
+    def __init__(self, slots: int, nodes: Optional[Dict[int, List[int]]] = None):
+        nodes = nodes or numa_nodes()
+        self.partitions = partition_cpus(nodes, max(1, slots))
+        self._free = list(self.partitions)
+        self._lock = threading.Lock()
+        layout = ", ".join(str(partition) for partition in self.partitions)
+        logger.info(f"CPU partitions for {slots} concurrent job(s): {layout}")
+
+    def lease(self) -> 'CpuLease':
+        """A partition for one encode, taken when entered; None inside when all are in use."""
+        return CpuLease(self)
+
+class CpuLease:
+    """A CPU partition held by one encode and handed back while its job is suspended.
+
+    Same protocol as storage.Lease. pids are the children placed on it, re-pinned
+    when a resumed job gets a different partition.
+    """
+
+    def __init__(self, allocator: CpuAllocator):
+        self.allocator = allocator
+        self.cpu_set: Optional[CpuSet] = None
+        self.pids: Set[int] = set()
+        self.held = False
+        self._lock = threading.Lock()
+
+    def acquire(self, abort: Optional[Callable[[], bool]] = None) -> bool:
+        """Without abort, takes a free partition or none; with abort, a pinned job waits for one."""
+        while True:
+            with self.allocator._lock:
+                if self.allocator._free or abort is None or self.cpu_set is None:
+                    self.cpu_set = self.allocator._free.pop(0) if self.allocator._free else None
+                    self.held = True
+                    return True
+            if abort():
+                return False
+            time.sleep(LEASE_POLL_SECONDS)
+
+    def release(self):
+        with self._lock:
+            if not self.held:
+                return
+            self.held = False
+        if self.cpu_set is not None:
+            with self.allocator._lock:
+                self.allocator._free.append(self.cpu_set)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+def _thread_ids(pid: int) -> List[int]:
+    # Affinity, nice and ioprio are per thread on Linux
+    try:
+        return [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        return [pid]
+
+def _set_io_priority(tid: int, priority: ProcessPriority):
+    syscall = IOPRIO_SYSCALLS.get(platform.machine().lower())
+    if syscall is None:
+        return
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    value = (IOPRIO_CLASSES[priority.io_class] << IOPRIO_CLASS_SHIFT) | priority.io_level
+    if libc.syscall(syscall, IOPRIO_WHO_PROCESS, tid, value) != 0:
+        raise OSError(ctypes.get_errno(), "ioprio_set failed")
+
+def _apply_windows(pid: int, cpu_set: Optional[CpuSet], priority: ProcessPriority):
+    import ctypes
+    PROCESS_SET_INFORMATION = 0x0200
+    PROCESS_QUERY_INFORMATION = 0x0400
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.OpenProcess(PROCESS_SET_INFORMATION | PROCESS_QUERY_INFORMATION, False, pid)
+    if not handle:
+        raise OSError(f"OpenProcess failed for pid {pid}")
+    try:
+        if cpu_set is not None:
+            mask = sum(1 << cpu for cpu in cpu_set.cpus if cpu < 64)
+            if mask and not kernel32.SetProcessAffinityMask(handle, ctypes.c_size_t(mask)):
+                raise OSError("SetProcessAffinityMask failed")
+        if priority.nice:
+            priority_class = next(value for limit, value in WINDOWS_PRIORITY_CLASSES if priority.nice <= limit)
+            if not kernel32.SetPriorityClass(handle, priority_class):
+                raise OSError("SetPriorityClass failed")
+    finally:
+        kernel32.CloseHandle(handle)
+
+def apply_placement(pid: int, cpu_set: Optional[CpuSet], priority: ProcessPriority):
+    """Pin a freshly started child to its CPU set and lower its CPU/I/O priority.
+
+    Best effort: a failure is logged and the child keeps running with default placement.
+    """
+    if cpu_set is None and priority == NORMAL_PRIORITY:
+        return
+    try:
+        if sys.platform == "win32":
+            _apply_windows(pid, cpu_set, priority)
+            return
+        for tid in _thread_ids(pid):
+            if cpu_set is not None and hasattr(os, "sched_setaffinity"):
+                os.sched_setaffinity(tid, cpu_set.cpus)
+            if priority.nice:
+                os.setpriority(os.PRIO_PROCESS, tid, priority.nice)
+            if priority.io_class and sys.platform.startswith("linux"):
+                _set_io_priority(tid, priority)
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning(f"Could not apply CPU placement to process {pid}: {str(e)}")
+
+def thread_hint_args(cmd: List[str], threads: int) -> List[str]:
+    """Copy of an encode command with -threads (and x265 pools) sized to the job's CPU set.
+
+    Options the preset sets itself are left alone. The output file must be the last argument.
+    """
+    if threads <= 0 or "-threads" in cmd:
+        return cmd
+    cmd = list(cmd)
+    hints = ["-threads", str(threads)]
+    if "-filter_threads" not in cmd:
+        hints += ["-filter_threads", str(threads)]
+    if "libx265" in cmd:
+        # libx265 sizes its own thread pool and ignores -threads
+        if "-x265-params" in cmd[:-1]:
+            position = cmd.index("-x265-params") + 1
+            if "pools=" not in cmd[position]:
+                cmd[position] += f":pools={threads}"
+        else:
+            hints += ["-x265-params", f"pools={threads}"]
+    cmd[-1:-1] = hints
+    return cmd
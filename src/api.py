@@ -0,0 +1,163 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from errors import EncodingError, PresetError
+from affinity import BACKGROUND_PRIORITY, CpuAllocator, ProcessPriority
+from storage import DiskBudget, VolumeThrottle
+from verify import VerificationResult
+from core import O3Encoder, PresetManager, estimate_input_seconds, run_batch
+
+@dataclass(slots=True)
+class EncodeJob:
+    input_file: str
+    presets: List[str]
+    output_dir: Optional[Path] = None
+    # Used when the source is untagged and sampled detection is unsure
+    colorspace: str = "auto"
+    colorrange: str = "auto"
+    parallel_encodes: int = 1
+    # (start, end) seconds of the input to encode; end None means to the end
+    trim: Optional[Tuple[float, Optional[float]]] = None
+    # Background priority when not set
+    priority: Optional[ProcessPriority] = None
+
+@dataclass(slots=True)
+class PresetResult:
+    preset: str
+    success: bool
+    output_file: Path
+    error: Optional[str] = None
+    # Stream copy decision, see O3Encoder.plan_passthrough
+    passthrough: Optional[dict] = None
+    verification: Optional[VerificationResult] = None
+
+    @classmethod
+    def from_result(cls, preset: str, result: dict) -> 'PresetResult':
+        return cls(preset=preset, success=result['success'], output_file=Path(result['output_file']),
+                   error=result.get('error'), passthrough=result.get('passthrough'),
+                   verification=result.get('verification'))
+
+@dataclass(slots=True)
+class JobResult:
+    input_file: str
+    presets: Dict[str, PresetResult] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    @property
+    def success(self) -> bool:
+        return bool(self.presets) and all(result.success for result in self.presets.values())
+
+class Session:
+    """In-process access to o3enc for other Python code: no prompts, no console output.
+
+    Presets are loaded and the tools checked once per session rather than once per job.
+    encode() is blocking and may be called from several threads at once; disk space,
+    volume bandwidth and CPU partitions are shared between those calls. Progress events
+    are the dicts documented for the job service. Logging goes to the "o3enc" logger,
+    which stays silent until the application configures it.
+    """
+
+    def __init__(self, preset_file: Optional[Path] = None, max_jobs: int = 1, test_nvenc: bool = False):
+        # Holds the checked environment and the encode history, like the service and watch modes
+        self._encoder = O3Encoder("session")
+        self._encoder.interactive = False
+        try:
+            self._encoder.initialize_environment(test_nvenc, preset_file)
+        except BaseException:
+            self.close()
+            raise
+        self.preset_manager: PresetManager = self._encoder.preset_manager
+
+        self.disk_budget = DiskBudget()
+        self.throttle = VolumeThrottle()
+        self.cpu_allocator = CpuAllocator(max_jobs) if max_jobs > 1 else None
+        # id() of each EncodeJob being encoded -> its encoders
+        self._running: Dict[int, List[O3Encoder]] = {}
+        self._paused: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> 'Session':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def preset_names(self) -> List[str]:
+        return list(self.preset_manager.presets)
+
+    def preset(self, name: str) -> dict:
+        try:
+            return self.preset_manager.presets[name]
+        except KeyError:
+            raise PresetError(f"Unknown preset: {name}")
+
+    def estimate(self, job: EncodeJob) -> float:
+        """Predicted seconds for the job from the encode history."""
+        return estimate_input_seconds(self._encoder, job.input_file, [self.preset(name) for name in job.presets])
+
+    def encode(self, job: EncodeJob, progress: Optional[Callable[[dict], None]] = None) -> JobResult:
+        """Encode one input with the job's presets and return once every output is verified."""
+        presets = [self.preset(name) for name in job.presets]
+        with self._lock:
+            if id(job) in self._running:
+                raise EncodingError("This job is already being encoded")
+            self._running[id(job)] = []
+
+        def on_encoder(encoder: O3Encoder):
+            with self._lock:
+                self._running[id(job)].append(encoder)
+                if id(job) in self._paused:
+                    encoder.suspend()
+
+        started = time.monotonic()
+        try:
+            results = run_batch(job.input_file, presets, self.preset_manager,
+                                Path(job.output_dir) if job.output_dir else None, job.colorspace, job.colorrange,
+                                self.disk_budget, self.throttle, progress, on_encoder, self.cpu_allocator,
+                                job.priority or BACKGROUND_PRIORITY, job.parallel_encodes, interactive=False,
+                                trim=job.trim)
+        finally:
+            with self._lock:
+                del self._running[id(job)]
+                self._paused.discard(id(job))
+        return JobResult(input_file=job.input_file,
+                         presets={name: PresetResult.from_result(name, result) for name, result in results.items()},
+                         elapsed=time.monotonic() - started)
+
+    def _encoders(self, job: Optional[EncodeJob]) -> List[O3Encoder]:
+        with self._lock:
+            if job is None:
+                return [encoder for encoders in self._running.values() for encoder in encoders]
+            return list(self._running.get(id(job), []))
+
+    def cancel(self, job: Optional[EncodeJob] = None):
+        """Stop the encode of job, or every running encode; their encode() calls return failed results."""
+        for encoder in self._encoders(job):
+            encoder.cancel()
+
+    def pause(self, job: Optional[EncodeJob] = None):
+        """Suspend the ffmpeg processes of job (or of every job) in place until resume().
+        
+        Their volume slots, disk reservations and CPU partitions are free for other jobs meanwhile.
+        """
+        with self._lock:
+            keys = [id(job)] if job is not None else list(self._running)
+            self._paused.update(key for key in keys if key in self._running)
+        for encoder in self._encoders(job):
+            encoder.suspend()
+
+    def resume(self, job: Optional[EncodeJob] = None):
+        with self._lock:
+            if job is None:
+                self._paused.clear()
+            else:
+                self._paused.discard(id(job))
+        for encoder in self._encoders(job):
+            encoder.resume()
+
+    def close(self):
+        self._encoder.cleanup()
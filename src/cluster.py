@@ -0,0 +1,309 @@
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import socket
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+from errors import O3EncoderError
+
+logger = logging.getLogger("o3enc.cluster")
+
+DEFAULT_PORT = 8766
+HEARTBEAT_INTERVAL = 5.0
+HEARTBEAT_TIMEOUT = 20.0
+MAX_ATTEMPTS = 3
+RECONNECT_DELAY = 5.0
+PROGRESS_INTERVAL = 1.0
+MAX_MESSAGE_BYTES = 4 * 1024 * 1024
+
+class ClusterError(O3EncoderError):
+    pass
+
+def parse_address(address: str, default_port: int = DEFAULT_PORT):
+    host, _, port = address.rpartition(":")
+    if not host:
+        return address or "127.0.0.1", default_port
+    return host, int(port)
+
+def attempt_path(path: str, attempt: int) -> str:
+    """Where one attempt of a task writes path, so a stale attempt never overwrites the accepted one."""
+    path = Path(path)
+    return str(path.with_name(f"{path.stem}.attempt{attempt}{path.suffix}"))
+
+async def send_message(writer: asyncio.StreamWriter, message: dict):
+    writer.write((json.dumps(message) + "\n").encode('utf-8'))
+    await writer.drain()
+
+async def read_message(reader: asyncio.StreamReader) -> Optional[dict]:
+    line = await reader.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+@dataclass(slots=True)
+class TaskState:
+    id: str
+    task: dict
+    attempts: int = 0
+    cost: float = 0.0                # expected seconds, longer tasks are handed out first
+    status: str = "pending"          # pending, running, done, failed
+    worker: Optional[str] = None
+    result: Optional[dict] = None
+    errors: List[str] = field(default_factory=list)
+
+@dataclass(slots=True)
+class WorkerConnection:
+    name: str
+    writer: asyncio.StreamWriter
+    slots: int
+    last_seen: float = field(default_factory=time.monotonic)
+    running: Set[str] = field(default_factory=set)
+
+class Coordinator:
+    """Hands tasks to connected workers over TCP and collects their results.
+
+    Protocol: one JSON object per line.
+      worker -> coordinator: hello {worker, slots}, heartbeat, progress {task, ...},
+                             result {task, attempt, result}
+      coordinator -> worker: task {task} (task carries its attempt number)
+    A worker that stops sending anything for HEARTBEAT_TIMEOUT is dropped and its
+    tasks go back to the queue, up to MAX_ATTEMPTS per task. Only the result of a
+    task's latest attempt is accepted; state.attempts is then the committed one.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = DEFAULT_PORT,
+                 heartbeat_timeout: float = HEARTBEAT_TIMEOUT, max_attempts: int = MAX_ATTEMPTS,
+                 progress_callback: Optional[Callable[[str, dict], None]] = None):
+        self.host = host
+        self.port = port
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.progress_callback = progress_callback
+        self.tasks: Dict[str, TaskState] = {}
+        self.workers: Dict[str, WorkerConnection] = {}
+        self._pending: Deque[str] = collections.deque()
+        self._ids = itertools.count(1)
+        self._all_done: Optional[asyncio.Event] = None
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._handlers: Set[asyncio.Task] = set()
+
+    def add_task(self, task: dict, cost: float = 0.0) -> str:
+        """Queue a task; pending tasks are dispatched by descending cost, then in order added."""
+        task_id = str(next(self._ids))
+        self.tasks[task_id] = TaskState(id=task_id, task={**task, "id": task_id}, cost=cost)
+        position = len(self._pending)
+        while position > 0 and self.tasks[self._pending[position - 1]].cost < cost:
+            position -= 1
+        self._pending.insert(position, task_id)
+        return task_id
+
+    async def run(self) -> Dict[str, TaskState]:
+        """Serve workers until every task is done or has failed for good."""
+        self._all_done = asyncio.Event()
+        if not self.tasks:
+            return self.tasks
+        self._server = await asyncio.start_server(self._handle_worker, self.host, self.port,
+                                                  limit=MAX_MESSAGE_BYTES)
+        logger.info(f"Coordinator listening on {self.host}:{self.port} with {len(self.tasks)} task(s)")
+        monitor = asyncio.create_task(self._monitor())
+        try:
+            await self._all_done.wait()
+        finally:
+            monitor.cancel()
+            self._server.close()
+            for worker in list(self.workers.values()):
+                worker.writer.close()
+            # Let connection handlers see the closed sockets before the loop goes away
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            await self._server.wait_closed()
+        return self.tasks
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        worker = None
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        try:
+            hello = await read_message(reader)
+            if not hello or hello.get("type") != "hello":
+                return
+            peer = writer.get_extra_info("peername")
+            name = f"{hello.get('worker', 'worker')}@{peer[0] if peer else '?'}:{peer[1] if peer else '?'}"
+            worker = WorkerConnection(name=name, writer=writer, slots=max(1, int(hello.get("slots", 1))))
+            self.workers[name] = worker
+            logger.info(f"Worker connected: {name} ({worker.slots} slot(s))")
+            await self._dispatch()
+
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                worker.last_seen = time.monotonic()
+                if message.get("type") == "result":
+                    await self._complete(worker, message.get("task"), message.get("attempt"),
+                                         message.get("result") or {})
+                elif message.get("type") == "progress" and self.progress_callback:
+                    self.progress_callback(message.get("task"), message)
+        except (ConnectionError, asyncio.IncompleteReadError, json.JSONDecodeError, ValueError) as e:
+            logger.warning(f"Worker connection error: {str(e)}")
+        finally:
+            self._handlers.discard(handler)
+            if worker is not None:
+                self._drop_worker(worker, "disconnected")
+                await self._dispatch()
+
+    def _drop_worker(self, worker: WorkerConnection, reason: str):
+        if self.workers.pop(worker.name, None) is None:
+            return
+        logger.warning(f"Worker {worker.name} {reason}; requeueing {len(worker.running)} task(s)")
+        for task_id in list(worker.running):
+            self._retry(self.tasks[task_id], f"worker {worker.name} {reason}")
+        worker.running.clear()
+        worker.writer.close()
+
+    def _retry(self, state: TaskState, error: str):
+        state.errors.append(error)
+        state.worker = None
+        if state.attempts >= self.max_attempts:
+            state.status = "failed"
+            logger.error(f"Task {state.id} failed after {state.attempts} attempt(s): {error}")
+            self._check_finished()
+        else:
+            state.status = "pending"
+            self._pending.appendleft(state.id)
+
+    async def _complete(self, worker: WorkerConnection, task_id: str, attempt: Optional[int], result: dict):
+        state = self.tasks.get(task_id)
+        if state is None or state.status != "running" or state.worker != worker.name or attempt != state.attempts:
+            # Late result of an attempt we already gave up on
+            logger.info(f"Ignoring result of task {task_id} attempt {attempt} from {worker.name}")
+            return
+        worker.running.discard(task_id)
+        if result.get("success"):
+            state.status = "done"
+            state.result = result
+            logger.info(f"Task {task_id} finished on {worker.name}")
+            self._check_finished()
+        else:
+            logger.warning(f"Task {task_id} failed on {worker.name}: {result.get('error')}")
+            self._retry(state, result.get("error") or "unknown error")
+        await self._dispatch()
+
+    def _check_finished(self):
+        if all(state.status in ("done", "failed") for state in self.tasks.values()):
+            self._all_done.set()
+
+    async def _dispatch(self):
+        for worker in list(self.workers.values()):
+            while self._pending and len(worker.running) < worker.slots:
+                task_id = self._pending.popleft()
+                state = self.tasks[task_id]
+                state.status = "running"
+                state.worker = worker.name
+                state.attempts += 1
+                worker.running.add(task_id)
+                try:
+                    await send_message(worker.writer, {"type": "task",
+                                                       "task": {**state.task, "attempt": state.attempts}})
+                except ConnectionError:
+                    self._drop_worker(worker, "disconnected")
+                    break
+                logger.info(f"Task {task_id} -> {worker.name} (attempt {state.attempts})")
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(1.0)
+            now = time.monotonic()
+            for worker in list(self.workers.values()):
+                if now - worker.last_seen > self.heartbeat_timeout:
+                    self._drop_worker(worker, "missed heartbeats")
+            await self._dispatch()
+
+class Worker:
+    """Connects to a coordinator, runs the tasks it receives and reports results; reconnects when dropped."""
+
+    def __init__(self, host: str, port: int, task_runner: Callable[[dict, Callable[[dict], None]], dict],
+                 slots: int = 1, name: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.task_runner = task_runner
+        self.slots = max(1, slots)
+        self.name = name or socket.gethostname()
+
+    async def run(self):
+        while True:
+            try:
+                await self._session()
+                logger.info("Coordinator closed the connection")
+            except (ConnectionError, OSError) as e:
+                logger.warning(f"Cannot reach coordinator {self.host}:{self.port}: {str(e)}")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _session(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=MAX_MESSAGE_BYTES)
+        logger.info(f"Connected to coordinator {self.host}:{self.port}")
+        await send_message(writer, {"type": "hello", "worker": self.name, "slots": self.slots})
+        heartbeat = asyncio.create_task(self._heartbeat(writer))
+        running: Set[asyncio.Task] = set()
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                if message.get("type") == "task":
+                    task = asyncio.create_task(self._execute(writer, message["task"]))
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+        finally:
+            heartbeat.cancel()
+            writer.close()
+
+    async def _heartbeat(self, writer: asyncio.StreamWriter):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            await send_message(writer, {"type": "heartbeat"})
+
+    async def _execute(self, writer: asyncio.StreamWriter, task: dict):
+        loop = asyncio.get_running_loop()
+        last_sent = [0.0]
+
+        def on_progress(progress: dict):
+            now = time.monotonic()
+            if now - last_sent[0] >= PROGRESS_INTERVAL or progress.get("done"):
+                last_sent[0] = now
+                message = {"type": "progress", "task": task["id"], **progress}
+                loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._send_quietly(writer, message)))
+
+        logger.info(f"Running task {task['id']} ({task.get('kind')})")
+        try:
+            result = await loop.run_in_executor(None, self.task_runner, task, on_progress)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        await self._send_quietly(writer, {"type": "result", "task": task["id"], "attempt": task.get("attempt"),
+                                          "result": result})
+
+    async def _send_quietly(self, writer: asyncio.StreamWriter, message: dict):
+        try:
+            await send_message(writer, message)
+        except ConnectionError:
+            logger.warning(f"Lost coordinator while sending {message.get('type')}")
+
+def plan_segments(duration: float, fps: float, segment_seconds: float) -> List[tuple]:
+    """Split [0, duration) into (start, length) chunks aligned to the source frame grid."""
+    if duration <= 0 or segment_seconds <= 0 or fps <= 0:
+        return [(0.0, duration)]
+    frames_total = round(duration * fps)
+    frames_per_segment = max(1, round(segment_seconds * fps))
+    segments = []
+    for first in range(0, frames_total, frames_per_segment):
+        count = min(frames_per_segment, frames_total - first)
+        segments.append((first / fps, count / fps))
+    # Fold a tiny trailing chunk into the previous one
+    if len(segments) > 1 and segments[-1][1] < segment_seconds / 4:
+        start, length = segments[-2]
+        segments[-2:] = [(start, length + segments[-1][1])]
+    return segments
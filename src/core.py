@@ -1,75 +1,154 @@
+import asyncio
+import collections
 import json
 import os
 import subprocess
 import sys
 from dataclasses import dataclass
+from fractions import Fraction
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 import configparser
 import time
 import shutil
 import logging
 from contextlib import contextmanager
 import tempfile
-
-# Config logging
+import threading
+
+from errors import (O3EncoderError, InitializationError, VideoAnalysisError, AudioAnalysisError,
+                    EncodingError, PresetError, error_context)
+from probe import MediaProbe, MediaInfo, VideoStream, parse_bitrate
+from runner import RunningProcess, install_interrupt_handler, shared_runner
+from framepipe import (DEFAULT_QUEUE_FRAMES, FrameFanout, FrameFormat, iter_buffers, parse_frame_format,
+                       read_raw_frames, read_y4m)
+from sequence import (DEFAULT_SEQUENCE_FPS, ImageSequence, SequencePrefetcher, find_sequence,
+                      is_sequence_path)
+from sampling import (CROP_FRAMES, DEINTERLACERS, IDET_FRAMES, ColorEstimate, CropEstimate, FrameSampler,
+                      ScanEstimate, cached_crop, classify_scan, crop_filter, estimate_color, last_crop,
+                      parse_frame_metadata, parse_idet, sample_starts, store_crop, vote_crop)
+from affinity import (BACKGROUND_PRIORITY, NORMAL_PRIORITY, CpuAllocator, CpuLease, CpuSet, ProcessPriority,
+                      apply_placement, thread_hint_args)
+from verify import OutputVerifier, VerificationJob
+from passcache import FirstPassCache, rate_control_options, stats_key
+from outputcache import OutputCache, link_or_copy, output_fingerprint
+from history import EncodeHistory, format_duration
+from mezzanine import (FREE_SPACE_MARGIN, MODES as MEZZANINE_MODES, choose_codec, is_cheap_chain,
+                       measure_filter_cost, raw_bytes, render_command)
+from storage import DiskBudget, JobEstimate, Lease, VolumeThrottle, estimate_job, is_network_volume
+from watch import WatchDaemon, WatchRule, load_watch_config
+from service import DEFAULT_ADDRESS, JobService, serve
+from cluster import Coordinator, TaskState, Worker, attempt_path, parse_address, plan_segments
+from dag import TaskGraph
+from smartcut import parse_timestamp, piece_encode_options, piece_extension, plan_cut
+from loudness import MIN_SHARD_SECONDS, Shard, ShardReader, merge_shards, plan_shards, shard_command
+
+# Log file written by the command line (see configure_logging)
 log_file_path = Path(__file__).parent / '..' / 'o3enc.log'
 
-# Create logger
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-
-# Create formatters and handlers
-console_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', 
-                                    datefmt='%Y-%m-%d %H:%M:%S')
-
-# Console handler
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(console_formatter)
-console_handler.setLevel(logging.INFO)
-logger.addHandler(console_handler)
-
-# File handler
-file_handler = logging.FileHandler(log_file_path, mode='w', encoding='utf-8')
-file_handler.setFormatter(console_formatter)
-file_handler.setLevel(logging.INFO)
-logger.addHandler(file_handler)
-
-# Prevent logging from propagating to root logger
-logger.propagate = False
-
-class O3EncoderError(Exception):
-    pass
-
-class InitializationError(O3EncoderError):
-    pass
-
-class VideoAnalysisError(O3EncoderError):
-    pass
-
-class AudioAnalysisError(O3EncoderError):
-    pass
-
-class EncodingError(O3EncoderError):
-    pass
-
-class PresetError(O3EncoderError):
-    pass
-
-@contextmanager
-def error_context(error_msg: str, error_class=O3EncoderError):
-    try:
-        yield
-    except Exception as e:
-        logger.error(f"{error_msg}: {str(e)}")
-        raise error_class(f"{error_msg}: {str(e)}") from e
-
-import sys
-import os
-import subprocess
-from pathlib import Path
-import tempfile
-import logging
+# Modules log to children of this logger; nothing is output until the application configures it
+logger = logging.getLogger("o3enc")
+logger.addHandler(logging.NullHandler())
+
+def configure_logging(log_file: Optional[Path] = log_file_path):
+    """Console and log file output for the command line; library users configure logging themselves."""
+    logger.setLevel(logging.INFO)
+    
+    # Create formatters and handlers
+    console_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', 
+                                        datefmt='%Y-%m-%d %H:%M:%S')
+    
+    # Console handler
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(console_formatter)
+    console_handler.setLevel(logging.INFO)
+    logger.addHandler(console_handler)
+    
+    # File handler
+    if log_file is not None:
+        file_handler = logging.FileHandler(log_file, mode='w', encoding='utf-8')
+        file_handler.setFormatter(console_formatter)
+        file_handler.setLevel(logging.INFO)
+        logger.addHandler(file_handler)
+    
+    # Prevent logging from propagating to root logger
+    logger.propagate = False
+
+# Codec produced by each encoder, used to decide whether a source stream
+# already matches what a preset would produce
+VIDEO_ENCODER_CODECS = {
+    "h264_nvenc": "h264", "h264_qsv": "h264", "h264_vaapi": "h264",
+    "h264_amf": "h264", "libx264": "h264",
+    "hevc_nvenc": "hevc", "hevc_qsv": "hevc", "hevc_vaapi": "hevc",
+    "hevc_amf": "hevc", "libx265": "hevc",
+    "av1_nvenc": "av1", "av1_qsv": "av1", "av1_vaapi": "av1", "av1_amf": "av1",
+    "libaom-av1": "av1", "librav1e": "av1", "libsvtav1": "av1",
+    "libvpx-vp9": "vp9", "vp9_qsv": "vp9", "vp9_vaapi": "vp9", "libvpx": "vp8",
+    "prores": "prores", "prores_ks": "prores", "prores_videotoolbox": "prores",
+    "dnxhd": "dnxhd", "cfhd": "cfhd", "ffv1": "ffv1", "magicyuv": "magicyuv",
+}
+
+AUDIO_ENCODER_CODECS = {
+    "aac": "aac", "libfdk_aac": "aac", "libopus": "opus", "opus": "opus",
+    "libvorbis": "vorbis", "vorbis": "vorbis", "libmp3lame": "mp3",
+    "flac": "flac", "alac": "alac", "ac3": "ac3", "eac3": "eac3",
+}
+
+# Codecs each container accepts for stream copy (None = anything)
+CONTAINER_CODECS = {
+    "mp4": {"h264", "hevc", "av1", "vp9", "mpeg4", "aac", "mp3", "opus", "flac", "alac", "ac3", "eac3"},
+    "mov": {"h264", "hevc", "prores", "dnxhd", "cfhd", "mpeg4", "aac", "mp3", "alac", "ac3", "pcm_s16le", "pcm_s24le"},
+    "webm": {"vp8", "vp9", "av1", "opus", "vorbis"},
+    "mkv": None,
+}
+
+# Text subtitle codecs that can be converted for containers without native support
+TEXT_SUBTITLE_CODECS = {"subrip", "ass", "ssa", "mov_text", "webvtt", "text"}
+
+SUBTITLE_CONTAINER_CODECS = {
+    "mp4": "mov_text",
+    "mov": "mov_text",
+    "webm": "webvtt",
+}
+
+# Loudness tolerance when deciding to copy already normalized audio
+PASSTHROUGH_LUFS_TOLERANCE = 1.0
+
+# NVENC self-test encodes one frame; anything slower means a hung driver (seconds)
+NVENC_TEST_TIMEOUT = 60
+
+# Steps that run an encoder and get -threads hints when pinned
+ENCODE_STAGES = {"single", "pass1", "pass2", "mezzanine"}
+
+# Estimated seconds of encode graph steps that the encode history does not cover
+DETECT_SECONDS = 5.0
+AUDIO_SECONDS_PER_SECOND = 0.02    # Loudness measurement, per audio track and second of source
+VERIFY_SECONDS = 3.0
+# Analysis steps (detection, loudness, verification) running at once
+ANALYSIS_SLOTS = 2
+
+def get_option_value(options: str, *names: str) -> Optional[str]:
+    """Return the value following the first of the given flags in an options string."""
+    tokens = options.split()
+    for i, token in enumerate(tokens[:-1]):
+        if token in names:
+            return tokens[i + 1]
+    return None
+
+def preset_crops(preset: dict) -> bool:
+    return str(preset.get('crop', 'auto')).strip().lower() == 'auto'
+
+def preset_mezzanine(preset: dict) -> str:
+    """Filtered intermediate mode of a preset: auto (measured), true or false."""
+    mode = str(preset.get('mezzanine', 'auto')).strip().lower()
+    return mode if mode in MEZZANINE_MODES else 'auto'
+
+def preset_passes(preset: dict) -> int:
+    return 2 if str(preset.get('2pass', 'true')).strip().lower() == 'true' else 1
+
+def preset_deinterlacer(preset: dict) -> Optional[str]:
+    """Deinterlacing filter a preset opted into (deinterlace=auto/bwdif/yadif), or None."""
+    return DEINTERLACERS.get(str(preset.get('deinterlace', 'false')).strip().lower())
 
 class O3Encoder:
     def __init__(self, input_file: str):
@@ -82,16 +161,93 @@ class O3Encoder:
         self.src_dir = Path(__file__).parent
         self.bin_dir = self.root_dir / "bin"
         
-        self.ffmpeg = os.path.join(self.bin_dir, "ffmpeg.exe")
-        self.ffprobe = os.path.join(self.bin_dir, "ffprobe.exe")
+        # Other builds, or the stand-in of fakeff.py, can be used instead of bin/
+        self.ffmpeg = os.environ.get("O3ENC_FFMPEG") or os.path.join(self.bin_dir, "ffmpeg.exe")
+        self.ffprobe = os.environ.get("O3ENC_FFPROBE") or os.path.join(self.bin_dir, "ffprobe.exe")
+        cache_dir = Path(os.environ.get("O3ENC_CACHE_DIR") or self.root_dir / "cache")
+        
+        # Per-preset stream copy decisions made by encode()
+        self.passthrough_decisions = {}
+        
+        # First-pass statistics kept between runs
+        self.pass_cache: Optional[FirstPassCache] = FirstPassCache(cache_dir / "firstpass")
+        
+        # Finished outputs by fingerprint; an identical job links the earlier file instead of encoding
+        self.output_cache: Optional[OutputCache] = OutputCache(cache_dir / "outputs.json")
+        self._ffmpeg_version: Optional[str] = None
+        
+        # Lossless renders of expensive filter chains (chain -> file), read by every pass using the chain
+        self.mezzanines: Dict[str, Path] = {}
+        self._chain_uses: collections.Counter = collections.Counter()
+        self._mezzanine_lock = threading.Lock()
+        
+        # Preset name -> (first-pass cache key, cache used, seconds) for passes run by run_first_pass()
+        self._first_passes: Dict[str, Tuple[Optional[str], bool, float]] = {}
+        
+        # Timings of finished encodes, used to predict how long the next ones take
+        self.history: Optional[EncodeHistory] = EncodeHistory(cache_dir / "history.db")
+        
+        # Every ffmpeg/ffprobe child is launched and supervised by the shared runner loop
+        self.runner = shared_runner()
+        
+        # Single ffprobe per file, shared by every analysis step
+        self.prober = MediaProbe(self.ffprobe, self.runner)
+        self.media_info = None
+        
+        # (start, duration) in seconds; duration None runs to the end of an input of unknown length
+        self.input_range: Optional[Tuple[float, Optional[float]]] = None
+        
+        # Set when frames arrive on stdin instead of from input_file
+        self.frame_format: Optional[FrameFormat] = None
+        self._stream_processes: List[RunningProcess] = []
+        
+        # Black bar crop shared by every preset with crop=auto; detected on first use
+        self.crop: Optional[CropEstimate] = None
+        self._crop_detected = False
+        
+        # Scan type for presets that deinterlace; detected on first use
+        self.scan: Optional[ScanEstimate] = None
+        
+        # Set when the input is a numbered PNG/TIFF/EXR frame sequence
+        self.sequence: Optional[ImageSequence] = None
+        self.sequence_prefetch = False
+        
+        # Status lines, ffmpeg's stats line and installer prompts; the library API (api.py) turns this off
+        self.interactive = True
+        
+        # Progress reporting and cancellation for callers running encodes in the background
+        self.progress_callback: Optional[Callable[[dict], None]] = None
+        # Several steps of one input may run at once (see build_encode_graph)
+        self._processes: Set[RunningProcess] = set()
+        self._cancelled = threading.Event()
+        # Cleared while suspended; new steps wait for it. Paused time is left out of step timings
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._pause_lock = threading.Lock()
+        self._paused_at: Optional[float] = None
+        self._paused_total = 0.0
+        # Volume slots, disk reservations and CPU partitions held by running steps; handed
+        # back while suspended. _frozen: the children are stopped; _pauses counts suspend()s
+        self._leases: List[Union[Lease, CpuLease]] = []
+        self._frozen = False
+        self._pauses = 0
+        
+        # Shared between encoders running concurrently; replaced by the caller when pooling jobs
+        self.disk_budget = DiskBudget()
+        self.throttle = VolumeThrottle()
+        
+        # CPU partition and priority of the ffmpeg children; set by callers running jobs side by side
+        self.cpu_allocator: Optional[CpuAllocator] = None
+        self.priority: ProcessPriority = NORMAL_PRIORITY
+        # Held per thread, so concurrent steps each keep their own partition
+        self._placement = threading.local()
         
         try:
-            self.temp_dir = Path(tempfile.gettempdir()) / "o3enc_temp"
-            if not self.temp_dir.exists():
-                self.temp_dir.mkdir(parents=True)
-                logger.info(f"Created temporary directory: {self.temp_dir}")
-            else:
-                logger.info(f"Using existing temporary directory: {self.temp_dir}")
+            # Each encoder gets its own scratch directory so concurrent jobs never collide
+            temp_root = Path(tempfile.gettempdir()) / "o3enc_temp"
+            temp_root.mkdir(parents=True, exist_ok=True)
+            self.temp_dir = Path(tempfile.mkdtemp(prefix="job_", dir=temp_root))
+            logger.info(f"Created temporary directory: {self.temp_dir}")
                 
         except Exception as e:
             raise InitializationError(f"Failed to setup temporary directory: {str(e)}")
@@ -108,32 +264,34 @@ class O3Encoder:
         except Exception as e:
             logger.error(f"Error during cleanup: {str(e)}")
 
-    def initialize_environment(self):
+    def initialize_environment(self, test_nvenc: bool = True, preset_file: Optional[Path] = None):
         logger.info("Initializing system environment...")
         
         with error_context("Failed to check required components", InitializationError):
             logger.info("Checking required components in bin directory...")
             self._check_required_components()
 
-        with error_context("CUDA functionality test failed", InitializationError):
-            logger.info("Testing CUDA functionality...")
-            self._test_cuda_functionality()
+        if test_nvenc:
+            with error_context("CUDA functionality test failed", InitializationError):
+                logger.info("Testing CUDA functionality...")
+                self._test_cuda_functionality()
 
         with error_context("Failed to load encoding presets", PresetError):
             logger.info("Loading encoding presets...")
-            self._initialize_presets()
+            self._initialize_presets(preset_file)
             
         logger.info("Initialization completed successfully")
 
     def _check_required_components(self):
         missing_tools = []
-        for tool in ["ffmpeg", "ffprobe"]:
-            exe_path = os.path.join(self.bin_dir, f"{tool}.exe")
+        for tool, exe_path in (("ffmpeg", self.ffmpeg), ("ffprobe", self.ffprobe)):
             if not os.path.exists(exe_path):
                 missing_tools.append(tool)
-                logger.warning(f"{tool}.exe not found in bin directory")
+                logger.warning(f"{tool} not found: {exe_path}")
 
         if missing_tools:
+            if not self.interactive:
+                raise InitializationError(f"Required tools are missing: {', '.join(missing_tools)}")
             print(f"\nRequired tools are missing: {', '.join(missing_tools)}")
             print("These tools need to be installed to continue.")
             
@@ -158,7 +316,7 @@ class O3Encoder:
                         f"Initialization script failed with return code: {process.returncode}"
                     )
                     
-                if not all(os.path.exists(os.path.join(self.bin_dir, f"{tool}.exe")) for tool in missing_tools):
+                if not all(os.path.exists(path) for path in (self.ffmpeg, self.ffprobe)):
                     raise InitializationError(
                         f"Failed to install required tools: {', '.join(missing_tools)}"
                     )
@@ -171,7 +329,7 @@ class O3Encoder:
                 )
 
     def _test_cuda_functionality(self):
-        nvenc_test = subprocess.run([
+        nvenc_test = self.runner.run([
             self.ffmpeg,
             "-f", "lavfi",
             "-i", "color=black:s=1280x720",
@@ -180,14 +338,14 @@ class O3Encoder:
             "-an",
             "-f", "null",
             "-"
-        ], capture_output=True, text=True)
+        ], timeout=NVENC_TEST_TIMEOUT)
         if nvenc_test.returncode != 0:
             raise InitializationError(
                 "NVIDIA NVENC encoder not available\n"
                 f"Error: {nvenc_test.stderr}"
             )
         logger.info("NVENC encoder test passed")
-        nvenc_params_test = subprocess.run([
+        nvenc_params_test = self.runner.run([
             self.ffmpeg,
             "-f", "lavfi",
             "-i", "color=black:s=1280x720",
@@ -198,7 +356,7 @@ class O3Encoder:
             "-an",
             "-f", "null",
             "-"
-        ], capture_output=True, text=True)
+        ], timeout=NVENC_TEST_TIMEOUT)
         if nvenc_params_test.returncode != 0:
             raise InitializationError(
                 "NVIDIA NVENC encoder with specific parameters not available\n"
@@ -206,101 +364,61 @@ class O3Encoder:
             )
         logger.info("NVENC encoder with parameters test passed")
 
-    def _initialize_presets(self):
-        self.preset_manager = PresetManager()
+    def _initialize_presets(self, preset_file: Optional[Path] = None):
+        self.preset_manager = PresetManager(preset_file)
         self.preset_manager.load_presets()
         preset_count = len(self.preset_manager.presets)
         logger.info(f"Loaded {preset_count} presets")
 
+    def use_sequence(self, sequence: ImageSequence, prefetch: Optional[bool] = None):
+        """Encode from an image sequence instead of a container file.
+        
+        With prefetch, frames are read ahead on a thread pool and piped to ffmpeg, which keeps
+        the encoder fed from network storage; by default it is enabled for network volumes.
+        """
+        self.sequence = sequence
+        self.input_file = sequence.pattern
+        # The first frame header and the file count stand in for ffprobe
+        self.media_info = sequence.media_info()
+        if prefetch is None:
+            prefetch = is_network_volume(sequence.directory)
+        self.sequence_prefetch = prefetch
+        if prefetch:
+            logger.info("Reading sequence frames ahead of the encoder")
+
+    def probe_input(self) -> MediaInfo:
+        """Probe the input once; every analysis step reuses this model."""
+        if self.media_info is None:
+            if not Path(self.input_file).exists():
+                raise VideoAnalysisError("Input file does not exist")
+            self.media_info = self.prober.probe(self.input_file)
+            logger.info(f"Probed streams: {len(self.media_info.video)} video, "
+                        f"{len(self.media_info.audio)} audio, {len(self.media_info.subtitle)} subtitle, "
+                        f"{self.media_info.attachments} attachment, {self.media_info.chapters} chapters")
+        return self.media_info
+
     def analyze_video(self) -> dict:
         logger.info("Starting video analysis...")
-        print("Analyzing input video file...\n")
+        self._echo("Analyzing input video file...\n")
         
         with error_context("Failed to analyze video file", VideoAnalysisError):
-            if not Path(self.input_file).exists():
-                raise VideoAnalysisError("Input file does not exist")
-                
-            cmd = [
-                self.ffprobe,
-                "-v", "quiet",
-                "-select_streams", "v:0",
-                "-print_format", "json",
-                "-show_entries", "stream=width,height,r_frame_rate,codec_name,duration,pix_fmt,"
-                "color_space,color_transfer,color_primaries,color_range,field_order,bit_rate",
-                self.input_file
-            ]
-            
-            try:
-                result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            except subprocess.CalledProcessError as e:
-                logger.error(f"FFprobe failed: {e.stderr}")
-                raise VideoAnalysisError(f"FFprobe failed: {e.stderr}")
+            if self.frame_format is not None:
+                # Streamed frames: the format is declared up front, the length is unknown
+                info = self.frame_format.video_info()
+            else:
+                info = self.probe_input().video_info()
             
-            try:
-                data = json.loads(result.stdout)
-                if not data.get("streams"):
-                    raise VideoAnalysisError("No video stream found in input file")
-                stream_data = data["streams"][0]
-                
-                # Validate required fields
-                required_fields = ["width", "height", "r_frame_rate", "codec_name"]
-                missing_fields = [field for field in required_fields if field not in stream_data]
-                if missing_fields:
-                    raise VideoAnalysisError(f"Missing required video information: {', '.join(missing_fields)}")
-                
-                # Calculate FPS
-                try:
-                    num, den = map(int, stream_data["r_frame_rate"].split("/"))
-                    if den == 0:
-                        raise ValueError("Invalid frame rate denominator (zero)")
-                    fps = num / den
-                    if fps <= 0:
-                        raise ValueError(f"Invalid frame rate: {fps} FPS")
-                except (ValueError, ZeroDivisionError) as e:
-                    raise VideoAnalysisError(f"Invalid frame rate format: {str(e)}")
-                
-                # Calculate file size
-                try:
-                    size_mb = Path(self.input_file).stat().st_size / (1024 * 1024)
-                except OSError as e:
-                    raise VideoAnalysisError(f"Failed to get file size: {e}")
-                
-                # Get duration
-                try:
-                    duration = float(stream_data.get("duration", 0))
-                    if duration <= 0:
-                        logger.warning("Invalid or missing duration in video stream")
-                        duration = 0
-                except (ValueError, TypeError):
-                    logger.warning("Could not parse duration value")
-                    duration = 0
-                
-                info = {
-                    "width": stream_data["width"],
-                    "height": stream_data["height"],
-                    "fps": fps,
-                    "duration": duration,
-                    "codec": stream_data["codec_name"],
-                    "pixfmt": stream_data.get("pix_fmt", "unknown"),
-                    "colorspace": stream_data.get("color_space", "unknown"),
-                    "colortrc": stream_data.get("color_transfer", "unknown"),
-                    "colorprim": stream_data.get("color_primaries", "unknown"),
-                    "colorrange": stream_data.get("color_range", "unknown"),
-                    "field_order": stream_data.get("field_order", "unknown"),
-                    "size_mb": size_mb
-                }
-                
-                if info["width"] <= 0 or info["height"] <= 0:
-                    raise VideoAnalysisError(f"Invalid video dimensions: {info['width']}x{info['height']}")
+            if info["fps"] <= 0:
+                raise VideoAnalysisError("Invalid frame rate format")
+            if info["duration"] <= 0 and self.frame_format is None:
+                logger.warning("Invalid or missing duration in video stream and container")
+            if info["width"] <= 0 or info["height"] <= 0:
+                raise VideoAnalysisError(f"Invalid video dimensions: {info['width']}x{info['height']}")
                 
+            if self.interactive:
                 self._print_video_info(info)
-                logger.info("Video analysis completed successfully")
-                return info
-                
-            except json.JSONDecodeError as e:
-                raise VideoAnalysisError(f"Failed to parse FFprobe output: {str(e)}")
-            except KeyError as e:
-                raise VideoAnalysisError(f"Missing required field in video data: {str(e)}")
+            logger.info("Video analysis completed successfully")
+            return info
 
     def get_color_settings(self, video_info: dict) -> tuple:
         logger.info("Getting color settings...")
@@ -319,6 +437,18 @@ class O3Encoder:
                 return colorspace, colorrange
 
             logger.info(f"No complete color information detected.")
+            estimate = self.detect_color(video_info)
+            if estimate is not None and estimate.confident:
+                self._print_color_estimate(estimate)
+                if estimate.colorspace != "auto":
+                    self._print_color_settings(video_info, estimate.colorspace, estimate.colorrange)
+                logger.info(f"Using sampled color settings: space={estimate.colorspace}, "
+                            f"range={estimate.colorrange}, confidence={estimate.confidence:.2f}")
+                return estimate.colorspace, estimate.colorrange
+            if estimate is not None:
+                print(f"\nAutomatic detection is unsure (confidence {estimate.confidence:.0%}): "
+                      f"suggests {estimate.colorspace}, {estimate.colorrange} range")
+                
             print("\nSelect input color space interpretation:")
             print("  -----------------------------------------------")
             print("  [0] Auto (No color space conversion)")
@@ -349,6 +479,146 @@ class O3Encoder:
         except Exception as e:
             raise EncodingError(f"Failed to get color settings: {str(e)}")
 
+    def frame_sampler(self, video_info: dict) -> Optional[FrameSampler]:
+        """Sampler decoding a few frames at seek points; None for streamed input, which cannot seek."""
+        if self.frame_format is not None:
+            return None
+        # Seek points are spread over the trimmed range only
+        offset = self.input_range[0] if self.input_range is not None else 0.0
+        return FrameSampler(self.ffmpeg, self.runner, lambda start: self._sample_input_args(offset + start),
+                            video_index=video_info.get("video_index", 0), on_start=self._placer())
+
+    def _sample_input_args(self, start: float) -> List[str]:
+        if self.sequence is not None:
+            # Always read sampled frames straight from the files, not through the prefetcher
+            return ["-ss", f"{start:.3f}", *self.sequence.input_args()]
+        return ["-ss", f"{start:.3f}", "-i", self.input_file]
+
+    def detect_color(self, video_info: dict) -> Optional[ColorEstimate]:
+        """Guess matrix and range from signalstats on sampled frames plus resolution/fps heuristics."""
+        sampler = self.frame_sampler(video_info)
+        if sampler is None:
+            return None
+        self._echo("Sampling frames to detect color settings...")
+        try:
+            samples = sampler.collect("signalstats,metadata=mode=print",
+                                      sample_starts(video_info.get("duration", 0.0)))
+        except OSError as e:
+            logger.warning(f"Color detection failed: {str(e)}")
+            return None
+        stats = [frame for lines in samples for frame in parse_frame_metadata(lines)]
+        estimate = estimate_color(video_info, stats)
+        logger.info(f"Color detection: space={estimate.colorspace}, range={estimate.colorrange}, "
+                    f"confidence={estimate.confidence:.2f} ({'; '.join(estimate.reasons)})")
+        return estimate
+
+    def detect_crop(self, video_info: dict) -> Optional[CropEstimate]:
+        """Black bar crop from cropdetect on sampled seek points; None when nothing is worth cropping."""
+        if self._crop_detected:
+            return self.crop
+        sampler = self.frame_sampler(video_info)
+        if sampler is None:
+            self.set_crop(None)
+            return None
+            
+        key = self._source_key()
+        found, crop = cached_crop(key)
+        if not found:
+            self._echo("Sampling frames to detect black bars...")
+            try:
+                samples = sampler.collect(crop_filter(), sample_starts(video_info.get("duration", 0.0)),
+                                          CROP_FRAMES)
+            except OSError as e:
+                logger.warning(f"Crop detection failed: {str(e)}")
+                samples = []
+            crop = vote_crop(video_info["width"], video_info["height"], [last_crop(lines) for lines in samples])
+            store_crop(key, crop)
+            
+        if crop is not None:
+            logger.info(f"Crop detected: {crop.filter} ({crop.agreement:.0%} of {crop.samples} samples agree)")
+        else:
+            logger.info("No black bars to crop")
+        self.set_crop(crop)
+        return crop
+
+    def set_trim(self, start: float, end: Optional[float], video_info: dict) -> dict:
+        """Encode only start..end seconds of the input (end None: to the end).
+        
+        Returns video_info describing the trimmed range, for every later step. Without
+        an end or a known duration the range stays open-ended and only seeks.
+        """
+        duration = float(video_info.get('duration') or 0)
+        if end is None and duration <= 0:
+            if start < 0:
+                raise VideoAnalysisError(f"Invalid trim start: {start:.3f}s")
+            self.input_range = (start, None)
+            logger.info(f"Trimming from {start:.3f}s to the end (duration unknown)")
+            return video_info
+        if end is None or (duration > 0 and end > duration):
+            end = duration
+        if start < 0 or end <= start:
+            raise VideoAnalysisError(f"Invalid trim range: {start:.3f}s to {end:.3f}s")
+        self.input_range = (start, end - start)
+        logger.info(f"Trimming to {start:.3f}s - {end:.3f}s ({end - start:.3f}s)")
+        return {**video_info, 'duration': end - start}
+
+    def set_crop(self, crop: Optional[CropEstimate]):
+        """Use a crop decided elsewhere (e.g. by a coordinator) instead of detecting one."""
+        self.crop = crop
+        self._crop_detected = True
+
+    def detect_scan(self, video_info: dict) -> ScanEstimate:
+        """Progressive, interlaced or telecined, from idet on sampled seek points."""
+        if self.scan is not None:
+            return self.scan
+        sampler = self.frame_sampler(video_info)
+        samples = []
+        if sampler is not None:
+            self._echo("Sampling frames to detect interlacing...")
+            try:
+                samples = [parse_idet(lines) for lines in
+                           sampler.collect("idet", sample_starts(video_info.get("duration", 0.0)), IDET_FRAMES)]
+            except OSError as e:
+                logger.warning(f"Interlace detection failed: {str(e)}")
+        self.scan = classify_scan(video_info, samples)
+        logger.info(f"Scan type: {self.scan.kind} ({self.scan.field_order}, "
+                    f"{self.scan.interlaced_share:.0%} combed, {self.scan.repeated_share:.0%} repeated fields "
+                    f"in {self.scan.frames} frames)")
+        return self.scan
+
+    def _preset_deinterlace(self, preset: dict, video_info: dict) -> str:
+        deinterlacer = preset_deinterlacer(preset)
+        if deinterlacer is None:
+            return ""
+        return self.detect_scan(video_info).filter(deinterlacer)
+
+    def output_fps(self, preset: dict, video_info: dict) -> float:
+        """Output frame rate, taking inverse telecine into account."""
+        if preset.get('fps') or preset_deinterlacer(preset) is None:
+            return get_output_fps(preset, video_info)
+        return float(video_info['fps']) * self.detect_scan(video_info).fps_factor
+
+    def _source_key(self) -> tuple:
+        if self.sequence is not None:
+            return (self.sequence.pattern, self.sequence.frame_count, self.sequence.first_size)
+        stat = os.stat(self.input_file)
+        return (str(Path(self.input_file).resolve()), stat.st_size, stat.st_mtime_ns)
+
+    def _preset_crop(self, preset: dict, video_info: dict) -> Optional[CropEstimate]:
+        if not preset_crops(preset):
+            return None
+        return self.detect_crop(video_info)
+
+    def _print_color_estimate(self, estimate: ColorEstimate):
+        print("\nDetected Color Settings:")
+        print("----------------------------------------")
+        print(f"Color Space : {estimate.colorspace}")
+        print(f"Color Range : {estimate.colorrange}")
+        print(f"Confidence  : {estimate.confidence:.0%} ({estimate.frames} frames sampled)")
+        for reason in estimate.reasons:
+            print(f"  - {reason}")
+        print("----------------------------------------")
+
     def _get_user_color_space(self) -> str:
         while True:
             try:
@@ -434,115 +704,170 @@ class O3Encoder:
         print("----------------------------------------")
         print()
 
-    def analyze_audio(self, preset: dict) -> Optional[dict]:
-       logger.info("Starting audio analysis...")
-       print("\nAnalyzing audio levels...")
-       
-       with error_context("Failed to analyze audio", AudioAnalysisError):
-           if not isinstance(preset, dict):
-               raise AudioAnalysisError("Invalid preset format")
-               
-           # Check if file has audio
-           cmd = [
-               self.ffprobe,
-               "-v", "error", 
-               "-select_streams", "a",
-               "-show_entries", "stream=codec_name",
-               "-of", "csv=p=0",
-               self.input_file
-           ]
-           
-           try:
-               result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', check=True)
-           except subprocess.CalledProcessError as e:
-               raise AudioAnalysisError(f"Failed to probe audio stream: {e.stderr}")
-               
-           if not result.stdout.strip():
-               logger.info("No audio track detected")
-               print("No audio track detected - skipping audio processing")
-               return None
-               
-           # Get target values from preset
-           try:
-               target_lufs = float(preset.get("target_lufs", -18))
-               target_lra = float(preset.get("target_lra", 7))
-               target_tp = float(preset.get("target_tp", -2))
-           except (ValueError, TypeError) as e:
-               raise AudioAnalysisError(f"Invalid audio target values in preset: {str(e)}")
-               
-           # Analyze audio levels
-           cmd = [
-               self.ffmpeg,
-               "-v", "info",
-               "-stats",
-               "-i", self.input_file,
-               "-af", f"loudnorm=I={target_lufs}:LRA={target_lra}:TP={target_tp}:print_format=json",
-               "-f", "null", "-"
-           ]
-           
-           try:
-               process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                                       universal_newlines=True, encoding='utf-8')
-               
-               stderr_lines = []
-               while True:
-                   line = process.stderr.readline()
-                   if not line and process.poll() is not None:
-                       break
-                   if line.startswith("frame="):
-                       print(f"\r{line.strip()}", end='', flush=True)
-                   else:
-                       stderr_lines.append(line)
-               
-               print()  
-               process.wait()
-               if process.returncode != 0:
-                   raise AudioAnalysisError(f"Audio analysis failed")
-               
-               stderr = ''.join(stderr_lines)
-               json_start = stderr.find("{")
-               json_end = stderr.rfind("}") + 1
-               if json_start == -1 or json_end == 0:
-                   raise AudioAnalysisError("Audio analysis data not found in output")
-               
-               json_str = stderr[json_start:json_end]
-               data = json.loads(json_str)
-               
-               required_fields = ["input_i", "input_lra", "input_tp", "input_thresh", "target_offset"]
-               missing_fields = [field for field in required_fields if field not in data]
-               if missing_fields:
-                   raise AudioAnalysisError(f"Missing audio analysis data: {', '.join(missing_fields)}")
-               
-               try:
-                   audio_info = {
-                       "input_i": float(data["input_i"]),
-                       "input_lra": float(data["input_lra"]),
-                       "input_tp": float(data["input_tp"]),
-                       "input_thresh": float(data["input_thresh"]),
-                       "target_offset": float(data["target_offset"])
-                   }
-                   
-                   # Check for invalid measurements (-inf values)
-                   if (audio_info["input_i"] == float("-inf") or 
-                       audio_info["input_tp"] == float("-inf")):
-                       logger.info("Invalid audio measurements detected - skipping audio processing")
-                       print("\nInvalid audio measurements - skipping audio normalization")
-                       return None
-                       
-                   self._print_audio_info(audio_info, target_lufs, target_lra, target_tp)
-                   logger.info("Audio analysis completed successfully")
-                   return audio_info
-                   
-               except (ValueError, TypeError) as e:
-                   raise AudioAnalysisError(f"Invalid audio measurement values: {str(e)}")
-               
-           except json.JSONDecodeError as e:
-               raise AudioAnalysisError(f"Failed to parse audio analysis data: {str(e)}")
-           except subprocess.CalledProcessError as e:
-               raise AudioAnalysisError(f"Audio analysis process failed: {e.stderr}")
+    def analyze_audio(self, preset: dict) -> Optional[List[dict]]:
+        logger.info("Starting audio analysis...")
+        self._echo("\nAnalyzing audio levels...")
+        
+        with error_context("Failed to analyze audio", AudioAnalysisError):
+            if not isinstance(preset, dict):
+                raise AudioAnalysisError("Invalid preset format")
+                
+            tracks = [track.as_track() for track in self.probe_input().audio]
+            if not tracks:
+                logger.info("No audio track detected")
+                self._echo("No audio track detected - skipping audio processing")
+                return None
+                
+            # Get target values from preset
+            try:
+                target_lufs = float(preset.get("target_lufs", -18))
+                target_lra = float(preset.get("target_lra", 7))
+                target_tp = float(preset.get("target_tp", -2))
+            except (ValueError, TypeError) as e:
+                raise AudioAnalysisError(f"Invalid audio target values in preset: {str(e)}")
+                
+            # Each track is measured by its own ffmpeg process, all driven from the runner loop
+            self._echo(f"Measuring {len(tracks)} audio track(s)...")
+            measurements = self.runner.call(
+                self._measure_audio_tracks(tracks, target_lufs, target_lra, target_tp)
+            )
+            for track, measurement in zip(tracks, measurements):
+                if measurement is None:
+                    logger.info(f"Invalid audio measurements on track {track['index']} - "
+                                "track will not be normalized")
+                    self._echo(f"\nTrack {track['index']}: invalid audio measurements - "
+                          "skipping audio normalization")
+                    continue
+                track.update(measurement)
+                    
+            for track in tracks:
+                if "input_i" in track and self.interactive:
+                    self._print_audio_info(track, target_lufs, target_lra, target_tp)
+            logger.info("Audio analysis completed successfully")
+            return tracks
+
+    async def _measure_audio_tracks(self, tracks: List[dict], target_lufs: float, target_lra: float,
+                                    target_tp: float) -> List[Optional[dict]]:
+        cpu_set = self._cpu_set
+        processes = len(cpu_set.cpus) if cpu_set is not None else os.cpu_count() or 1
+        limit = asyncio.Semaphore(processes)
+        shards = self._loudness_shards(processes)
+        
+        async def measure(track: dict) -> Optional[dict]:
+            if shards:
+                try:
+                    return await self._measure_audio_shards(track["index"], shards, limit)
+                except AudioAnalysisError as e:
+                    logger.warning(f"Sharded loudness measurement failed on track {track['index']}, "
+                                   f"measuring in one pass: {str(e)}")
+            async with limit:
+                return await self._measure_audio_track(track["index"], target_lufs, target_lra, target_tp)
+                
+        tasks = [asyncio.create_task(measure(track)) for track in tracks]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            # One track failed: stop the measurements still running
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def _loudness_shards(self, processes: int) -> List[Shard]:
+        """Time shards for measuring each track in parallel; empty when one process is better."""
+        if self.sequence is not None or self.frame_format is not None:
+            return []
+        duration = self._range_duration(self.probe_input().duration)
+        count = min(processes, int(duration // MIN_SHARD_SECONDS))
+        return plan_shards(duration, count) if count > 1 else []
+
+    async def _measure_audio_shards(self, track_index: int, shards: List[Shard],
+                                    limit: asyncio.Semaphore) -> Optional[dict]:
+        """Block loudness of every shard from its own ffmpeg process, merged into one measurement."""
+        range_start = self.input_range[0] if self.input_range is not None else 0.0
+        duration = self._range_duration(self.probe_input().duration)
+        
+        async def measure(shard: Shard) -> ShardReader:
+            reader = ShardReader(shard)
+            cmd = shard_command(self.ffmpeg, self.input_file, track_index, shard, range_start, duration,
+                                whole_file=self._range_duration(None) is None)
+            async with limit:
+                try:
+                    process = await self.runner.execute(cmd, stdout_callback=reader, keep_output=False,
+                                                        on_start=self._placer())
+                except OSError as e:
+                    raise AudioAnalysisError(f"Loudness shard process failed: {str(e)}")
+            if process.returncode != 0:
+                raise AudioAnalysisError(f"Loudness shard at {shard.read_start:.1f}s failed "
+                                         f"(exit code {process.returncode})")
+            if not reader.momentary:
+                raise AudioAnalysisError(f"No loudness data from shard at {shard.read_start:.1f}s")
+            return reader
+        
+        tasks = [asyncio.create_task(measure(shard)) for shard in shards]
+        try:
+            readers = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        measurement = merge_shards(readers)
+        if measurement is not None:
+            self._echo(f"Track {track_index}: measured in {len(shards)} parallel shards")
+        return measurement
+
+    async def _measure_audio_track(self, track_index: int, target_lufs: float, target_lra: float,
+                                   target_tp: float) -> Optional[dict]:
+        cmd = [
+            self.ffmpeg,
+            "-v", "info",
+            "-nostats",
+            *self._range_args(),
+            "-i", self.input_file,
+            "-map", f"0:a:{track_index}",
+            "-af", f"loudnorm=I={target_lufs}:LRA={target_lra}:TP={target_tp}:print_format=json",
+            "-f", "null", "-"
+        ]
+        
+        try:
+            process = await self.runner.execute(cmd, on_start=self._placer())
+        except OSError as e:
+            raise AudioAnalysisError(f"Audio analysis process failed on track {track_index}: {str(e)}")
+        if process.returncode != 0:
+            raise AudioAnalysisError(f"Audio analysis failed on track {track_index}")
+            
+        stderr = process.stderr
+        json_start = stderr.rfind("{")
+        json_end = stderr.rfind("}") + 1
+        if json_start == -1 or json_end == 0:
+            raise AudioAnalysisError(f"Audio analysis data not found in output for track {track_index}")
+            
+        try:
+            data = json.loads(stderr[json_start:json_end])
+        except json.JSONDecodeError as e:
+            raise AudioAnalysisError(f"Failed to parse audio analysis data: {str(e)}")
+            
+        required_fields = ["input_i", "input_lra", "input_tp", "input_thresh", "target_offset"]
+        missing_fields = [field for field in required_fields if field not in data]
+        if missing_fields:
+            raise AudioAnalysisError(f"Missing audio analysis data: {', '.join(missing_fields)}")
+            
+        try:
+            measurement = {field: float(data[field]) for field in required_fields}
+        except (ValueError, TypeError) as e:
+            raise AudioAnalysisError(f"Invalid audio measurement values: {str(e)}")
+            
+        # Check for invalid measurements (-inf values)
+        if (measurement["input_i"] == float("-inf") or
+                measurement["input_tp"] == float("-inf")):
+            return None
+            
+        self._echo(f"Track {track_index}: measured")
+        return measurement
 
     def _print_audio_info(self, audio_info: dict, target_lufs: float, target_lra: float, target_tp: float):
-        print("\nAudio Analysis Results:")
+        print(f"\nAudio Analysis Results (Track {audio_info['index']}, {audio_info['language']}):")
         print("  -------------------------------------")
         print(f"  Target LUFS     : {target_lufs} LUFS")
         print(f"  Target LRA      : {target_lra} LU")
@@ -553,35 +878,37 @@ class O3Encoder:
         print(f"  True Peak Level : {audio_info['input_tp']:.1f} dB")
         print("  -------------------------------------")
 
-    def encode(self, preset: dict, output_file: Path, color_filters: str, audio_info: Optional[dict], video_info: dict) -> bool:
+    def encode(self, preset: dict, output_file: Path, color_filters: str, audio_info: Optional[List[dict]], video_info: dict) -> bool:
         logger.info(f"Starting encoding process for preset: {preset.get('name', 'unknown')}")
         with error_context("Encoding failed", EncodingError):
             self._validate_encoding_inputs(preset, output_file, video_info)
+            started = self._clock()
             
             try:
                 # Build video filter chain safely
                 filters = self._build_filter_chain(preset, video_info, color_filters)
                 filter_chain = ",".join(filters)
                 
-                # Configure audio parameters based on presence of audio track
-                audio_params = []
-                if audio_info is not None:
-                    audio_filter = self._build_audio_filter(preset, audio_info)
-                    audio_params = [
-                        "-c:a", preset['audio_codec'],
-                        "-b:a", preset['audio_bitrate'],
-                        "-ac", "2",
-                        "-af", audio_filter
-                    ]
-                else:
-                    # Remove audio stream if no audio track is present
-                    audio_params = ["-an"]
+                fingerprint = self._output_fingerprint(preset, filter_chain, color_filters)
+                if fingerprint is not None and self._reuse_output(fingerprint, output_file):
+                    self.passthrough_decisions.pop(preset['name'], None)
+                    self._first_passes.pop(preset['name'], None)
+                    self._consume_chain(filter_chain, preset_passes(preset))
+                    self._release_mezzanine(filter_chain)
+                    return True
+                    
+                passthrough = self.plan_passthrough(preset, video_info, audio_info, color_filters)
+                self.passthrough_decisions[preset['name']] = passthrough
+                
+                # Map video, selected audio tracks, subtitles and chapters
+                stream_params = self._build_stream_params(preset, audio_info, passthrough)
                 
                 # Get hardware acceleration options
                 hwaccel_opts = self._get_hwaccel_options(preset)
                 
-                print(f"\nProcessing Preset: [{preset['name']}]")
-                print("----------------------------------------")
+                self._echo(f"\nProcessing Preset: [{preset['name']}]")
+                self._echo("----------------------------------------")
+                self._print_passthrough(passthrough)
                 
                 # Parse 2pass encoding setting from preset
                 two_pass_value = preset.get('2pass', 'true')
@@ -590,25 +917,36 @@ class O3Encoder:
                 use_2pass = str(two_pass_value).strip().lower() == 'true'
                 logger.info(f"Processed 2pass value: {use_2pass}")
                 
-                if use_2pass:
-                    # Run first pass if two-pass encoding is enabled
-                    logger.info("Starting two-pass encoding")
-                    success = self._run_first_pass(preset, hwaccel_opts, filter_chain)
-                    if not success:
-                        raise EncodingError("First pass encoding failed")
-                    
-                    # Run second pass with audio processing if available
-                    success = self._run_second_pass(preset, hwaccel_opts, filter_chain, 
-                                               audio_params, output_file)
-                    if not success:
-                        raise EncodingError("Second pass encoding failed")
-                else:
-                    # Run single pass encoding
-                    logger.info("Starting single-pass encoding")
-                    success = self._run_single_pass(preset, hwaccel_opts, filter_chain, 
-                                               audio_params, output_file)
-                    if not success:
-                        raise EncodingError("Single pass encoding failed")
+                # Reserve estimated output/scratch space and wait for a free slot on busy volumes
+                estimate = estimate_job(preset, video_info, max(1, len(self._select_audio_tracks(preset, audio_info))))
+                io_paths = [output_file.parent, self.temp_dir]
+                with self._leased(self.disk_budget.reservation(output_file.parent, self.temp_dir, estimate),
+                                  self.throttle.acquire(io_paths)), self._cpu_slot():
+                    trimmed = False
+                    if passthrough['video_copy'] and self._range_duration(None) is not None:
+                        # Cut points rarely fall on keyframes: copy the whole GOPs, encode the ends
+                        trimmed = self._run_smart_trim(preset, passthrough, audio_info, output_file, video_info)
+                        if not trimmed:
+                            passthrough['video_copy'] = passthrough['remux'] = False
+                    if passthrough['video_copy']:
+                        # Source video already matches the preset, no passes needed
+                        logger.info("Starting stream copy" + (" (remux)" if passthrough['remux'] else ""))
+                        self._consume_chain(filter_chain, preset_passes(preset))
+                        self._release_mezzanine(filter_chain)
+                        if not trimmed and not self._run_video_copy(stream_params, output_file):
+                            raise EncodingError("Stream copy failed")
+                    elif use_2pass:
+                        # Second pass runs with audio processing if available
+                        logger.info("Starting two-pass encoding")
+                        self._run_two_pass(preset, hwaccel_opts, filter_chain, stream_params, output_file,
+                                           video_info)
+                    else:
+                        # Run single pass encoding
+                        logger.info("Starting single-pass encoding")
+                        success = self._run_single_pass(preset, hwaccel_opts, filter_chain, 
+                                                   stream_params, output_file, video_info)
+                        if not success:
+                            raise EncodingError("Single pass encoding failed")
                 
                 # Verify output file
                 if not output_file.exists():
@@ -619,8 +957,13 @@ class O3Encoder:
                     raise EncodingError("Output file is empty")
                 
                 # Force cleanup of FFmpeg logs after encoding
-                self.cleanup()
+                self._remove_pass_logs(preset)
                 
+                if fingerprint is not None:
+                    self.output_cache.record(fingerprint, output_file)
+                self._record_history(preset, video_info, started, True,
+                                     "copy" if passthrough['video_copy'] else "encode")
+                    
                 logger.info(f"Encoding completed successfully: {output_file}")
                 return True
                 
@@ -634,11 +977,128 @@ class O3Encoder:
                         
                 # Try to clean up logs even if encoding failed
                 try:
-                    self.cleanup()
+                    self._remove_pass_logs(preset)
                 except Exception as cleanup_err:
                     logger.error(f"Failed to clean up FFmpeg logs after error: {cleanup_err}")
+                self._record_history(preset, video_info, started, False)
                 raise
 
+    def plan_passthrough(self, preset: dict, video_info: dict, audio_info: Optional[List[dict]],
+                         color_filters: str) -> dict:
+        """Decide which streams can be copied instead of re-encoded for a preset."""
+        decision = {
+            'video_copy': False,
+            'audio_copy': False,
+            'audio_copy_tracks': [],
+            'remux': False,
+            'video_reasons': [],
+            'audio_reasons': []
+        }
+        
+        if str(preset.get('passthrough', 'true')).strip().lower() != 'true':
+            decision['video_reasons'].append("passthrough disabled in preset")
+            decision['audio_reasons'].append("passthrough disabled in preset")
+            return decision
+            
+        container = str(preset.get('container', '')).lower()
+        allowed_codecs = CONTAINER_CODECS.get(container, set())
+        
+        # Video: the preset must add nothing the source does not already have
+        video_reasons = decision['video_reasons']
+        target_codec = VIDEO_ENCODER_CODECS.get(preset.get('encoder'))
+        if target_codec is None or video_info.get('codec') != target_codec:
+            video_reasons.append(f"codec {video_info.get('codec')} -> {preset.get('encoder')}")
+        if video_info.get('pixfmt') != preset.get('pixfmt'):
+            video_reasons.append(f"pixel format {video_info.get('pixfmt')} -> {preset.get('pixfmt')}")
+        if preset.get('height'):
+            try:
+                if int(preset['height']) != video_info.get('height'):
+                    video_reasons.append(f"height {video_info.get('height')} -> {preset['height']}")
+            except ValueError:
+                video_reasons.append("invalid preset height")
+        if preset.get('fps'):
+            try:
+                if abs(float(preset['fps']) - float(video_info.get('fps', 0))) > 0.01:
+                    video_reasons.append(f"frame rate {video_info.get('fps', 0):.2f} -> {preset['fps']}")
+            except (ValueError, TypeError):
+                video_reasons.append("invalid preset fps")
+        if color_filters:
+            video_reasons.append("color conversion required")
+        crop = self._preset_crop(preset, video_info)
+        if crop is not None:
+            video_reasons.append(f"black bars to crop ({crop.width}x{crop.height})")
+        if self._preset_deinterlace(preset, video_info):
+            video_reasons.append(f"{self.scan.kind} source needs deinterlacing")
+        target_bitrate = parse_bitrate(get_option_value(preset.get('options', ''), '-b:v', '-b'))
+        if target_bitrate is None:
+            video_reasons.append("preset has no target bitrate to compare against")
+        elif not video_info.get('bit_rate'):
+            video_reasons.append("source bitrate unknown")
+        elif video_info['bit_rate'] > target_bitrate:
+            video_reasons.append(f"bitrate {video_info['bit_rate'] // 1000}k > {target_bitrate // 1000}k")
+        if allowed_codecs is not None and video_info.get('codec') not in allowed_codecs:
+            video_reasons.append(f"{video_info.get('codec')} not supported in {container}")
+        decision['video_copy'] = not video_reasons
+        
+        # Audio: same codec, within bitrate and channel budget, already normalized
+        audio_reasons = decision['audio_reasons']
+        tracks = self._select_audio_tracks(preset, audio_info)
+        if not tracks:
+            audio_reasons.append("no audio to process")
+        for track in tracks:
+            track_reasons = self._audio_copy_blockers(preset, track, container, allowed_codecs)
+            if track_reasons:
+                audio_reasons.extend(f"track {track['index']}: {reason}" for reason in track_reasons)
+            else:
+                decision['audio_copy_tracks'].append(track['index'])
+        decision['audio_copy'] = bool(tracks) and len(decision['audio_copy_tracks']) == len(tracks)
+        
+        decision['remux'] = decision['video_copy'] and (not tracks or decision['audio_copy'])
+        logger.info(f"Passthrough decision for {preset.get('name', 'unknown')}: "
+                    f"video_copy={decision['video_copy']}, audio_copy={decision['audio_copy']}, "
+                    f"remux={decision['remux']}")
+        return decision
+
+    def _audio_copy_blockers(self, preset: dict, track: dict, container: str,
+                             allowed_codecs: Optional[set]) -> List[str]:
+        reasons = []
+        target_codec = AUDIO_ENCODER_CODECS.get(preset.get('audio_codec'))
+        if target_codec is None or track.get('codec') != target_codec:
+            reasons.append(f"codec {track.get('codec')} -> {preset.get('audio_codec')}")
+        target_channels = str(preset.get('audio_channels', '2')).strip()
+        if target_channels:
+            try:
+                if track.get('channels', 0) > int(target_channels):
+                    reasons.append(f"{track['channels']} channels -> {target_channels}")
+            except ValueError:
+                reasons.append("invalid preset audio_channels")
+        target_bitrate = parse_bitrate(preset.get('audio_bitrate'))
+        if not track.get('bit_rate') or target_bitrate is None:
+            reasons.append("audio bitrate unknown")
+        elif track['bit_rate'] > target_bitrate:
+            reasons.append(f"bitrate {track['bit_rate'] // 1000}k > {target_bitrate // 1000}k")
+        try:
+            if abs(track['input_i'] - float(preset['target_lufs'])) > PASSTHROUGH_LUFS_TOLERANCE:
+                reasons.append(f"loudness {track['input_i']:.1f} LUFS -> {preset['target_lufs']} LUFS")
+            if track['input_tp'] > float(preset['target_tp']):
+                reasons.append(f"true peak {track['input_tp']:.1f} dB > {preset['target_tp']} dB")
+        except (KeyError, ValueError, TypeError):
+            reasons.append("loudness targets unavailable")
+        if allowed_codecs is not None and track.get('codec') not in allowed_codecs:
+            reasons.append(f"{track.get('codec')} not supported in {container}")
+        return reasons
+
+    def _print_passthrough(self, decision: dict):
+        if decision['remux']:
+            self._echo("Passthrough: source already matches preset - remuxing without re-encoding")
+        elif decision['video_copy']:
+            self._echo("Passthrough: video stream copied (video encode skipped)")
+        elif decision['audio_copy']:
+            self._echo("Passthrough: audio streams copied (audio encode skipped)")
+        elif decision['audio_copy_tracks']:
+            tracks = ', '.join(str(index) for index in decision['audio_copy_tracks'])
+            self._echo(f"Passthrough: audio track(s) {tracks} copied")
+
     def _validate_encoding_inputs(self, preset: dict, output_file: Path, video_info: dict):
         if not isinstance(preset, dict):
             raise EncodingError("Invalid preset format")
@@ -664,13 +1124,20 @@ class O3Encoder:
 
     def _build_filter_chain(self, preset: dict, video_info: dict, color_filters: str) -> List[str]:
         try:
-            filters = [f"format={preset['pixfmt']}"]
+            # Fields are rebuilt on the full frame; cropping next keeps the black bars out of every later filter
+            deinterlace = self._preset_deinterlace(preset, video_info)
+            filters = [deinterlace] if deinterlace else []
+            crop = self._preset_crop(preset, video_info)
+            if crop:
+                filters.append(crop.filter)
+            filters.append(f"format={preset['pixfmt']}")
+            source_height = crop.height if crop else video_info['height']
             
             # Add scaling if needed
             if preset.get('height'):
                 try:
                     target_height = int(preset['height'])
-                    if target_height != video_info['height']:
+                    if target_height != source_height:
                         scale_flags = preset.get('scale_flags', 'lanczos')
                         filters.append(f"scale=-1:{target_height}:flags={scale_flags}")
                 except ValueError as e:
@@ -681,6 +1148,8 @@ class O3Encoder:
                 try:
                     target_fps = float(preset['fps'])
                     current_fps = float(video_info['fps'])
+                    if deinterlace:
+                        current_fps *= self.scan.fps_factor
                     if abs(target_fps - current_fps) > 0.01:
                         filters.append(f"fps={preset['fps']}")
                 except (ValueError, TypeError) as e:
@@ -723,96 +1192,939 @@ class O3Encoder:
         except (KeyError, ValueError) as e:
             raise EncodingError(f"Failed to build audio filter: {str(e)}")
 
+    def _select_audio_tracks(self, preset: dict, audio_info: Optional[List[dict]]) -> List[dict]:
+        """Pick the audio tracks a preset keeps, by index or language ('all' keeps every track)."""
+        if not audio_info:
+            return []
+        selection = str(preset.get('audio_tracks', 'all')).strip().lower()
+        if not selection or selection == 'all':
+            return list(audio_info)
+            
+        wanted = [item.strip() for item in selection.split(',') if item.strip()]
+        selected = []
+        for track in audio_info:
+            if str(track['index']) in wanted or str(track.get('language', '')).lower() in wanted:
+                selected.append(track)
+        if not selected:
+            logger.warning(f"No audio track matches audio_tracks={selection} - keeping all tracks")
+            return list(audio_info)
+        return selected
+
+    def _build_stream_params(self, preset: dict, audio_info: Optional[List[dict]],
+                             passthrough: dict, source_input: int = 0,
+                             video_map: Optional[str] = None) -> List[str]:
+        """Stream mapping for the output; source_input is the ffmpeg input holding audio/subtitles."""
+        if video_map is None:
+            video = self.probe_input().primary_video
+            video_map = f"0:v:{video.index if video else 0}"
+        params = ["-map", video_map]
+        
+        tracks = self._select_audio_tracks(preset, audio_info)
+        if not tracks:
+            # Remove audio stream if no audio track is present
+            params.append("-an")
+        channels = str(preset.get('audio_channels', '2')).strip()
+        for out_index, track in enumerate(tracks):
+            params += ["-map", f"{source_input}:a:{track['index']}"]
+            if track['index'] in passthrough['audio_copy_tracks']:
+                params += [f"-c:a:{out_index}", "copy"]
+                continue
+            params += [
+                f"-c:a:{out_index}", preset['audio_codec'],
+                f"-b:a:{out_index}", preset['audio_bitrate']
+            ]
+            if channels:
+                params += [f"-ac:a:{out_index}", channels]
+            if "input_i" in track:
+                params += [f"-filter:a:{out_index}", self._build_audio_filter(preset, track)]
+                
+        params += self._build_subtitle_params(preset, source_input)
+        params += ["-map_metadata", str(source_input), "-map_chapters", str(source_input)]
+        return params
+
+    def _build_subtitle_params(self, preset: dict, source_input: int = 0) -> List[str]:
+        if str(preset.get('subtitles', 'true')).strip().lower() != 'true':
+            return ["-sn"]
+            
+        media = self.probe_input()
+        container = str(preset.get('container', '')).lower()
+        params = []
+        out_index = 0
+        for subtitle in media.subtitle:
+            if container == "mkv":
+                codec = "copy"
+            elif subtitle.codec not in TEXT_SUBTITLE_CODECS:
+                logger.warning(f"Dropping subtitle track {subtitle.index} ({subtitle.codec}): "
+                               f"bitmap subtitles are not supported in {container}")
+                continue
+            elif container in SUBTITLE_CONTAINER_CODECS:
+                codec = SUBTITLE_CONTAINER_CODECS[container]
+            else:
+                logger.warning(f"Dropping subtitle track {subtitle.index}: "
+                               f"subtitles are not supported in {container}")
+                continue
+            params += ["-map", f"{source_input}:s:{subtitle.index}", f"-c:s:{out_index}", codec]
+            out_index += 1
+            
+        # Fonts used by ASS subtitles travel as attachments
+        if container == "mkv" and media.attachments:
+            params += ["-map", f"{source_input}:t", "-c:t", "copy"]
+        return params
+
+    def _input_args(self) -> List[str]:
+        if self.frame_format is not None:
+            return self.frame_format.input_args()
+        if self.sequence is not None and self.sequence_prefetch:
+            # The prefetcher feeds only the frames of input_range
+            return self.sequence.input_args(prefetch=True)
+        if self.sequence is not None:
+            return self._range_args() + self.sequence.input_args()
+        return self._range_args() + ["-i", self.input_file]
+
+    def _range_args(self) -> List[str]:
+        """Seek and duration of input_range, placed before an -i of the source."""
+        if self.input_range is None:
+            return []
+        # Input-side seek is frame accurate when transcoding
+        start, duration = self.input_range
+        if duration is None:
+            return ["-ss", f"{start:.6f}"]
+        return ["-ss", f"{start:.6f}", "-t", f"{duration:.6f}"]
+
+    def _range_duration(self, whole: Optional[float]) -> Optional[float]:
+        """Seconds in input_range; whole (the input's length) when it runs to the end."""
+        if self.input_range is None or self.input_range[1] is None:
+            return whole
+        return self.input_range[1]
+
+    def _sequence_feed(self) -> Optional[Callable]:
+        """stdin_feed streaming the prefetched frames of the encoded range."""
+        if self.sequence is None or not self.sequence_prefetch:
+            return None
+        first, count = 0, None
+        if self.input_range is not None:
+            fps = float(self.sequence.fps)
+            start, duration = self.input_range
+            first = round(start * fps)
+            count = max(1, round(duration * fps)) if duration is not None else None
+        return SequencePrefetcher(self.sequence, first=first, count=count).feed
+
+    def start_stream_encode(self, preset: dict, output_file: Path, color_filters: str, video_info: dict,
+                            stdin_feed: Callable) -> RunningProcess:
+        """Start a single-pass encode of frames written to ffmpeg's stdin by stdin_feed."""
+        logger.info(f"Starting streamed encoding for preset: {preset.get('name', 'unknown')}")
+        with error_context("Encoding failed", EncodingError):
+            self._validate_encoding_inputs(preset, output_file, video_info)
+            if str(preset.get('2pass', 'true')).strip().lower() == 'true':
+                # The stream can only be read once
+                logger.warning(f"Preset {preset['name']}: streamed input is encoded in a single pass")
+            filter_chain = ",".join(self._build_filter_chain(preset, video_info, color_filters))
+            cmd = [
+                self.ffmpeg,
+                "-y",
+                "-loglevel", "warning",
+                "-nostats",
+                *self._input_args(),
+                "-c:v", preset['encoder'],
+                *preset['options'].split(),
+                "-vf", filter_chain,
+                "-map", "0:v:0", "-an", "-sn", "-dn",
+                str(output_file)
+            ]
+            self._echo(f"ffmpeg {' '.join(cmd[1:])}\n")
+            
+            name = preset['name']
+            options = {}
+            if self.progress_callback is not None:
+                cmd[-1:-1] = ["-progress", "pipe:1"]
+                options["stdout_callback"] = self._progress_reader(name)
+            process = self.runner.start(
+                cmd,
+                stderr_callback=lambda line: line.strip() and logger.warning(f"[{name}] {line.strip()}"),
+                keep_output=False,
+                stdin_feed=stdin_feed,
+                on_start=self._placer(),
+                **options
+            )
+            self._stream_processes.append(process)
+            return process
+
+    def encode_video_segment(self, preset: dict, output_file: Path, color_filters: str,
+                             video_info: dict) -> bool:
+        """Encode only the video of input_range into output_file, for later concatenation."""
+        logger.info(f"Encoding segment {self.input_range} for preset {preset['name']}")
+        with error_context("Segment encoding failed", EncodingError):
+            self._validate_encoding_inputs(preset, output_file, video_info)
+            filter_chain = ",".join(self._build_filter_chain(preset, video_info, color_filters))
+            video = self.probe_input().primary_video
+            stream_params = ["-map", f"0:v:{video.index if video else 0}", "-an", "-sn", "-dn"]
+            hwaccel_opts = self._get_hwaccel_options(preset)
+            started = self._clock()
+            try:
+                with self._cpu_slot():
+                    if str(preset.get('2pass', 'true')).strip().lower() == 'true':
+                        self._run_two_pass(preset, hwaccel_opts, filter_chain, stream_params, output_file,
+                                           video_info)
+                    else:
+                        self._run_single_pass(preset, hwaccel_opts, filter_chain, stream_params, output_file,
+                                              video_info)
+                if not output_file.exists() or output_file.stat().st_size == 0:
+                    raise EncodingError("Segment output is missing or empty")
+                self._record_history(preset, video_info, started, True)
+                return True
+            except Exception:
+                if output_file.exists():
+                    output_file.unlink()
+                self._record_history(preset, video_info, started, False)
+                raise
+            finally:
+                self._remove_pass_logs(preset)
+
+    def assemble_segments(self, preset: dict, segment_files: List[Path], output_file: Path,
+                          audio_info: Optional[List[dict]], passthrough: Optional[dict] = None) -> bool:
+        """Concatenate encoded video segments and mux them with audio/subtitles from the source.
+        
+        Audio is taken from input_range of the source; passthrough selects audio tracks to copy.
+        """
+        logger.info(f"Assembling {len(segment_files)} segments for preset {preset['name']}")
+        with error_context("Segment assembly failed", EncodingError):
+            list_file = self.temp_dir / f"concat-{self._passlog_prefix(preset).name}.txt"
+            with open(list_file, 'w', encoding='utf-8') as f:
+                for segment in segment_files:
+                    escaped = str(Path(segment).absolute()).replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+                    
+            stream_params = self._build_stream_params(preset, audio_info, passthrough or {'audio_copy_tracks': []},
+                                                      source_input=1, video_map="0:v:0")
+            cmd = [
+                self.ffmpeg,
+                "-y",
+                "-loglevel", "warning",
+                "-stats",
+                "-f", "concat",
+                "-safe", "0",
+                "-i", str(list_file),
+                *self._range_args(),
+                "-i", self.input_file,
+                "-c:v", "copy",
+                *stream_params,
+                str(output_file)
+            ]
+            self._echo(f"ffmpeg {' '.join(cmd[1:])}\n")
+            if self._run_ffmpeg(cmd, "assemble") != 0:
+                raise EncodingError("Concatenation failed")
+            if not output_file.exists() or output_file.stat().st_size == 0:
+                raise EncodingError("Assembled output is missing or empty")
+            return True
+
+    def _run_smart_trim(self, preset: dict, passthrough: dict, audio_info: Optional[List[dict]],
+                        output_file: Path, video_info: dict) -> bool:
+        """Stream copy the whole GOPs of input_range and encode only the partial GOPs at its ends.
+        
+        The encoded ends use the preset's encoder with the source pixel format and profile
+        forced, so they join the copied GOPs in one stream. False, with nothing written,
+        when the range holds too few whole GOPs to be worth splitting or an encoded end
+        does not come out matching the source.
+        """
+        start, duration = self.input_range
+        video_index = video_info.get('video_index', 0)
+        media = self.probe_input()
+        source = media.primary_video
+        if source is None or source.pix_fmt == "unknown":
+            logger.info("Source pixel format unknown, encoding the trimmed range")
+            return False
+        try:
+            keyframes = self.prober.keyframes(self.input_file, video_index, start, start + duration,
+                                              origin=media.format.start_time or 0.0)
+        except VideoAnalysisError as e:
+            logger.warning(f"Could not read keyframes, encoding the trimmed range: {str(e)}")
+            return False
+        plan = plan_cut(keyframes, start, start + duration, float(video_info['fps']))
+        if plan is None:
+            logger.info("Too few whole GOPs inside the trimmed range to copy, encoding it")
+            return False
+            
+        self._echo(f"\nSmart Trim... copying {plan.copied:.1f}s, encoding {plan.encoded:.1f}s at the cut points")
+        logger.info(f"Smart trim: copying {plan.copy_start:.3f}s - {plan.copy_end:.3f}s, "
+                    f"encoding {plan.encoded:.3f}s")
+        piece_dir = self.temp_dir / f"trim-{self._passlog_prefix(preset).name}"
+        piece_dir.mkdir(parents=True, exist_ok=True)
+        encode_args = ["-c:v", preset['encoder'],
+                       *piece_encode_options(preset['encoder'], preset['options'], source.pix_fmt, source.profile)]
+        pieces = []
+        try:
+            for number, (kind, piece_start, piece_end) in enumerate(plan.pieces()):
+                piece = piece_dir / f"{number:02d}.{piece_extension(video_info['codec'])}"
+                cmd = [
+                    self.ffmpeg,
+                    "-y",
+                    "-loglevel", "warning",
+                    "-stats",
+                    # Copies start on a keyframe, so the input seek is exact for both kinds
+                    "-ss", f"{piece_start:.6f}",
+                    "-t", f"{piece_end - piece_start:.6f}",
+                    "-i", self.input_file,
+                    "-map", f"0:v:{video_index}",
+                    *(["-c:v", "copy"] if kind == "copy" else encode_args),
+                    "-an", "-sn", "-dn",
+                    str(piece)
+                ]
+                self._echo(f"ffmpeg {' '.join(cmd[1:])}\n")
+                if self._run_ffmpeg(cmd, "copy" if kind == "copy" else "single") != 0:
+                    if kind == "copy":
+                        raise EncodingError(f"Trim piece {number} (copy) failed")
+                    logger.warning(f"Trim piece {number} could not be encoded like the source, encoding the trimmed range")
+                    return False
+                if kind == "encode" and not self._piece_matches(piece, source):
+                    return False
+                pieces.append(piece)
+            return self.assemble_segments(preset, pieces, output_file, audio_info, passthrough)
+        finally:
+            shutil.rmtree(piece_dir, ignore_errors=True)
+
+    def _piece_matches(self, piece: Path, source: VideoStream) -> bool:
+        """Whether an encoded trim piece has the codec, pixel format and profile of the source."""
+        try:
+            video = self.prober.probe(str(piece)).primary_video
+        except VideoAnalysisError as e:
+            logger.warning(f"Could not probe trim piece {piece.name}: {str(e)}")
+            return False
+        found = (video.codec, video.pix_fmt, video.profile) if video else None
+        wanted = (source.codec, source.pix_fmt, source.profile)
+        if found != wanted:
+            logger.warning(f"Trim piece {piece.name} came out as {found}, source is {wanted}; "
+                           f"encoding the trimmed range")
+            return False
+        return True
+
     def _get_hwaccel_options(self, preset: dict) -> List[str]:
         # Hardware acceleration is now handled by encoder only
         return []
 
     def _run_single_pass(self, preset: dict, hwaccel_opts: List[str], filter_chain: str, 
-                        audio_params: List[str], output_file: Path) -> bool:
+                        stream_params: List[str], output_file: Path, video_info: Optional[dict] = None) -> bool:
+        video_input = self._mezzanine_input(preset, filter_chain, video_info, 1) if video_info else None
         try:
-            print("\nSingle Pass Encoding...")
+            self._echo("\nSingle Pass Encoding...")
             
             cmd = [
                 self.ffmpeg,
                 "-y",
                 "-loglevel", "warning",
                 "-stats",
-                "-i", self.input_file,
+                *self._pass_inputs(video_input),
                 "-c:v", preset['encoder'],
                 *preset['options'].split()
             ]
             
-            if filter_chain:
+            if filter_chain and video_input is None:
                 cmd.extend(["-vf", filter_chain])
             
-            # Add audio parameters
-            cmd.extend(audio_params)
+            # Add stream mapping and audio parameters
+            cmd.extend(self._pass_stream_params(stream_params, video_input))
             
             cmd.append(str(output_file))
             
-            print(f"ffmpeg {' '.join(cmd[1:])}\n")
-            result = subprocess.run(cmd)
-            if result.returncode != 0:
+            self._echo(f"ffmpeg {' '.join(cmd[1:])}\n")
+            returncode = self._run_ffmpeg(cmd, "single")
+            if returncode != 0:
                 raise EncodingError("Single pass encoding failed")
                 
             return True
             
-        except subprocess.SubprocessError as e:
-            raise EncodingError("Single pass process error")
+        except OSError as e:
+            raise EncodingError(f"Single pass process error: {str(e)}")
+        finally:
+            self._release_mezzanine(filter_chain)
+
+    def _run_video_copy(self, stream_params: List[str], output_file: Path) -> bool:
+        try:
+            self._echo("\nStream Copy...")
+            
+            cmd = [
+                self.ffmpeg,
+                "-y",
+                "-loglevel", "warning",
+                "-stats",
+                *self._input_args(),
+                "-c:v", "copy",
+                *stream_params,
+                str(output_file)
+            ]
+            
+            self._echo(f"ffmpeg {' '.join(cmd[1:])}\n")
+            returncode = self._run_ffmpeg(cmd, "copy")
+            if returncode != 0:
+                raise EncodingError("Stream copy failed")
+                
+            return True
+            
+        except OSError as e:
+            raise EncodingError(f"Stream copy process error: {str(e)}")
+
+    def _run_ffmpeg(self, cmd: List[str], stage: str) -> int:
+        """Run one ffmpeg step; reports progress through progress_callback when one is set."""
+        self._resumed.wait()
+        if self._cancelled.is_set():
+            raise EncodingError("Encoding cancelled")
+            
+        if self._cpu_set is not None and stage in ENCODE_STAGES:
+            cmd = thread_hint_args(cmd, len(self._cpu_set.cpus))
+            logger.info(f"{stage}: pinned to {self._cpu_set} ({','.join(map(str, self._cpu_set.cpus))})")
+            
+        stdin_feed = self._sequence_feed() if "pipe:0" in cmd else None
+        stderr_tail = collections.deque(maxlen=5)
+        if self.progress_callback is None and self.interactive:
+            # ffmpeg writes its -stats line straight to the console
+            process = self.runner.start(cmd, capture=False, on_start=self._placer(), stdin_feed=stdin_feed)
+        else:
+            cmd = [cmd[0], "-nostats", *[arg for arg in cmd[1:] if arg != "-stats"]]
+            if self.progress_callback is not None:
+                # Machine-readable progress on stdout instead of the console stats line
+                cmd[1:1] = ["-progress", "pipe:1"]
+            process = self.runner.start(cmd,
+                                        stdout_callback=self._progress_reader(stage) if self.progress_callback else None,
+                                        stderr_callback=stderr_tail.append, keep_output=False,
+                                        on_start=self._placer(), stdin_feed=stdin_feed)
+        self._processes.add(process)
+        try:
+            # cancel() or suspend() may have run before the handle was published
+            if self._cancelled.is_set():
+                process.cancel()
+            elif self.paused:
+                process.suspend()
+            result = process.wait()
+        finally:
+            self._processes.discard(process)
+                
+        if self._cancelled.is_set() or result.cancelled:
+            raise EncodingError("Encoding cancelled")
+        if result.returncode != 0 and stderr_tail:
+            logger.error(f"FFmpeg {stage} failed: {' '.join(line.strip() for line in stderr_tail)}")
+        return result.returncode
+
+    @contextmanager
+    def _cpu_slot(self):
+        """Hold one CPU partition for the passes of a single encode."""
+        if self.cpu_allocator is None:
+            yield
+            return
+        with self._leased(self.cpu_allocator.lease()) as (lease,):
+            self._placement.lease = lease
+            try:
+                yield
+            finally:
+                self._placement.lease = None
 
-    def _run_first_pass(self, preset: dict, hwaccel_opts: List[str], filter_chain: str) -> bool:
+    @contextmanager
+    def _leased(self, *leases: Union[Lease, CpuLease]):
+        """Hold leases for one step; suspend() hands them back and resume() takes them again."""
         try:
-            print("\nFirst Pass Encoding...")
+            while True:
+                # A suspended job takes nothing new
+                self._resumed.wait()
+                for lease in leases:
+                    lease.acquire()
+                with self._pause_lock:
+                    if self._resumed.is_set():
+                        self._leases.extend(leases)
+                        break
+                    for lease in reversed(leases):
+                        lease.release()
+            yield leases
+        finally:
+            with self._pause_lock:
+                for lease in leases:
+                    if lease in self._leases:
+                        self._leases.remove(lease)
+                for lease in reversed(leases):
+                    lease.release()
+
+    @property
+    def _cpu_set(self) -> Optional[CpuSet]:
+        lease = getattr(self._placement, "lease", None)
+        return lease.cpu_set if lease is not None else None
+
+    def _placer(self) -> Callable[[int], None]:
+        """on_start callback placing a child on the calling thread's CPU partition."""
+        lease = getattr(self._placement, "lease", None)
+        
+        def place(pid: int):
+            if lease is None:
+                apply_placement(pid, None, self.priority)
+                return
+            lease.pids.add(pid)
+            apply_placement(pid, lease.cpu_set, self.priority)
+            
+        return place
+
+    def _progress_reader(self, stage: str) -> Callable[[str], None]:
+        """Line callback turning ffmpeg -progress blocks into progress_callback events."""
+        block = {}
+        
+        def on_line(line: str):
+            key, _, value = line.strip().partition("=")
+            if not key:
+                return
+            block[key] = value
+            if key == "progress":
+                try:
+                    out_time = int(block.get("out_time_us", "0") or 0) / 1_000_000
+                except ValueError:
+                    out_time = 0.0
+                self.progress_callback({
+                    "stage": stage,
+                    "frame": int(block["frame"]) if block.get("frame", "").isdigit() else None,
+                    "out_time": max(out_time, 0.0),
+                    "speed": block.get("speed", "").strip(),
+                    "done": value == "end"
+                })
+                block.clear()
+                
+        return on_line
+
+    def _echo(self, *args, **kwargs):
+        """print() for status lines, silent when not interactive."""
+        if self.interactive:
+            print(*args, **kwargs)
+
+    def cancel(self):
+        """Stop the running ffmpeg step; encode() then fails with 'Encoding cancelled'."""
+        self._cancelled.set()
+        # Wakes steps waiting for resume(); suspended children are resumed to take the interrupt
+        self._resumed.set()
+        for process in [*self._processes, *self._stream_processes]:
+            if process is not None and not process.done():
+                logger.info("Cancelling running FFmpeg process")
+                process.cancel()
+
+    @property
+    def paused(self) -> bool:
+        return not self._resumed.is_set()
+
+    def suspend(self):
+        """Freeze the running ffmpeg steps in place; further steps wait until resume().
+        
+        The volume slots, disk reservations and CPU partitions of the frozen steps are
+        handed back, so a job taking over the slot is not blocked by them.
+        """
+        with self._pause_lock:
+            if self._cancelled.is_set() or self._paused_at is not None:
+                return
+            self._paused_at = time.monotonic()
+            self._resumed.clear()
+            self._pauses += 1
+            logger.info("Suspending encoding")
+            if not self._frozen:
+                self._frozen = True
+                for process in self._running_processes():
+                    process.suspend()
+            for lease in reversed(self._leases):
+                lease.release()
+
+    def resume(self):
+        """Continue after suspend(); returns at once, the steps continue once their leases are back."""
+        with self._pause_lock:
+            if self._paused_at is None:
+                return
+            self._paused_total += time.monotonic() - self._paused_at
+            self._paused_at = None
+            pauses = self._pauses
+        logger.info("Resuming encoding")
+        threading.Thread(target=self._take_back, args=(pauses,), name="o3enc-resume", daemon=True).start()
+
+    def _take_back(self, pauses: int):
+        """Take the leases of the frozen steps again, then let the steps continue."""
+        def stale() -> bool:
+            # Cancelled, or suspended again while waiting
+            return self._cancelled.is_set() or self._pauses != pauses
+            
+        for lease in list(self._leases):
+            if not lease.acquire(abort=stale):
+                return
+            with self._pause_lock:
+                if stale() or lease not in self._leases:
+                    lease.release()
+                if stale():
+                    return
+        with self._pause_lock:
+            if stale():
+                return
+            running = self._running_processes()
+            for lease in self._leases:
+                if isinstance(lease, CpuLease):
+                    # The partition may differ from the one the children were started on
+                    lease.pids &= {process.pid for process in running}
+                    for pid in lease.pids:
+                        apply_placement(pid, lease.cpu_set, self.priority)
+            self._frozen = False
+            for process in running:
+                process.resume()
+            self._resumed.set()
+
+    def _running_processes(self) -> List[RunningProcess]:
+        return [process for process in [*self._processes, *self._stream_processes]
+                if process is not None and not process.done()]
+
+    def _clock(self) -> float:
+        """Monotonic seconds without the time spent suspended, for step timings and history."""
+        with self._pause_lock:
+            paused = self._paused_total
+            if self._paused_at is not None:
+                paused += time.monotonic() - self._paused_at
+        return time.monotonic() - paused
+
+    def _passlog_prefix(self, preset: dict) -> Path:
+        safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in preset['name'])
+        return self.temp_dir / f"ffmpeg2pass-{safe_name}"
+
+    def _passlog_params(self, preset: dict) -> List[str]:
+        # Keep 2-pass statistics per job unless the preset picks its own log file
+        if '-passlogfile' in preset['options'].split():
+            return []
+        return ["-passlogfile", str(self._passlog_prefix(preset))]
+
+    def _remove_pass_logs(self, preset: dict):
+        prefix = self._passlog_prefix(preset)
+        for log_file in prefix.parent.glob(f"{prefix.name}*"):
+            try:
+                log_file.unlink()
+            except OSError as e:
+                logger.warning(f"Could not remove 2-pass log {log_file}: {str(e)}")
+
+    def ffmpeg_version(self) -> str:
+        """First line of `ffmpeg -version`, falling back to the binary's size and date."""
+        if self._ffmpeg_version is None:
+            version = ""
+            try:
+                result = self.runner.run([self.ffmpeg, "-version"], timeout=30)
+                if result.returncode == 0 and result.stdout.strip():
+                    version = result.stdout.splitlines()[0].strip()
+            except OSError:
+                pass
+            if not version:
+                try:
+                    stat = os.stat(self.ffmpeg)
+                    version = f"{self.ffmpeg}:{stat.st_size}:{stat.st_mtime_ns}"
+                except OSError:
+                    version = self.ffmpeg
+            self._ffmpeg_version = version
+        return self._ffmpeg_version
+
+    def _output_fingerprint(self, preset: dict, filter_chain: str, color_filters: str) -> Optional[str]:
+        """Fingerprint of an encode, or None when the output cannot be reused (e.g. streamed input)."""
+        if self.output_cache is None or self.frame_format is not None:
+            return None
+        try:
+            source = self._source_key()
+        except OSError:
+            return None
+        return output_fingerprint(
+            source=source,
+            input=self._input_args(),
+            # Prefetched sequences leave the range out of the input arguments
+            range=self.input_range,
+            preset={key: value for key, value in preset.items() if key != 'name'},
+            filters=filter_chain,
+            color=color_filters,
+            ffmpeg=self.ffmpeg_version()
+        )
+
+    def _record_history(self, preset: dict, video_info: dict, started: float, success: bool,
+                        kind: str = "encode"):
+        elapsed = self._clock() - started
+        first_pass = self._first_passes.pop(preset['name'], None)
+        if first_pass is not None:
+            elapsed += first_pass[2]
+        if self.history is None or self.frame_format is not None:
+            return
+        if self._range_duration(None) is not None:
+            video_info = {**video_info, 'duration': self.input_range[1]}
+        self.history.record(self.input_file, preset, video_info, elapsed, success, kind)
+        
+    def predict_seconds(self, presets: List[dict], video_info: dict) -> Optional[float]:
+        """Expected processing time of presets on video_info, from the encode history."""
+        if self.history is None:
+            return None
+        return sum(self.history.predict(preset, video_info)[0] for preset in presets)
+        
+    def _reuse_output(self, fingerprint: str, output_file: Path) -> bool:
+        cached = self.output_cache.lookup(fingerprint)
+        if cached is None:
+            return False
+        if cached.absolute() == output_file.absolute():
+            return True
+        try:
+            method = link_or_copy(cached, output_file)
+        except OSError as e:
+            logger.warning(f"Could not reuse earlier output {cached}: {str(e)}")
+            return False
+        self._echo(f"\nIdentical output already exists, {method} instead of encoding:")
+        self._echo(f"  {cached} -> {output_file}")
+        logger.info(f"Reused output {cached} ({method}) for {output_file}")
+        return True
+
+    def _first_pass_key(self, preset: dict, filter_chain: str) -> Optional[str]:
+        """Cache key of the first pass, or None when its statistics cannot be cached."""
+        if self.pass_cache is None or self.frame_format is not None or '-passlogfile' in preset['options'].split():
+            return None
+        try:
+            source = self._source_key()
+            ffmpeg = os.stat(self.ffmpeg)
+        except OSError:
+            return None
+        return stats_key(
+            source=source,
+            input=self._input_args(),
+            # Prefetched sequences leave the range out of the input arguments
+            range=self.input_range,
+            encoder=preset['encoder'],
+            hwaccel=preset.get('hwaccel'),
+            options=rate_control_options(preset['encoder'], preset['options']),
+            filters=filter_chain,
+            ffmpeg=(self.ffmpeg, ffmpeg.st_size, ffmpeg.st_mtime_ns)
+        )
+
+    def _run_two_pass(self, preset: dict, hwaccel_opts: List[str], filter_chain: str,
+                      stream_params: List[str], output_file: Path, video_info: Optional[dict] = None):
+        """Both passes; the first is skipped when the same statistics were cached by an earlier run.
+        
+        Passes read a lossless render of the filter chain instead of the source when
+        _mezzanine_input() finds that cheaper.
+        """
+        if preset['name'] in self._first_passes:
+            # run_first_pass() already wrote the statistics
+            key, reused, _ = self._first_passes[preset['name']]
+            video_input = self.mezzanines.get(filter_chain)
+        else:
+            key, reused, video_input = self._first_pass(preset, hwaccel_opts, filter_chain, video_info)
+        try:
+            try:
+                if not self._run_second_pass(preset, hwaccel_opts, filter_chain, stream_params, output_file,
+                                             video_input):
+                    raise EncodingError("Second pass encoding failed")
+            except EncodingError:
+                if reused and not self._cancelled.is_set():
+                    # Do not hand possibly broken statistics to the next run
+                    self.pass_cache.discard(key)
+                raise
+        finally:
+            self._release_mezzanine(filter_chain)
+
+    def _first_pass(self, preset: dict, hwaccel_opts: List[str], filter_chain: str,
+                    video_info: Optional[dict]) -> Tuple[Optional[str], bool, Optional[Path]]:
+        """Pass 1 or its cached statistics: (cache key, whether the cache was used, intermediate to read)."""
+        key = self._first_pass_key(preset, filter_chain)
+        reused = key is not None and self.pass_cache.restore(key, self._passlog_prefix(preset))
+        video_input = None
+        if video_info:
+            video_input = self._mezzanine_input(preset, filter_chain, video_info, 1 if reused else 2)
+        if reused:
+            self._echo("\nFirst Pass Encoding... reusing statistics from an earlier run")
+            return key, reused, video_input
+        try:
+            if not self._run_first_pass(preset, hwaccel_opts, filter_chain, video_input):
+                raise EncodingError("First pass encoding failed")
+        except BaseException:
+            self._release_mezzanine(filter_chain)
+            raise
+        if key is not None:
+            self.pass_cache.store(key, self._passlog_prefix(preset))
+        return key, reused, video_input
+
+    def run_first_pass(self, preset: dict, output_file: Path, color_filters: str, video_info: dict) -> bool:
+        """Run the first pass of a 2-pass preset ahead of encode(), which then only runs pass 2.
+        
+        Lets pass 1 overlap with loudness measurement, which only the second pass needs.
+        Returns False, leaving the preset to encode(), when encode() would not run a
+        first pass at all (single pass, stream copy or an identical earlier output).
+        """
+        with error_context("First pass failed", EncodingError):
+            self._validate_encoding_inputs(preset, output_file, video_info)
+            if preset_passes(preset) < 2:
+                return False
+            filter_chain = ",".join(self._build_filter_chain(preset, video_info, color_filters))
+            fingerprint = self._output_fingerprint(preset, filter_chain, color_filters)
+            if fingerprint is not None and self.output_cache.lookup(fingerprint) is not None:
+                return False
+            if self.plan_passthrough(preset, video_info, None, color_filters)['video_copy']:
+                return False
+            started = self._clock()
+            # The pass log stays in the scratch directory until the second pass reads it
+            scratch = JobEstimate(output_bytes=0, scratch_bytes=estimate_job(preset, video_info).scratch_bytes)
+            with self._leased(self.disk_budget.reservation(output_file.parent, self.temp_dir, scratch),
+                              self.throttle.acquire([self.temp_dir])), self._cpu_slot():
+                key, reused, _ = self._first_pass(preset, self._get_hwaccel_options(preset), filter_chain,
+                                                  video_info)
+            self._first_passes[preset['name']] = (key, reused, self._clock() - started)
+            return True
+
+    def plan_filter_sharing(self, presets: List[dict], video_info: dict, color_filters: str):
+        """Count the passes reading each filter chain, so an intermediate is weighed against all of them."""
+        self._chain_uses.clear()
+        for preset in presets:
+            if preset_mezzanine(preset) == "false":
+                continue
+            try:
+                chain = ",".join(self._build_filter_chain(preset, video_info, color_filters))
+            except EncodingError:
+                continue
+            self._chain_uses[chain] += preset_passes(preset)
+
+    def _mezzanine_input(self, preset: dict, filter_chain: str, video_info: dict, passes: int) -> Optional[Path]:
+        """Intermediate to read instead of the source for the next passes of filter_chain, if any.
+        
+        Renders one when the chain is read at least twice (these passes plus later presets
+        planned by plan_filter_sharing) and, in auto mode, a measured sample shows that
+        reading it back is cheaper than running the chain every time.
+        """
+        with self._mezzanine_lock:
+            # Presets running side by side wait for one render of a shared chain
+            return self._prepare_mezzanine(preset, filter_chain, video_info,
+                                           self._consume_chain(filter_chain, passes))
+
+    def _prepare_mezzanine(self, preset: dict, filter_chain: str, video_info: dict, uses: int) -> Optional[Path]:
+        if filter_chain in self.mezzanines:
+            return self.mezzanines[filter_chain]
+            
+        mode = preset_mezzanine(preset)
+        if mode == "false" or uses < 2 or not filter_chain or self.frame_format is not None:
+            return None
+        if mode == "auto" and is_cheap_chain(filter_chain):
+            return None
+            
+        duration = self._range_duration(float(video_info['duration']))
+        crop = self._preset_crop(preset, video_info)
+        height = int(preset['height']) if preset.get('height') else (crop.height if crop else video_info['height'])
+        width = (crop.width if crop else video_info['width']) * height / (crop.height if crop else video_info['height'])
+        frame_bytes = raw_bytes(width, height, preset['pixfmt'], duration * self.output_fps(preset, video_info))
+        codec = choose_codec(preset['pixfmt'], frame_bytes)
+        needed = frame_bytes * codec.ratio * FREE_SPACE_MARGIN
+        try:
+            free = shutil.disk_usage(self.temp_dir).free
+        except OSError:
+            free = 0
+        if free < needed:
+            logger.info(f"Not enough scratch space for a filtered intermediate "
+                        f"({needed / 1024**3:.1f} GB needed, {free / 1024**3:.1f} GB free)")
+            return None
+            
+        video_map = f"0:v:{video_info.get('video_index', 0)}"
+        if mode == "auto":
+            start = (self.input_range[0] if self.input_range is not None else 0.0) + duration / 3
+            cost = measure_filter_cost(self.ffmpeg, self.runner, self._sample_input_args(start), video_map,
+                                       filter_chain, codec, self.temp_dir, on_start=self._placer())
+            if cost is None or not cost.worth_it(uses):
+                logger.info(f"Filtering directly for {uses} pass(es)"
+                            + (f" (sample: render {cost.render_seconds:.1f}s, read back {cost.decode_seconds:.1f}s)"
+                               if cost else ""))
+                return None
+            logger.info(f"Using a {codec.name} intermediate for {uses} pass(es) "
+                        f"(sample: render {cost.render_seconds:.1f}s, read back {cost.decode_seconds:.1f}s)")
+            
+        path = self.temp_dir / f"mezzanine-{stats_key(filters=filter_chain)[:12]}.{codec.extension}"
+        self._echo(f"\nRendering Filtered Intermediate ({codec.name})...")
+        cmd = render_command(self.ffmpeg, self._input_args(), video_map, filter_chain, codec, path)
+        self._echo(f"ffmpeg {' '.join(cmd[1:])}\n")
+        try:
+            returncode = self._run_ffmpeg(cmd, "mezzanine")
+        except OSError as e:
+            logger.warning(f"Could not render filtered intermediate: {str(e)}")
+            returncode = -1
+        if returncode != 0:
+            # The passes can still filter the source themselves
+            path.unlink(missing_ok=True)
+            logger.warning("Filtered intermediate failed, filtering the source directly")
+            return None
+        self.mezzanines[filter_chain] = path
+        return path
+
+    def _consume_chain(self, filter_chain: str, passes: int) -> int:
+        """Planned reads of filter_chain from now on, including these passes, which are taken off."""
+        uses = max(self._chain_uses.pop(filter_chain, 0), passes)
+        if uses > passes:
+            self._chain_uses[filter_chain] = uses - passes
+        return uses
+
+    def _release_mezzanine(self, filter_chain: str):
+        """Delete the intermediate of filter_chain once no planned pass reads it anymore."""
+        with self._mezzanine_lock:
+            if self._chain_uses.get(filter_chain):
+                return
+            path = self.mezzanines.pop(filter_chain, None)
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+    def _pass_inputs(self, video_input: Optional[Path], with_source: bool = True) -> List[str]:
+        """Input options of a pass; an intermediate comes after the source, which keeps audio and subtitles."""
+        if video_input is None:
+            return self._input_args()
+        if not with_source:
+            return ["-i", str(video_input)]
+        return [*self._input_args(), "-i", str(video_input)]
+
+    def _pass_stream_params(self, stream_params: List[str], video_input: Optional[Path]) -> List[str]:
+        # stream_params always starts with the video -map
+        if video_input is None:
+            return stream_params
+        return ["-map", "1:v:0", *stream_params[2:]]
+
+    def _run_first_pass(self, preset: dict, hwaccel_opts: List[str], filter_chain: str,
+                        video_input: Optional[Path] = None) -> bool:
+        try:
+            self._echo("\nFirst Pass Encoding...")
             
             first_pass = [
                 self.ffmpeg,
                 "-y",
                 "-loglevel", "warning",
                 "-stats",
-                "-i", self.input_file,
+                *self._pass_inputs(video_input, with_source=False),
                 "-c:v", preset['encoder'],
                 *preset['options'].split(),
-                "-vf", filter_chain,
+                *(["-vf", filter_chain] if video_input is None else ["-map", "0:v:0"]),
                 "-pass", "1",
+                *self._passlog_params(preset),
                 "-an",  # Disable audio processing in first pass
                 "-f", "null",
                 "NUL"
             ]
             
-            print(f"ffmpeg {' '.join(first_pass[1:])}\n")
-            result = subprocess.run(first_pass)
-            if result.returncode != 0:
+            self._echo(f"ffmpeg {' '.join(first_pass[1:])}\n")
+            returncode = self._run_ffmpeg(first_pass, "pass1")
+            if returncode != 0:
                 raise EncodingError("First pass encoding failed")
                 
             return True
             
-        except subprocess.SubprocessError as e:
-            raise EncodingError("First pass process error")
+        except OSError as e:
+            raise EncodingError(f"First pass process error: {str(e)}")
 
     def _run_second_pass(self, preset: dict, hwaccel_opts: List[str], filter_chain: str, 
-                        audio_params: List[str], output_file: Path) -> bool:
+                        stream_params: List[str], output_file: Path, video_input: Optional[Path] = None) -> bool:
         try:
-            print("\nSecond Pass Encoding...")
+            self._echo("\nSecond Pass Encoding...")
             
             second_pass = [
                 self.ffmpeg,
                 "-y",
                 "-loglevel", "warning",
                 "-stats",
-                "-i", self.input_file,
+                *self._pass_inputs(video_input),
                 "-c:v", preset['encoder'],
                 *preset['options'].split(),
-                "-vf", filter_chain,
-                "-pass", "2"
+                *(["-vf", filter_chain] if video_input is None else []),
+                "-pass", "2",
+                *self._passlog_params(preset)
             ]
             
-            # Add audio parameters for second pass
-            second_pass.extend(audio_params)
+            # Add stream mapping and audio parameters for second pass
+            second_pass.extend(self._pass_stream_params(stream_params, video_input))
             
             second_pass.append(str(output_file))
-            print(f"ffmpeg {' '.join(second_pass[1:])}\n")
-            result = subprocess.run(second_pass)
-            if result.returncode != 0:
+            self._echo(f"ffmpeg {' '.join(second_pass[1:])}\n")
+            returncode = self._run_ffmpeg(second_pass, "pass2")
+            if returncode != 0:
                 raise EncodingError("Second pass encoding failed")
                 
             if not output_file.exists():
@@ -820,10 +2132,8 @@ class O3Encoder:
                 
             return True
             
-        except subprocess.SubprocessError as e:
-            raise EncodingError("Second pass process error")
         except OSError as e:
-            raise EncodingError("Output file system error")
+            raise EncodingError(f"Second pass process error: {str(e)}")
 
     def cleanup(self):
         cleanup_errors = []
@@ -868,10 +2178,10 @@ class O3Encoder:
         logger.info("Cleanup completed")
 
 class PresetManager:
-    def __init__(self):
+    def __init__(self, preset_file: Optional[Path] = None):
         self.root_dir = Path(__file__).parent.parent
         self.src_dir = Path(__file__).parent
-        self.preset_file = self.root_dir / "presets.ini"
+        self.preset_file = Path(preset_file) if preset_file else self.root_dir / "presets.ini"
         self.presets = {}
 
     def create_presets(self):
@@ -966,8 +2276,15 @@ class PresetManager:
                 'pixfmt': config.get(section, 'pixfmt'),
                 'scale_flags': config.get(section, 'scale_flags', fallback='lanczos'),
                 'options': config.get(section, 'options'),
+                'passthrough': config.get(section, 'passthrough', fallback='true'),
+                'crop': config.get(section, 'crop', fallback='auto'),
+                'deinterlace': config.get(section, 'deinterlace', fallback='false'),
+                'mezzanine': config.get(section, 'mezzanine', fallback='auto'),
                 'audio_codec': config.get(section, 'audio_codec', fallback='aac'),
                 'audio_bitrate': config.get(section, 'audio_bitrate', fallback='128k'),
+                'audio_channels': config.get(section, 'audio_channels', fallback='2'),
+                'audio_tracks': config.get(section, 'audio_tracks', fallback='all'),
+                'subtitles': config.get(section, 'subtitles', fallback='true'),
                 'target_lufs': config.getfloat(section, 'target_lufs', fallback=-18),
                 'target_lra': config.getfloat(section, 'target_lra', fallback=7),
                 'target_tp': config.getfloat(section, 'target_tp', fallback=-2)
@@ -1104,7 +2421,7 @@ class PresetManager:
         except Exception as e:
             raise PresetError(f"Failed to get base filename: {str(e)}")
 
-    def get_output_filename(self, base_name: str, preset: dict) -> Path:
+    def get_output_filename(self, base_name: str, preset: dict, output_dir: Optional[Path] = None) -> Path:
         try:
             if not base_name or not isinstance(base_name, str):
                 raise PresetError("Invalid base filename")
@@ -1125,6 +2442,8 @@ class PresetManager:
             while True:
                 version_str = f"_v{version:02d}"
                 output_path = Path(f"{output_name}{version_str}.{preset['container']}")
+                if output_dir is not None:
+                    output_path = Path(output_dir) / output_path
                 
                 try:
                     # Check if path is too long for the system
@@ -1155,7 +2474,9 @@ class PresetManager:
         except Exception as e:
             raise PresetError(f"Failed to generate output filename: {str(e)}")
 
-def show_encoding_preview(selected_presets: List[dict], output_files: Dict[str, Path], video_info: dict):
+def show_encoding_preview(selected_presets: List[dict], output_files: Dict[str, Path], video_info: dict,
+                          crop: Optional[CropEstimate] = None, scan: Optional[ScanEstimate] = None,
+                          history: Optional[EncodeHistory] = None):
     try:
         logger.info("Generating encoding preview")
         print("\nEncoding Preview:")
@@ -1165,37 +2486,52 @@ def show_encoding_preview(selected_presets: List[dict], output_files: Dict[str,
             try:
                 output_file = output_files[preset['name']]
                 
-                target_height = video_info['height']
-                target_width = video_info['width']
+                preset_crop = crop if preset_crops(preset) else None
+                source_width = preset_crop.width if preset_crop else video_info['width']
+                source_height = preset_crop.height if preset_crop else video_info['height']
+                target_height = source_height
+                target_width = source_width
 
                 if preset.get('height'):
                     try:
                         target_height = int(preset['height'])
-                        scale_factor = target_height / video_info['height']
-                        target_width = int(video_info['width'] * scale_factor)
+                        scale_factor = target_height / source_height
+                        target_width = int(source_width * scale_factor)
                         if target_width <= 0 or target_height <= 0:
                             raise ValueError("Invalid scaled dimensions")
                     except (ValueError, TypeError, ZeroDivisionError) as e:
                         logger.warning(f"Could not calculate scaled dimensions for preset {preset['name']}: {e}")
-                        target_height = video_info['height']
-                        target_width = video_info['width']
+                        target_height = source_height
+                        target_width = source_width
                 
+                preset_scan = scan if preset_deinterlacer(preset) and scan and scan.kind != "progressive" else None
+                source_fps = video_info['fps'] * (preset_scan.fps_factor if preset_scan else 1.0)
                 try:
                     preset_fps = preset.get('fps')
-                    fps = int(float(preset_fps)) if preset_fps else int(video_info['fps'])
+                    fps = int(float(preset_fps)) if preset_fps else int(source_fps)
                 except (ValueError, TypeError) as e:
                     logger.warning(f"Could not parse FPS value for preset {preset['name']}: {e}")
-                    fps = int(video_info['fps'])
+                    fps = int(source_fps)
                 
                 preview_info = [
                     f"\nPreset: [{preset['name']}]",
                     "----------------------------------------",
                     f"Output Path : {output_file.absolute()}",
+                    f"Crop        : {source_width} x {source_height} at {preset_crop.x},{preset_crop.y}"
+                    if preset_crop else "Crop        : none",
                     f"Resolution  : {target_width} x {target_height}",
+                    f"Deinterlace : {preset_scan.kind} ({preset_deinterlacer(preset)}"
+                    f"{', inverse telecine' if preset_scan.kind == 'telecined' else ''})"
+                    if preset_scan else "Deinterlace : none",
                     f"Frame Rate  : {fps} fps",
                     f"Encoder     : {preset['encoder']}",
-                    f"Pixel Format: {preset['pixfmt']}"
+                    f"Pixel Format: {preset['pixfmt']}",
+                    f"Est. Size   : {estimate_job(preset, video_info).output_bytes / (1024 * 1024):.0f} MB"
                 ]
+                if history is not None:
+                    seconds, basis = history.predict(preset, video_info)
+                    preview_info.append(f"Est. Time   : {format_duration(seconds)}"
+                                        + (" (no history yet)" if basis == "default" else ""))
                 
                 for line in preview_info:
                     print(line)
@@ -1215,12 +2551,329 @@ def show_encoding_preview(selected_presets: List[dict], output_files: Dict[str,
         logger.error(error_msg)
         raise EncodingError(error_msg)
 
-def show_encoding_results(results: Dict[str, dict], ffprobe_path: str):
+def batch_color_filters(encoder: 'O3Encoder', video_info: dict, colorspace: str, colorrange: str) -> str:
+    """Color filters without prompting: source tags, then confident detection, then the given settings."""
+    if video_info["colorspace"] != "unknown" and video_info["colorrange"] != "unknown":
+        return ""
+    estimate = encoder.detect_color(video_info)
+    if estimate is not None and estimate.confident:
+        colorspace, colorrange = estimate.colorspace, estimate.colorrange
+    elif estimate is not None:
+        logger.warning(f"Color detection unsure ({estimate.confidence:.0%}); "
+                       f"using configured {colorspace}/{colorrange}")
+    return build_color_filters(colorspace, colorrange)
+
+def build_color_filters(colorspace: str, colorrange: str) -> str:
+    color_filters = ""
+    if colorspace != "auto":
+        color_filters = "colorspace=all=bt709:iall=" + colorspace
+        if colorrange in ["tv", "pc"]:
+            color_filters += f":range={colorrange}:irange={colorrange}"
+    return color_filters
+
+def run_batch(input_file: str, presets: List[dict], preset_manager: 'PresetManager',
+              output_dir: Optional[Path] = None, colorspace: str = "auto", colorrange: str = "auto",
+              disk_budget: Optional[DiskBudget] = None,
+              throttle: Optional[VolumeThrottle] = None,
+              progress_callback: Optional[Callable[[dict], None]] = None,
+              on_encoder: Optional[Callable[['O3Encoder'], None]] = None,
+              cpu_allocator: Optional[CpuAllocator] = None,
+              priority: ProcessPriority = BACKGROUND_PRIORITY,
+              parallel_encodes: int = 1, interactive: bool = True,
+              trim: Optional[Tuple[float, Optional[float]]] = None) -> Dict[str, dict]:
+    """Encode one input with the given presets without any prompts.
+    
+    Color settings tagged in the source take priority, then sampled detection when it is
+    confident; colorspace/colorrange are the fallback for the rest. on_encoder receives the encoder before work
+    starts so the caller can cancel it. Batch jobs run at background priority unless
+    the caller passes another one. Image sequences are read at DEFAULT_SEQUENCE_FPS.
+    The steps run as a graph (see build_encode_graph) with up to parallel_encodes
+    encoding steps at once. With interactive=False nothing is printed to the console.
+    trim is (start, end) in seconds of the input to encode, end None meaning to the end.
+    """
+    encoder = O3Encoder(input_file)
+    encoder.interactive = interactive
+    encoder.preset_manager = preset_manager
+    base_name = Path(input_file).stem
+    encoder.progress_callback = progress_callback
+    if on_encoder is not None:
+        on_encoder(encoder)
+    if disk_budget is not None:
+        encoder.disk_budget = disk_budget
+    if throttle is not None:
+        encoder.throttle = throttle
+    encoder.cpu_allocator = cpu_allocator
+    encoder.priority = priority
+        
+    try:
+        if not Path(input_file).is_file() and is_sequence_path(input_file):
+            encoder.use_sequence(find_sequence(input_file, DEFAULT_SEQUENCE_FPS))
+            base_name = encoder.sequence.name
+        video_info = encoder.analyze_video()
+        if trim is not None:
+            video_info = encoder.set_trim(*trim, video_info)
+        color_filters = batch_color_filters(encoder, video_info, colorspace, colorrange)
+        output_files = {
+            preset['name']: preset_manager.get_output_filename(base_name, preset, output_dir)
+            for preset in presets
+        }
+        # Fail the whole batch up front rather than after some presets have encoded
+        check_disk_space(encoder, presets, output_files, video_info, parallel_encodes)
+        
+        results: Dict[str, dict] = {}
+        graph = build_encode_graph(encoder, presets, output_files, color_filters, video_info, results,
+                                   progress_callback)
+        run_encode_graph(graph, presets, results, parallel_encodes)
+        return results
+        
+    finally:
+        encoder.cleanup()
+
+def build_encode_graph(encoder: 'O3Encoder', presets: List[dict], output_files: Dict[str, Path],
+                       color_filters: str, video_info: dict, results: Dict[str, dict],
+                       progress_callback: Optional[Callable[[dict], None]] = None) -> TaskGraph:
+    """The steps of encoding one analyzed input with several presets, as a dependency graph.
+    
+    Black bar/scan detection and loudness measurement start together. The first pass of
+    a 2-pass preset only needs detection; the second pass (audio encode and mux) or a
+    single pass needs both. Each output is verified as soon as it is written. results
+    receives one entry per preset as its steps finish.
+    """
+    # Ctrl+C stops the running ffmpeg steps instead of waiting for them
+    graph = TaskGraph(on_interrupt=encoder.cancel)
+    state = {'audio_info': None}
+    
+    def detect():
+        if any(preset_crops(preset) for preset in presets):
+            encoder.detect_crop(video_info)
+        if any(preset_deinterlacer(preset) for preset in presets):
+            encoder.detect_scan(video_info)
+        encoder.plan_filter_sharing(presets, video_info, color_filters)
+        
+    def measure_audio():
+        try:
+            state['audio_info'] = encoder.analyze_audio(presets[0])
+        except Exception as e:
+            logger.warning(f"Audio analysis failed: {str(e)}")
+            logger.info(f"Continuing without audio normalization...")
+            try:
+                state['audio_info'] = [track.as_track() for track in encoder.probe_input().audio] or None
+            except O3EncoderError:
+                state['audio_info'] = None
+                
+    try:
+        audio_tracks = len(encoder.probe_input().audio)
+    except O3EncoderError:
+        audio_tracks = 0
+    graph.add("detect", detect, resources={"analysis": 1}, estimate=DETECT_SECONDS)
+    graph.add("audio", measure_audio, resources={"analysis": 1},
+              estimate=AUDIO_SECONDS_PER_SECOND * video_info['duration'] * audio_tracks)
+    
+    for preset in presets:
+        name = preset['name']
+        output_file = output_files[name]
+        results[name] = {'success': False, 'output_file': output_file}
+        seconds = encoder.predict_seconds([preset], video_info) or 0.0
+        encode_deps = ["detect", "audio"]
+        if preset_passes(preset) == 2:
+            # The history covers both passes; the split is only used for ordering
+            seconds /= 2
+            graph.add(f"{name}:pass1",
+                      lambda preset=preset, output_file=output_file:
+                          encoder.run_first_pass(preset, output_file, color_filters, video_info),
+                      deps=["detect"], resources={"encode": 1}, estimate=seconds)
+            encode_deps = [f"{name}:pass1", "audio"]
+            
+        def encode(preset=preset, output_file=output_file):
+            if progress_callback is not None:
+                progress_callback({"stage": "preset", "preset": preset['name'], "done": False})
+            success = encoder.encode(preset, output_file, color_filters, state['audio_info'], video_info)
+            results[preset['name']].update(success=success,
+                                           passthrough=encoder.passthrough_decisions.get(preset['name']))
+            
+        def verify(preset=preset):
+            verify_outputs(encoder, {preset['name']: results[preset['name']]}, [preset], video_info)
+            
+        graph.add(f"{name}:encode", encode, deps=encode_deps, resources={"encode": 1}, estimate=seconds)
+        graph.add(f"{name}:verify", verify, deps=[f"{name}:encode"], resources={"analysis": 1},
+                  estimate=VERIFY_SECONDS)
+    return graph
+
+def run_encode_graph(graph: TaskGraph, presets: List[dict], results: Dict[str, dict], parallel_encodes: int = 1):
+    """Run a graph from build_encode_graph and record why presets failed in results."""
+    tasks = graph.run({"encode": max(1, parallel_encodes), "analysis": ANALYSIS_SLOTS})
+    for preset in presets:
+        name = preset['name']
+        if results[name]['success']:
+            continue
+        failed = [task for task in tasks.values()
+                  if task.name.startswith(f"{name}:") and task.status == "failed"]
+        error = failed[0].error if failed else "Encoding did not run"
+        results[name]['error'] = error
+        logger.error(f"Encoding failed for preset {name}: {error}")
+
+def run_pipe_encode(frames: Iterable, frame_format: FrameFormat, presets: List[dict],
+                    preset_manager: 'PresetManager', base_name: str, output_dir: Optional[Path] = None,
+                    colorspace: str = "auto", colorrange: str = "auto", copy_frames: bool = False,
+                    queue_frames: int = DEFAULT_QUEUE_FRAMES) -> Dict[str, dict]:
+    """Encode frames produced in Python (NumPy arrays or bytes) with several presets at once.
+    
+    The frames are read once and written to one ffmpeg per preset, so nothing is staged on
+    disk. See framepipe.iter_buffers for when copy_frames is needed.
+    """
+    encoder = O3Encoder("pipe:0")
+    encoder.preset_manager = preset_manager
+    encoder.frame_format = frame_format
+    try:
+        video_info = encoder.analyze_video()
+        color_filters = build_color_filters(colorspace, colorrange)
+        fanout = FrameFanout(encoder.runner, queue_frames)
+        
+        results = {}
+        processes = {}
+        for preset in presets:
+            output_file = preset_manager.get_output_filename(base_name, preset, output_dir)
+            results[preset['name']] = {'success': False, 'output_file': output_file}
+            try:
+                processes[preset['name']] = encoder.start_stream_encode(
+                    preset, output_file, color_filters, video_info, fanout.add_consumer(preset['name'])
+                )
+            except O3EncoderError as e:
+                logger.error(f"Encoding failed for preset {preset['name']}: {str(e)}")
+                results[preset['name']]['error'] = str(e)
+        if not processes:
+            return results
+            
+        def on_frame(count: int):
+            if count % max(1, round(video_info['fps'])) == 0:
+                print(f"\rFrames sent: {count}", end="", flush=True)
+                
+        try:
+            frame_count = fanout.feed(iter_buffers(frames, frame_format, copy_frames), on_frame)
+        except BaseException:
+            encoder.cancel()
+            raise
+        finally:
+            for name, process in processes.items():
+                result = process.wait()
+                output_file = results[name]['output_file']
+                if result.returncode == 0 and output_file.exists() and output_file.stat().st_size > 0:
+                    results[name]['success'] = True
+                    continue
+                results[name]['error'] = "Encoding cancelled" if result.cancelled else \
+                    f"FFmpeg exited with code {result.returncode}"
+                if output_file.exists():
+                    output_file.unlink()
+        print(f"\rFrames sent: {frame_count}")
+        logger.info(f"Streamed {frame_count} frames to {len(processes)} encoder(s)")
+        
+        for name, result in results.items():
+            if not result['success']:
+                logger.error(f"Encoding failed for preset {name}: {result.get('error')}")
+        verify_outputs(encoder, results, presets, frame_format.video_info(frame_count))
+        return results
+        
+    finally:
+        encoder.cleanup()
+
+def run_pipe_mode(kind: str, output_name: str, preset_names: List[str], size: Optional[str],
+                  pix_fmt: Optional[str], fps: Optional[str]) -> int:
+    encoder = None
+    try:
+        encoder = O3Encoder("pipe:0")
+        encoder.initialize_environment()
+        preset_manager = encoder.preset_manager
+        missing = [name for name in preset_names if name not in preset_manager.presets]
+        if missing:
+            raise PresetError(f"Unknown presets: {', '.join(missing)}")
+        presets = [preset_manager.presets[name] for name in preset_names]
+        
+        stream = sys.stdin.buffer
+        if kind == "y4m":
+            frame_format, frames = read_y4m(stream)
+        else:
+            if not (size and pix_fmt and fps):
+                raise VideoAnalysisError("Raw pipe input needs --size, --pix-fmt and --fps")
+            frame_format = parse_frame_format(size, pix_fmt, fps)
+            frames = read_raw_frames(stream, frame_format)
+            
+        output_path = Path(output_name)
+        results = run_pipe_encode(frames, frame_format, presets, preset_manager, output_path.stem,
+                                  output_path.parent)
+        show_encoding_results(results, encoder.prober)
+        return 0 if all(result['success'] for result in results.values()) else 1
+        
+    except KeyboardInterrupt:
+        logger.info("Pipe encoding stopped by user")
+        return 130
+    except O3EncoderError as e:
+        logger.error(f"Pipe encoding error: {str(e)}")
+        return 1
+    finally:
+        if encoder:
+            encoder.cleanup()
+
+def check_disk_space(encoder: O3Encoder, presets: List[dict], output_files: Dict[str, Path], video_info: dict,
+                     parallel: int = 1):
+    audio_tracks = max(1, len(encoder.probe_input().audio))
+    requirements = []
+    scratch = []
+    for preset in presets:
+        estimate = estimate_job(preset, video_info, audio_tracks)
+        requirements.append((output_files[preset['name']].parent, estimate.output_bytes))
+        scratch.append(estimate.scratch_bytes)
+    # Scratch space is reused between presets; only the ones running side by side add up
+    requirements.append((encoder.temp_dir, sum(sorted(scratch, reverse=True)[:max(1, parallel)])))
+    encoder.disk_budget.check(requirements)
+    
+    total_mb = sum(size for _, size in requirements) / (1024 * 1024)
+    logger.info(f"Disk space check passed (estimated {total_mb:.0f} MB)")
+
+def get_output_fps(preset: dict, video_info: dict) -> float:
+    try:
+        return float(preset['fps']) if preset.get('fps') else float(video_info['fps'])
+    except (ValueError, TypeError):
+        return float(video_info['fps'])
+
+def verify_outputs(encoder: O3Encoder, results: Dict[str, dict], presets: List[dict], video_info: dict):
+    jobs = {}
+    for preset in presets:
+        result = results.get(preset['name'])
+        if result and result['success']:
+            jobs[preset['name']] = VerificationJob(
+                output_file=result['output_file'],
+                expected_duration=video_info['duration'],
+                expected_fps=encoder.output_fps(preset, video_info)
+            )
+    if not jobs:
+        return
+        
+    if encoder.interactive:
+        print("\nVerifying outputs...")
+    verifier = OutputVerifier(encoder.ffmpeg, encoder.prober)
+    for preset_name, verification in verifier.verify_all(jobs).items():
+        results[preset_name]['verification'] = verification
+        if not verification.passed:
+            failed = ', '.join(check.name for check in verification.failures)
+            logger.error(f"Output verification failed for preset {preset_name}: {failed}")
+
+def show_encoding_results(results: Dict[str, dict], prober: MediaProbe):
    print("\nEncoding Results:")
    print("----------------------------------------")
    
    for preset_name, result in results.items():
        status = "Success" if result['success'] else "Failed"
+       passthrough = result.get('passthrough')
+       if result['success'] and passthrough:
+           if passthrough['remux']:
+               status += " (remuxed, no re-encode)"
+           elif passthrough['video_copy']:
+               status += " (video copied)"
+           elif passthrough['audio_copy']:
+               status += " (audio copied)"
+       verification = result.get('verification')
+       if verification is not None:
+           status += ", verified" if verification.passed else ", VERIFICATION FAILED"
        print(f"[{preset_name}] : {status}")
 
    print("\nDetailed Information:")
@@ -1229,34 +2882,31 @@ def show_encoding_results(results: Dict[str, dict], ffprobe_path: str):
    for preset_name, result in results.items():
        if result['success'] and result['output_file'].exists():
            try:
-               cmd = [
-                   ffprobe_path,
-                   "-v", "quiet",
-                   "-select_streams", "v:0",
-                   "-print_format", "json",
-                   "-show_entries", "stream=width,height,r_frame_rate,codec_name,"
-                   "pix_fmt,color_space,color_range,color_transfer,color_primaries",
-                   str(result['output_file'])
-               ]
-               
-               probe_result = subprocess.run(cmd, capture_output=True, text=True)
-               if probe_result.returncode != 0:
+               media = prober.probe(str(result['output_file']))
+               data = media.primary_video
+               if data is None:
                    print(f"Warning: Could not analyze file for [{preset_name}]")
                    continue
-                   
-               data = json.loads(probe_result.stdout)["streams"][0]
                file_size = result['output_file'].stat().st_size / (1024*1024)
                
                print(f"\nDetails for [{preset_name}]:")
                print(f"  Output Path    : {result['output_file'].absolute()}")
-               print(f"  Resolution     : {data['width']} x {data['height']}")
-               print(f"  Frame Rate     : {int(eval(data['r_frame_rate']))} fps")
-               print(f"  Codec          : {data['codec_name']}")
-               print(f"  Pixel Format   : {data['pix_fmt']}")
-               print(f"  Color Space    : {data.get('color_space', 'unknown')}")
-               print(f"  Color Transfer : {data.get('color_transfer', 'unknown')}")
-               print(f"  Color Primaries: {data.get('color_primaries', 'unknown')}")
-               print(f"  Color Range    : {data.get('color_range', 'unknown')}")
+               print(f"  Resolution     : {data.width} x {data.height}")
+               print(f"  Frame Rate     : {data.fps:.2f} fps")
+               print(f"  Codec          : {data.codec}")
+               print(f"  Pixel Format   : {data.pix_fmt}")
+               print(f"  Color Space    : {data.color_space}")
+               print(f"  Color Transfer : {data.color_transfer}")
+               print(f"  Color Primaries: {data.color_primaries}")
+               print(f"  Color Range    : {data.color_range}")
+               print(f"  Duration       : {media.duration:.2f} seconds")
+               print(f"  Audio Tracks   : {len(media.audio)}")
+               verification = result.get('verification')
+               if verification is not None:
+                   print("  Verification   :")
+                   for check in verification.checks:
+                       mark = "OK  " if check.passed else "FAIL"
+                       print(f"    [{mark}] {check.name}: {check.detail}")
                print(f"  File Size      : {file_size:.1f} MB")
                
            except Exception as e:
@@ -1264,6 +2914,337 @@ def show_encoding_results(results: Dict[str, dict], ffprobe_path: str):
 
    print("----------------------------------------")
 
+def estimate_input_seconds(encoder: O3Encoder, input_file: str, presets: List[dict]) -> float:
+    """Predicted processing time of a queued input, used to start the longest jobs first."""
+    video_info = encoder.prober.probe(input_file).video_info()
+    return encoder.predict_seconds(presets, video_info) or 0.0
+
+def run_plan_mode(input_file: str, preset_names: List[str]) -> int:
+    """Dry run: analyze the input and print the encode graph with estimates and its critical path."""
+    encoder = None
+    try:
+        encoder = O3Encoder(input_file)
+        encoder.initialize_environment()
+        preset_manager = encoder.preset_manager
+        missing = [name for name in preset_names if name not in preset_manager.presets]
+        if missing:
+            raise PresetError(f"Unknown presets: {', '.join(missing)}")
+        presets = [preset_manager.presets[name] for name in preset_names]
+        
+        base_name = Path(input_file).stem
+        if not Path(input_file).is_file() and is_sequence_path(input_file):
+            encoder.use_sequence(find_sequence(input_file, DEFAULT_SEQUENCE_FPS))
+            base_name = encoder.sequence.name
+        video_info = encoder.analyze_video()
+        color_filters = batch_color_filters(encoder, video_info, "auto", "auto")
+        output_files = {preset['name']: preset_manager.get_output_filename(base_name, preset)
+                        for preset in presets}
+        graph = build_encode_graph(encoder, presets, output_files, color_filters, video_info, {})
+        
+        print("\nEncode Plan (nothing is encoded):")
+        print("----------------------------------------")
+        for line in graph.describe():
+            print(line)
+        print("----------------------------------------")
+        return 0
+        
+    except O3EncoderError as e:
+        logger.error(f"Planning error: {str(e)}")
+        return 1
+    finally:
+        if encoder:
+            encoder.cleanup()
+
+def run_watch_mode(config_path: Optional[str]) -> int:
+    root_dir = Path(__file__).parent.parent
+    config_file = Path(config_path) if config_path else root_dir / "watch.ini"
+    
+    encoder = None
+    try:
+        # Environment checks and preset loading happen once for the whole session
+        encoder = O3Encoder("watch")
+        encoder.initialize_environment()
+        preset_manager = encoder.preset_manager
+        
+        settings, rules = load_watch_config(config_file)
+        for rule in rules:
+            missing = [name for name in rule.presets if name not in preset_manager.presets]
+            if missing:
+                raise PresetError(f"Watch folder [{rule.name}] uses unknown presets: {', '.join(missing)}")
+                
+        disk_budget = DiskBudget()
+        throttle = VolumeThrottle()
+        cpu_allocator = CpuAllocator(settings.workers) if settings.pin_cpus and settings.workers > 1 else None
+        
+        def job_runner(input_file: str, rule: WatchRule) -> Dict[str, dict]:
+            presets = [preset_manager.presets[name] for name in rule.presets]
+            # Workers share the console; ffmpeg's output is captured for the log instead
+            return run_batch(input_file, presets, preset_manager, rule.output_dir,
+                             rule.colorspace, rule.colorrange, disk_budget, throttle,
+                             cpu_allocator=cpu_allocator, priority=settings.priority, interactive=False)
+            
+        def estimator(input_file: str, rule: WatchRule) -> float:
+            return estimate_input_seconds(encoder, input_file, [preset_manager.presets[name] for name in rule.presets])
+            
+        daemon = WatchDaemon(rules, job_runner, settings, estimator)
+        daemon.run()
+        return 0
+        
+    except KeyboardInterrupt:
+        logger.info("Watch mode stopped by user")
+        return 130
+    except O3EncoderError as e:
+        logger.error(f"Watch mode error: {str(e)}")
+        return 1
+    finally:
+        if encoder:
+            encoder.cleanup()
+
+def run_service_mode(address: str, max_jobs: int) -> int:
+    encoder = None
+    try:
+        encoder = O3Encoder("service")
+        encoder.initialize_environment()
+        preset_manager = encoder.preset_manager
+        disk_budget = DiskBudget()
+        throttle = VolumeThrottle()
+        cpu_allocator = CpuAllocator(max_jobs) if max_jobs > 1 else None
+        
+        def job_runner(input_file, preset_names, output_dir, colorspace, colorrange,
+                       progress_callback, on_encoder, trim, priority) -> Dict[str, dict]:
+            presets = [preset_manager.presets[name] for name in preset_names]
+            # Rush jobs run their ffmpeg children at normal OS priority, the rest in the background
+            return run_batch(input_file, presets, preset_manager,
+                             Path(output_dir) if output_dir else None, colorspace, colorrange,
+                             disk_budget, throttle, progress_callback, on_encoder, cpu_allocator,
+                             NORMAL_PRIORITY if priority == "urgent" else BACKGROUND_PRIORITY,
+                             interactive=False, trim=trim)
+            
+        def estimator(input_file: str, preset_names: List[str]) -> float:
+            return estimate_input_seconds(encoder, input_file, [preset_manager.presets[name] for name in preset_names])
+            
+        service = JobService(job_runner, list(preset_manager.presets), max_jobs, estimator)
+        asyncio.run(serve(service, address))
+        return 0
+        
+    except KeyboardInterrupt:
+        logger.info("Job service stopped by user")
+        return 130
+    except (O3EncoderError, OSError) as e:
+        logger.error(f"Job service error: {str(e)}")
+        return 1
+    finally:
+        if encoder:
+            encoder.cleanup()
+
+def run_cluster_task(task: dict, progress_callback: Optional[Callable[[dict], None]] = None,
+                     cpu_allocator: Optional[CpuAllocator] = None,
+                     priority: ProcessPriority = BACKGROUND_PRIORITY) -> dict:
+    """Run one task received from a coordinator (worker side).
+    
+    Paths in the task must be reachable from this node (shared storage). The output is
+    written under the attempt's own name; the coordinator renames the accepted one.
+    """
+    encoder = O3Encoder(task['input'])
+    encoder.progress_callback = progress_callback
+    encoder.cpu_allocator = cpu_allocator
+    encoder.priority = priority
+    try:
+        preset = task['preset']
+        output_file = Path(attempt_path(task['output_file'], task.get('attempt', 1)))
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        video_info = task['video_info']
+        encoder.set_crop(CropEstimate(*task['crop']) if task.get('crop') else None)
+        if task.get('scan'):
+            encoder.scan = ScanEstimate(*task['scan'])
+        if task['kind'] == 'segment':
+            encoder.input_range = (task['start'], task['duration'])
+            encoder.encode_video_segment(preset, output_file, task['color_filters'], video_info)
+            return {'success': True, 'output_file': str(output_file)}
+            
+        success = encoder.encode(preset, output_file, task['color_filters'], task['audio_info'], video_info)
+        return {
+            'success': success,
+            'output_file': str(output_file),
+            'passthrough': encoder.passthrough_decisions.get(preset['name'])
+        }
+    except O3EncoderError as e:
+        return {'success': False, 'error': str(e)}
+    finally:
+        encoder.cleanup()
+
+def commit_attempts(tasks: Dict[str, TaskState]):
+    """Rename the accepted attempt of every finished task to its planned output; drop the others.
+    
+    Attempts given up on may still be running somewhere, but they write under their own names.
+    """
+    for state in tasks.values():
+        planned = state.task['output_file']
+        committed = state.attempts if state.status == "done" else None
+        for attempt in range(1, state.attempts + 1):
+            written = attempt_path(planned, attempt)
+            try:
+                if attempt == committed:
+                    os.replace(written, planned)
+                else:
+                    Path(written).unlink(missing_ok=True)
+            except OSError as e:
+                if attempt != committed:
+                    logger.warning(f"Could not remove abandoned attempt {written}: {str(e)}")
+                    continue
+                state.status = "failed"
+                state.errors.append(f"Cannot commit attempt {attempt}: {str(e)}")
+
+def run_coordinator_mode(input_file: str, preset_names: List[str], address: str,
+                         segment_seconds: float, colorspace: str = "auto", colorrange: str = "auto") -> int:
+    encoder = None
+    try:
+        encoder = O3Encoder(os.path.abspath(input_file))
+        encoder.initialize_environment()
+        preset_manager = encoder.preset_manager
+        missing = [name for name in preset_names if name not in preset_manager.presets]
+        if missing:
+            raise PresetError(f"Unknown presets: {', '.join(missing)}")
+        presets = [preset_manager.presets[name] for name in preset_names]
+        
+        # Analysis happens once here; workers receive the results with each task
+        video_info = encoder.analyze_video()
+        # Same rules as run_batch, so a distributed encode gets the same color conversion
+        color_filters = batch_color_filters(encoder, video_info, colorspace, colorrange)
+        try:
+            audio_info = encoder.analyze_audio(presets[0])
+        except Exception as e:
+            logger.warning(f"Audio analysis failed: {str(e)}")
+            audio_info = [track.as_track() for track in encoder.probe_input().audio] or None
+            
+        base_name = Path(input_file).stem
+        output_files = {
+            preset['name']: preset_manager.get_output_filename(base_name, preset).absolute()
+            for preset in presets
+        }
+        check_disk_space(encoder, presets, output_files, video_info)
+        
+        host, port = parse_address(address)
+        coordinator = Coordinator(host, port)
+        # Every segment must be cropped and deinterlaced the same way, so both are decided here too
+        crop = scan = None
+        if any(preset_crops(preset) for preset in presets):
+            crop = encoder.detect_crop(video_info)
+        if any(preset_deinterlacer(preset) for preset in presets):
+            scan = encoder.detect_scan(video_info)
+        base_task = {'input': encoder.input_file, 'color_filters': color_filters,
+                     'video_info': video_info, 'audio_info': audio_info,
+                     'crop': list(crop.rect) if crop else None,
+                     'scan': [scan.kind, scan.field_order] if scan else None}
+        segment_plan: Dict[str, List[Path]] = {}
+        for preset in presets:
+            output_file = output_files[preset['name']]
+            passthrough = encoder.plan_passthrough(preset, video_info, audio_info, color_filters)
+            segments = plan_segments(video_info['duration'], video_info['fps'], segment_seconds)
+            if passthrough['video_copy'] or len(segments) < 2:
+                # Stream copies are cheap, short inputs are not worth splitting
+                cost = 0.0 if passthrough['video_copy'] else encoder.predict_seconds([preset], video_info)
+                coordinator.add_task({**base_task, 'kind': 'preset', 'preset': preset,
+                                      'output_file': str(output_file)}, cost or 0.0)
+                continue
+                
+            # Chunks live next to the output so every node can reach them
+            segment_dir = output_file.with_name(output_file.name + ".segments")
+            segment_dir.mkdir(parents=True, exist_ok=True)
+            segment_plan[preset['name']] = []
+            for number, (start, duration) in enumerate(segments):
+                segment_file = segment_dir / f"{number:05d}.mkv"
+                segment_plan[preset['name']].append(segment_file)
+                cost = encoder.predict_seconds([preset], {**video_info, 'duration': duration})
+                coordinator.add_task({**base_task, 'kind': 'segment', 'preset': preset,
+                                      'output_file': str(segment_file),
+                                      'start': start, 'duration': duration}, cost or 0.0)
+                                      
+        print(f"\nWaiting for workers on {host}:{port} ({len(coordinator.tasks)} tasks)...")
+        tasks = asyncio.run(coordinator.run())
+        commit_attempts(tasks)
+        
+        results = {}
+        for preset in presets:
+            name = preset['name']
+            output_file = output_files[name]
+            states = [state for state in tasks.values() if state.task['preset']['name'] == name]
+            failed = [state for state in states if state.status != "done"]
+            if failed:
+                errors = "; ".join(state.errors[-1] for state in failed if state.errors)
+                results[name] = {'success': False, 'error': errors or "task failed", 'output_file': output_file}
+                continue
+            if name not in segment_plan:
+                result = states[0].result
+                results[name] = {'success': True, 'output_file': output_file,
+                                 'passthrough': result.get('passthrough')}
+                continue
+            try:
+                encoder.assemble_segments(preset, segment_plan[name], output_file, audio_info)
+                results[name] = {'success': True, 'output_file': output_file}
+                shutil.rmtree(segment_plan[name][0].parent, ignore_errors=True)
+            except O3EncoderError as e:
+                logger.error(f"Assembly failed for preset {name}: {str(e)}")
+                results[name] = {'success': False, 'error': str(e), 'output_file': output_file}
+                
+        verify_outputs(encoder, results, presets, video_info)
+        show_encoding_results(results, encoder.prober)
+        return 0 if all(result['success'] for result in results.values()) else 1
+        
+    except KeyboardInterrupt:
+        logger.info("Coordinator stopped by user")
+        return 130
+    except (O3EncoderError, OSError) as e:
+        logger.error(f"Coordinator error: {str(e)}")
+        return 1
+    finally:
+        if encoder:
+            encoder.cleanup()
+
+def run_worker_mode(address: str, slots: int) -> int:
+    encoder = None
+    try:
+        # Check the local ffmpeg build once before accepting work
+        encoder = O3Encoder("worker")
+        encoder.initialize_environment()
+        host, port = parse_address(address)
+        cpu_allocator = CpuAllocator(slots) if slots > 1 else None
+        
+        def task_runner(task: dict, progress_callback: Callable[[dict], None]) -> dict:
+            return run_cluster_task(task, progress_callback, cpu_allocator)
+            
+        asyncio.run(Worker(host, port, task_runner, slots).run())
+        return 0
+        
+    except KeyboardInterrupt:
+        logger.info("Worker stopped by user")
+        return 130
+    except O3EncoderError as e:
+        logger.error(f"Worker error: {str(e)}")
+        return 1
+    finally:
+        if encoder:
+            encoder.cleanup()
+
+def get_sequence_fps() -> str:
+    """Ask for the frame rate of an image sequence; the files do not carry one."""
+    while True:
+        try:
+            value = input(f"\nImage sequence frame rate (e.g. 24, 30000/1001) [{DEFAULT_SEQUENCE_FPS}]: ").strip()
+            if not value:
+                return DEFAULT_SEQUENCE_FPS
+            try:
+                if float(Fraction(value)) > 0:
+                    return value
+            except (ValueError, ZeroDivisionError):
+                pass
+            logger.warning(f"Invalid frame rate: {value}")
+        except EOFError:
+            raise EncodingError("Unexpected end of input")
+        except KeyboardInterrupt:
+            logger.info(f"Operation cancelled by user")
+            raise
+
 def main():
     try:
         print("===============================================")
@@ -1273,6 +3254,92 @@ def main():
         print("===============================================")
         print()
 
+        # Local job-submission service
+        if len(sys.argv) >= 2 and sys.argv[1] == "--serve":
+            args = sys.argv[2:]
+            max_jobs = 1
+            if "--jobs" in args:
+                position = args.index("--jobs")
+                try:
+                    max_jobs = int(args[position + 1])
+                except (IndexError, ValueError):
+                    print("Usage: o3enc --serve [host:port | unix:/path] [--jobs N]")
+                    return 1
+                del args[position:position + 2]
+            return run_service_mode(args[0] if args else DEFAULT_ADDRESS, max_jobs)
+            
+        # Frames streamed on stdin (raw video or YUV4MPEG2), e.g. straight from a renderer
+        if len(sys.argv) >= 2 and sys.argv[1] == "--pipe":
+            args = sys.argv[2:]
+            values = {"--size": None, "--pix-fmt": None, "--fps": None}
+            for flag in values:
+                if flag in args:
+                    position = args.index(flag)
+                    if position + 1 >= len(args):
+                        args = []
+                        break
+                    values[flag] = args[position + 1]
+                    del args[position:position + 2]
+            if len(args) != 3 or args[0] not in ("raw", "y4m"):
+                print("Usage: o3enc --pipe y4m <output_name> <preset[,preset...]>")
+                print("       o3enc --pipe raw <output_name> <preset[,preset...]> "
+                      "--size WxH --pix-fmt FORMAT --fps RATE")
+                return 1
+            preset_names = [name.strip() for name in args[2].split(",") if name.strip()]
+            return run_pipe_mode(args[0], args[1], preset_names,
+                                 values["--size"], values["--pix-fmt"], values["--fps"])
+            
+        # Distributed encoding: coordinator splits the work, workers encode
+        if len(sys.argv) >= 2 and sys.argv[1] == "--coordinator":
+            args = sys.argv[2:]
+            segment_seconds = 60.0
+            if "--segment" in args:
+                position = args.index("--segment")
+                try:
+                    segment_seconds = float(args[position + 1])
+                except (IndexError, ValueError):
+                    args = []
+                else:
+                    del args[position:position + 2]
+            if len(args) != 3:
+                print("Usage: o3enc --coordinator host:port <input_file> <preset[,preset...]> [--segment SECONDS]")
+                return 1
+            if not os.path.exists(args[1]):
+                print(f"Error: Input file not found: {args[1]}")
+                return 1
+            preset_names = [name.strip() for name in args[2].split(",") if name.strip()]
+            return run_coordinator_mode(args[1], preset_names, args[0], segment_seconds)
+            
+        if len(sys.argv) >= 2 and sys.argv[1] == "--worker":
+            args = sys.argv[2:]
+            slots = 1
+            if "--slots" in args:
+                position = args.index("--slots")
+                try:
+                    slots = int(args[position + 1])
+                except (IndexError, ValueError):
+                    args = []
+                else:
+                    del args[position:position + 2]
+            if len(args) != 1:
+                print("Usage: o3enc --worker host:port [--slots N]")
+                return 1
+            return run_worker_mode(args[0], slots)
+            
+        # Dry run: print the steps, their estimates and the critical path
+        if len(sys.argv) >= 2 and sys.argv[1] == "--plan":
+            args = sys.argv[2:]
+            if len(args) != 2:
+                print("Usage: o3enc --plan <input_file> <preset[,preset...]>")
+                return 1
+            preset_names = [name.strip() for name in args[1].split(",") if name.strip()]
+            return run_plan_mode(args[0], preset_names)
+            
+        # Long-running watch-folder mode
+        if len(sys.argv) >= 2 and sys.argv[1] == "--watch":
+            config_path = sys.argv[2] if len(sys.argv) > 2 else None
+            return run_watch_mode(config_path)
+            
         # Check arguments
         if len(sys.argv) == 1 or (len(sys.argv) == 2 and sys.argv[1] == "--init"):
             try:
@@ -1285,14 +3352,28 @@ def main():
                 input("\nPress Enter to continue...")
                 return 1
 
-        # Process input file
-        if len(sys.argv) != 2:
-            print("Usage: o3enc <input_file>")
+        # Process input file, optionally only a time range of it
+        args = sys.argv[1:]
+        trim = None
+        if "--trim" in args:
+            position = args.index("--trim")
+            try:
+                start, end = args[position + 1:position + 3]
+                trim = (parse_timestamp(start), None if end.lower() == "end" else parse_timestamp(end))
+            except ValueError:
+                args = []
+            else:
+                del args[position:position + 3]
+        if len(args) != 1:
+            print("Usage: o3enc <input_file> [--trim START END]")
+            print("       START/END as seconds or [HH:]MM:SS[.ms]; END may be 'end'")
             input("\nPress Enter to continue...")
             return 1
 
-        input_file = sys.argv[1]
-        if not os.path.exists(input_file):
+        input_file = args[0]
+        # A frame directory, a pattern such as shot_%04d.exr or one numbered frame
+        is_sequence = not os.path.isfile(input_file) and is_sequence_path(input_file)
+        if not is_sequence and not os.path.exists(input_file):
             print(f"Error: Input file not found: {input_file}")
             input("\nPress Enter to continue...")
             return 1
@@ -1303,20 +3384,21 @@ def main():
             # Initialize encoder and analyze video
             encoder = O3Encoder(input_file)
             encoder.initialize_environment()
+            if is_sequence:
+                encoder.use_sequence(find_sequence(input_file, get_sequence_fps()))
             video_info = encoder.analyze_video()
+            if trim is not None:
+                video_info = encoder.set_trim(*trim, video_info)
             colorspace, colorrange = encoder.get_color_settings(video_info)
 
             # Set up color filters
-            color_filters = ""
-            if colorspace != "auto":
-                color_filters = "colorspace=all=bt709:iall=" + colorspace
-                if colorrange in ["tv", "pc"]:
-                    color_filters += f":range={colorrange}:irange={colorrange}"
+            color_filters = build_color_filters(colorspace, colorrange)
 
             while True:  # Main selection loop
                 try:
                     selected_presets = encoder.preset_manager.show_preset_menu()
-                    base_name = encoder.preset_manager.get_base_filename(input_file)
+                    base_name = encoder.preset_manager.get_base_filename(
+                        encoder.sequence.name if encoder.sequence else input_file)
 
                     # Generate output filenames
                     output_files = {}
@@ -1330,43 +3412,29 @@ def main():
                     # Show encoding preview
                     print("\nEncoding Preview:")
                     print("----------------------------------------")
-                    show_encoding_preview(selected_presets, output_files, video_info)
+                    crop = scan = None
+                    if any(preset_crops(preset) for preset in selected_presets):
+                        crop = encoder.detect_crop(video_info)
+                    if any(preset_deinterlacer(preset) for preset in selected_presets):
+                        scan = encoder.detect_scan(video_info)
+                    show_encoding_preview(selected_presets, output_files, video_info, crop, scan,
+                                          encoder.history)
 
                     while True:
                         try:
                             answer = input("\nProceed with encoding? (Y/N): ").strip().upper()
                             if answer == 'Y':
-                                # Start encoding process
-                                audio_info = None
-                                try:
-                                    audio_info = encoder.analyze_audio(selected_presets[0])
-                                except Exception as e:
-                                    logger.warning(f"Audio analysis failed: {str(e)}")
-                                    logger.info(f"Continuing without audio normalization...")
+                                # Make sure the whole batch fits before launching anything
+                                check_disk_space(encoder, selected_presets, output_files, video_info)
                                 
-                                # Process each preset
+                                # Loudness, passes and verification run as a graph of steps
                                 results = {}
-                                for preset in selected_presets:
-                                    try:
-                                        output_file = output_files[preset['name']]
-                                        success = encoder.encode(preset, output_file, 
-                                                              color_filters, audio_info, 
-                                                              video_info)
-                                        results[preset['name']] = {
-                                            'success': success,
-                                            'output_file': output_file
-                                        }
-                                    except Exception as e:
-                                        logger.error(f"Encoding failed for preset "
-                                                   f"{preset['name']}: {str(e)}")
-                                        results[preset['name']] = {
-                                            'success': False,
-                                            'error': str(e),
-                                            'output_file': output_file
-                                        }
-
+                                graph = build_encode_graph(encoder, selected_presets, output_files,
+                                                           color_filters, video_info, results)
+                                run_encode_graph(graph, selected_presets, results)
+                                
                                 # Show results
-                                show_encoding_results(results, encoder.ffprobe)
+                                show_encoding_results(results, encoder.prober)
                                 input("\nPress Enter to continue...")
                                 return 0
                                 
@@ -1416,4 +3484,6 @@ def main():
         return 1
 
 if __name__ == "__main__":
+    configure_logging()
+    install_interrupt_handler(shared_runner())
     sys.exit(main())
\ No newline at end of file
@@ -44,8 +44,13 @@ echo                            -b:v                : Target bitrate (e.g. 6000k
 echo                            -maxrate:v          : Maximum bitrate
 echo                            -bufsize:v          : Buffer size (typically 2x maxrate^)
 echo.
+echo passthrough=^<bool^>     : Copy streams that already match the preset instead of re-encoding (default true^)
+echo.
 echo audio_codec=<codec>      : Audio codec (aac, libopus, libvorbis^)
 echo audio_bitrate=<bitrate>  : Audio bitrate (e.g. 128k^)
+echo audio_channels=^<n^>     : Output channels per audio track (default 2, empty for source^)
+echo audio_tracks=^<list^>    : Audio tracks to keep (all, or track numbers/languages e.g. 0,2 or jpn,eng^)
+echo subtitles=^<bool^>       : Keep subtitle tracks (default true^)
 echo target_lufs=^<LUFS^>     : Target loudness (-18 LUFS^)
 echo target_lra=^<LU^>        : Loudness range (7 LU^)
 echo target_tp=^<dB^>         : True peak (-2 dB^)
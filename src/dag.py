@@ -0,0 +1,202 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from errors import O3EncoderError
+
+logger = logging.getLogger("o3enc.dag")
+
+class GraphError(O3EncoderError):
+    pass
+
+@dataclass(slots=True)
+class Task:
+    name: str
+    run: Callable[[], Any]
+    deps: List[str] = field(default_factory=list)
+    # Resource name -> units held while running; see TaskGraph.run(limits)
+    resources: Dict[str, int] = field(default_factory=dict)
+    estimate: float = 0.0            # expected seconds, for ordering and the critical path
+    status: str = "pending"          # pending, running, done, failed, skipped
+    result: Any = None
+    error: Optional[str] = None
+    started: Optional[float] = None
+    finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+class TaskGraph:
+    """Tasks with dependencies, run as soon as their dependencies are done and resources allow.
+
+    Ready tasks start in order of the longest estimated path to the end of the graph, so
+    the critical path is never waiting behind shorter work. When a task fails, every task
+    depending on it is skipped; independent tasks still run.
+    """
+
+    def __init__(self, on_interrupt: Optional[Callable[[], None]] = None):
+        self.tasks: Dict[str, Task] = {}
+        self._cancelled = threading.Event()
+        # Stops the work of running tasks (e.g. O3Encoder.cancel) when run() is interrupted
+        self.on_interrupt = on_interrupt
+
+    def add(self, name: str, run: Callable[[], Any], deps: Optional[List[str]] = None,
+            resources: Optional[Dict[str, int]] = None, estimate: float = 0.0) -> Task:
+        if name in self.tasks:
+            raise GraphError(f"Duplicate task: {name}")
+        task = Task(name=name, run=run, deps=list(deps or []), resources=dict(resources or {}),
+                    estimate=max(0.0, estimate))
+        self.tasks[name] = task
+        return task
+
+    def order(self) -> List[Task]:
+        """Tasks in dependency order; raises GraphError on unknown dependencies or cycles."""
+        for task in self.tasks.values():
+            missing = [dep for dep in task.deps if dep not in self.tasks]
+            if missing:
+                raise GraphError(f"Task {task.name} depends on unknown task(s): {', '.join(missing)}")
+        ordered: List[Task] = []
+        state: Dict[str, int] = {}    # 1 = visiting, 2 = done
+
+        def visit(task: Task, path: List[str]):
+            if state.get(task.name) == 2:
+                return
+            if state.get(task.name) == 1:
+                raise GraphError(f"Dependency cycle: {' -> '.join(path + [task.name])}")
+            state[task.name] = 1
+            for dep in task.deps:
+                visit(self.tasks[dep], path + [task.name])
+            state[task.name] = 2
+            ordered.append(task)
+
+        for task in self.tasks.values():
+            visit(task, [])
+        return ordered
+
+    def _tails(self) -> Dict[str, float]:
+        """Longest estimated seconds from the start of each task to the end of the graph."""
+        dependents: Dict[str, List[str]] = {name: [] for name in self.tasks}
+        for task in self.tasks.values():
+            for dep in task.deps:
+                dependents[dep].append(task.name)
+        tails: Dict[str, float] = {}
+        for task in reversed(self.order()):
+            tails[task.name] = task.estimate + max((tails[name] for name in dependents[task.name]), default=0.0)
+        return tails
+
+    def critical_path(self) -> Tuple[List[Task], float]:
+        """Chain of tasks with the longest total estimate, and that total."""
+        finish: Dict[str, float] = {}
+        previous: Dict[str, Optional[str]] = {}
+        for task in self.order():
+            before = max(task.deps, key=lambda dep: finish[dep], default=None)
+            finish[task.name] = (finish[before] if before else 0.0) + task.estimate
+            previous[task.name] = before
+        if not finish:
+            return [], 0.0
+        name: Optional[str] = max(finish, key=finish.get)
+        total = finish[name]
+        path = []
+        while name is not None:
+            path.append(self.tasks[name])
+            name = previous[name]
+        return list(reversed(path)), total
+
+    def describe(self) -> List[str]:
+        """Printable plan: every task with its dependencies and estimate, then the critical path."""
+        lines = []
+        for task in self.order():
+            resources = ", ".join(f"{name}={units}" for name, units in task.resources.items())
+            lines.append(f"{task.name:<28} {task.estimate:>8.1f}s  [{resources or '-'}]"
+                         + (f"  after {', '.join(task.deps)}" if task.deps else ""))
+        path, total = self.critical_path()
+        lines.append("")
+        lines.append(f"Critical path ({total:.1f}s): {' -> '.join(task.name for task in path)}")
+        lines.append(f"Sequential total: {sum(task.estimate for task in self.tasks.values()):.1f}s")
+        return lines
+
+    def cancel(self):
+        """Start no further tasks; running ones finish (their own cancellation is up to the caller)."""
+        self._cancelled.set()
+
+    def run(self, limits: Optional[Dict[str, int]] = None, max_workers: Optional[int] = None) -> Dict[str, Task]:
+        """Run every task; limits caps the units of each resource in use at once (unlisted = unlimited)."""
+        limits = dict(limits or {})
+        ordered = self.order()
+        tails = self._tails()
+        in_use: Dict[str, int] = {name: 0 for name in limits}
+        running: Dict[Future, Task] = {}
+
+        def fits(task: Task) -> bool:
+            return all(in_use[name] + units <= limits[name]
+                       for name, units in task.resources.items() if name in limits)
+
+        def hold(task: Task, sign: int):
+            for name, units in task.resources.items():
+                if name in in_use:
+                    in_use[name] += sign * units
+
+        def execute(task: Task):
+            task.started = time.monotonic()
+            try:
+                return task.run()
+            finally:
+                task.finished = time.monotonic()
+
+        workers = max_workers or max(1, len(self.tasks))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="o3enc-task") as executor:
+            try:
+                while True:
+                    # Dependency order, so a skip reaches every task further down in one sweep
+                    for task in ordered:
+                        if task.status != "pending":
+                            continue
+                        if self._cancelled.is_set():
+                            task.status, task.error = "skipped", "cancelled"
+                        elif any(self.tasks[dep].status in ("failed", "skipped") for dep in task.deps):
+                            task.status, task.error = "skipped", "dependency failed"
+
+                    ready = [task for task in ordered if task.status == "pending"
+                             and all(self.tasks[dep].status == "done" for dep in task.deps)]
+                    for task in sorted(ready, key=lambda task: tails[task.name], reverse=True):
+                        if fits(task):
+                            hold(task, 1)
+                            task.status = "running"
+                            logger.info(f"Task {task.name} started")
+                            running[executor.submit(execute, task)] = task
+
+                    if not running:
+                        for task in ordered:
+                            if task.status == "pending":
+                                # Only possible when a task needs more units than its resource limit
+                                task.status, task.error = "failed", "resource limit too small"
+                        break
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task = running.pop(future)
+                        hold(task, -1)
+                        try:
+                            task.result = future.result()
+                            task.status = "done"
+                            logger.info(f"Task {task.name} done ({task.elapsed:.1f}s)")
+                        except Exception as e:
+                            task.status, task.error = "failed", str(e)
+                            logger.error(f"Task {task.name} failed: {str(e)}")
+            except BaseException:
+                # e.g. Ctrl+C: nothing new starts and running tasks are stopped, not waited out
+                self.cancel()
+                if self.on_interrupt is not None:
+                    try:
+                        self.on_interrupt()
+                    except Exception as e:
+                        logger.error(f"Interrupt handler failed: {str(e)}")
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+        return self.tasks
@@ -0,0 +1,30 @@
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger("o3enc")
+
+class O3EncoderError(Exception):
+    pass
+
+class InitializationError(O3EncoderError):
+    pass
+
+class VideoAnalysisError(O3EncoderError):
+    pass
+
+class AudioAnalysisError(O3EncoderError):
+    pass
+
+class EncodingError(O3EncoderError):
+    pass
+
+class PresetError(O3EncoderError):
+    pass
+
+@contextmanager
+def error_context(error_msg: str, error_class=O3EncoderError):
+    try:
+        yield
+    except Exception as e:
+        logger.error(f"{error_msg}: {str(e)}")
+        raise error_class(f"{error_msg}: {str(e)}") from e
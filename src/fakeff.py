@@ -0,0 +1,382 @@
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Stand-in for ffmpeg and ffprobe that simulates work instead of decoding anything.
+# O3Encoder runs it when O3ENC_FFMPEG/O3ENC_FFPROBE point at the launchers written by
+# write_launchers(); loadtest.py drives whole batches through it.
+#
+#   python fakeff.py ffmpeg|ffprobe <config.json> <arguments...>
+#
+# Files it writes start with a JSON header describing the simulated media and are then
+# extended sparsely to the size the bitrate implies, so ffprobe answers for them and
+# disk usage stays small. Anything else is described by the "source" settings.
+
+HEADER_MAGIC = b"#o3enc-fake "
+VERSION = "ffmpeg version fake-1.0 Copyright (c) o3enc stand-in"
+
+DEFAULT_CONFIG = {
+    "speed": 100.0,              # Encodes run at this multiple of realtime
+    "copy_speed": 2000.0,        # Stream copies and remuxes
+    "analysis_speed": 1000.0,    # Outputs to -f null: sampling, loudness, verification
+    "progress_interval": 0.5,    # Seconds between -progress blocks
+    "fail_rate": 0.0,            # Chance that a step writing a file fails
+    "fail_match": "",            # Steps whose command line contains this always fail
+    "size_scale": 1.0,           # Factor on the bitrate based output size
+    "log": None,                 # JSON lines file receiving one record per invocation
+    "source": {
+        "duration": 60.0,
+        "width": 1920,
+        "height": 1080,
+        "fps": "30/1",
+        "codec": "h264",
+        "pix_fmt": "yuv420p",
+        "color_space": "bt709",
+        "color_range": "tv",
+        "bit_rate": 8000000,
+        "audio_tracks": 1,
+        "audio_codec": "aac",
+        "audio_bit_rate": 192000,
+        "gop": 2.0,              # Seconds between keyframes
+        "loudness": -23.0,       # Integrated loudness reported by loudnorm (LUFS)
+    },
+}
+
+ENCODER_CODECS = [("264", "h264"), ("hevc", "hevc"), ("265", "hevc"), ("av1", "av1"), ("vp9", "vp9"),
+                  ("vpx", "vp8"), ("prores", "prores"), ("ffv1", "ffv1"), ("utvideo", "utvideo"),
+                  ("rawvideo", "rawvideo"), ("dnxhd", "dnxhd")]
+
+def load_config(path: str) -> dict:
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    with open(path, encoding="utf-8") as f:
+        overrides = json.load(f)
+    config["source"].update(overrides.pop("source", {}))
+    config.update(overrides)
+    return config
+
+def write_launchers(directory: Path, config: dict) -> Tuple[Path, Path]:
+    """Write config.json plus ffmpeg/ffprobe launchers running this script; returns their paths."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    config_file = directory / "fake-config.json"
+    config_file.write_text(json.dumps(config, indent=2), encoding="utf-8")
+    script = Path(__file__).resolve()
+    launchers = []
+    for tool in ("ffmpeg", "ffprobe"):
+        if sys.platform == "win32":
+            launcher = directory / f"{tool}.bat"
+            launcher.write_text(f'@"{sys.executable}" "{script}" {tool} "{config_file}" %*\r\n', encoding="utf-8")
+        else:
+            launcher = directory / tool
+            launcher.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{script}" {tool} "{config_file}" "$@"\n',
+                                encoding="utf-8")
+            launcher.chmod(0o755)
+        launchers.append(launcher)
+    return launchers[0], launchers[1]
+
+def parse_rate(value) -> float:
+    numerator, _, denominator = str(value).partition("/")
+    try:
+        return float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+def describe(path: str, config: dict) -> Optional[dict]:
+    """Simulated media of a file: its header if this script wrote it, else the configured source."""
+    try:
+        with open(path, "rb") as f:
+            first = f.readline()
+    except OSError:
+        return None
+    if first.startswith(HEADER_MAGIC):
+        return json.loads(first[len(HEADER_MAGIC):])
+    return dict(config["source"])
+
+def write_output(path: str, media: dict, size: int):
+    header = HEADER_MAGIC + json.dumps(media).encode("utf-8") + b"\n"
+    with open(path, "wb") as f:
+        f.write(header)
+        f.truncate(max(len(header), size))
+
+def split_args(args: List[str]) -> Tuple[List[dict], Dict[str, str], List[str]]:
+    """(inputs with their options, last value of each output option, arguments after the last input)."""
+    inputs = []
+    pending: Dict[str, str] = {}
+    output_options: Dict[str, str] = {}
+    output_start = 0
+    flags = {"-y", "-n", "-nostats", "-stats", "-hide_banner", "-an", "-sn", "-dn", "-vn", "-shortest",
+             "-nostdin", "-copyts", "-re"}
+    index = 0
+    while index < len(args) - 1:
+        arg = args[index]
+        if arg in flags:
+            index += 1
+            continue
+        value = args[index + 1]
+        if arg == "-i":
+            inputs.append({"path": value, **pending})
+            pending = {}
+            output_options = {}
+            output_start = index + 2
+        else:
+            pending[arg] = value
+            output_options[arg] = value
+        index += 2
+    return inputs, output_options, args[output_start:]
+
+def input_duration(source: dict, config: dict) -> Tuple[float, dict]:
+    """Seconds read from one input after -ss/-t, and the media it describes."""
+    path = source["path"]
+    if source.get("-f") == "lavfi":
+        return 1.0, {**config["source"], "duration": 1.0, "audio_tracks": 0}
+    if source.get("-f") == "concat":
+        total, media = 0.0, None
+        for line in Path(path).read_text(encoding="utf-8").splitlines():
+            match = re.match(r"file '(.*)'$", line.strip())
+            if match:
+                piece = describe(match.group(1).replace("'\\''", "'"), config) or {}
+                media = media or piece
+                total += float(piece.get("duration", 0.0))
+        media = dict(media or config["source"])
+    else:
+        media = describe(path, config)
+        if media is None:
+            raise FileNotFoundError(path)
+        total = float(media["duration"])
+    start = float(source.get("-ss", 0.0))
+    duration = max(0.0, total - start)
+    if "-t" in source:
+        duration = min(duration, float(source["-t"]))
+    return duration, media
+
+def output_media(media: dict, options: Dict[str, str], output_args: List[str], duration: float) -> dict:
+    maps = [value for flag, value in zip(output_args, output_args[1:]) if flag == "-map"]
+    result = {**media, "duration": duration,
+              "audio_tracks": sum(1 for value in maps if ":a" in value) if maps else media.get("audio_tracks", 0)}
+    encoder = options.get("-c:v", "copy")
+    if encoder != "copy":
+        result["codec"] = next((codec for key, codec in ENCODER_CODECS if key in encoder), encoder)
+        bitrate = options.get("-b:v")
+        if bitrate:
+            multiplier = {"k": 1000, "m": 1000 ** 2}.get(bitrate[-1].lower(), 1)
+            result["bit_rate"] = int(float(bitrate.rstrip("kKmM")) * multiplier)
+    video_filter = options.get("-vf", "")
+    scale = re.search(r"scale=(-?\d+):(-?\d+)", video_filter)
+    if scale:
+        width, height = int(scale.group(1)), int(scale.group(2))
+        if height > 0:
+            result["width"] = width if width > 0 else round(media["width"] * height / media["height"] / 2) * 2
+            result["height"] = height
+    fmt = re.search(r"format=(\w+)", video_filter)
+    if fmt:
+        result["pix_fmt"] = fmt.group(1)
+    if "-pix_fmt" in options:
+        result["pix_fmt"] = options["-pix_fmt"]
+    if "-r" in options:
+        result["fps"] = options["-r"]
+    if "-an" in output_args:
+        result["audio_tracks"] = 0
+    return result
+
+def filter_lines(video_filter: str, audio_filter: str, media: dict, frames: int) -> List[str]:
+    """What ffmpeg's analysis filters print on stderr."""
+    lines = []
+    width, height = int(media["width"]), int(media["height"])
+    if "cropdetect" in video_filter:
+        for frame in range(frames):
+            lines.append(f"[Parsed_cropdetect_0 @ 0x0] x1:0 x2:{width - 1} y1:0 y2:{height - 1} "
+                         f"w:{width} h:{height} x:0 y:0 pts:{frame} t:{frame / 30:.6f} crop={width}:{height}:0:0")
+    if "signalstats" in video_filter:
+        for frame in range(frames):
+            lines.append(f"[Parsed_metadata_1 @ 0x0] frame:{frame}    pts:{frame}    pts_time:{frame / 30:.6f}")
+            for key, value in (("YMIN", 16), ("YMAX", 235), ("UMIN", 16), ("UMAX", 240),
+                               ("VMIN", 16), ("VMAX", 240), ("YAVG", 110)):
+                lines.append(f"[Parsed_metadata_1 @ 0x0] lavfi.signalstats.{key}={value}")
+    if "idet" in video_filter:
+        lines.append(f"[Parsed_idet_0 @ 0x0] Repeated Fields: Neither: {frames} Top: 0 Bottom: 0")
+        lines.append(f"[Parsed_idet_0 @ 0x0] Multi frame detection: TFF: 0 BFF: 0 "
+                     f"Progressive: {frames} Undetermined: 0")
+    if "loudnorm" in audio_filter and "print_format=json" in audio_filter:
+        loudness = float(media.get("loudness", -23.0))
+        lines += ["[Parsed_loudnorm_0 @ 0x0] ", json.dumps({
+            "input_i": f"{loudness:.2f}", "input_tp": "-3.00", "input_lra": "6.00",
+            "input_thresh": f"{loudness - 10:.2f}", "output_i": "-18.00", "output_tp": "-2.00",
+            "output_lra": "5.00", "output_thresh": "-28.00", "normalization_type": "dynamic",
+            "target_offset": "0.00"}, indent=1)]
+    return lines
+
+def ebur128_lines(media: dict, start: float, duration: float) -> List[str]:
+    """ametadata print output of ebur128=metadata=1 for 100 ms blocks from start on.
+
+    Loudness follows the absolute block number, so shards of a file agree with one pass;
+    blocks without a full 400 ms / 3 s history in this process are -inf as in ffmpeg.
+    """
+    loudness = float(media.get("loudness", -23.0))
+    first = round(start * 10)
+    lines = []
+    for frame in range(int(duration * 10)):
+        block = first + frame
+        momentary = loudness + 6.0 * math.sin(block / 37.0) if frame >= 3 else float("-inf")
+        short_term = loudness + 3.0 * math.sin(block / 91.0) if frame >= 29 else float("-inf")
+        lines += [f"frame:{frame}    pts:{frame * 4800}    pts_time:{frame / 10}",
+                  f"lavfi.r128.M={momentary:.3f}", f"lavfi.r128.S={short_term:.3f}",
+                  f"lavfi.r128.true_peaks_ch0={10 ** ((loudness + 20.0 + math.sin(block / 53.0)) / 20):.6f}"]
+    return lines
+
+def run_ffmpeg(args: List[str], config: dict) -> int:
+    if "-version" in args:
+        print(VERSION)
+        return 0
+    inputs, options, output_args = split_args(args)
+    output = args[-1]
+    if not inputs:
+        print("At least one output file must be specified", file=sys.stderr)
+        return 1
+    try:
+        duration, media = input_duration(inputs[0], config)
+    except (OSError, ValueError) as e:
+        print(f"{inputs[0]['path']}: No such file or directory ({e})", file=sys.stderr)
+        return 1
+    fps = parse_rate(media.get("fps", "30/1")) or 30.0
+    if "-t" in options and "-t" not in inputs[0]:
+        duration = min(duration, float(options["-t"]))
+    frame_limit = options.get("-frames:v") or options.get("-vframes")
+    if frame_limit:
+        duration = min(duration, int(frame_limit) / fps)
+    frames = max(1, round(duration * fps))
+
+    null_output = options.get("-f") == "null" or output in ("-", "NUL", "/dev/null")
+    encoder = options.get("-c:v", "copy")
+    if null_output:
+        speed = config["analysis_speed"]
+    elif encoder == "copy" or "-f" in inputs[0] and inputs[0]["-f"] == "concat":
+        speed = config["copy_speed"]
+    else:
+        speed = config["speed"]
+    work = duration / speed if speed > 0 else 0.0
+
+    command = " ".join(args)
+    fails = not null_output and (random.random() < config["fail_rate"]
+                                 or (config["fail_match"] and config["fail_match"] in command))
+    if fails:
+        work *= random.random()
+
+    progress = "-progress" in args and args[args.index("-progress") + 1] == "pipe:1"
+    stats = "-stats" in args and "-nostats" not in args
+    interval = max(0.01, config["progress_interval"])
+    # Only time spent awake counts, so a suspended stand-in makes no progress, like ffmpeg
+    elapsed, last = 0.0, time.monotonic()
+    while True:
+        now = time.monotonic()
+        elapsed += min(now - last, interval * 2)
+        last = now
+        done = min(1.0, elapsed / work) if work > 0 else 1.0
+        frame = int(frames * done)
+        if progress:
+            sys.stdout.write(f"frame={frame}\nfps={fps:.2f}\nout_time_us={int(duration * done * 1e6)}\n"
+                             f"speed={speed:.1f}x\nprogress={'end' if done >= 1.0 else 'continue'}\n")
+            sys.stdout.flush()
+        elif stats:
+            sys.stderr.write(f"frame={frame} fps={fps:.0f} time={duration * done:.2f} speed={speed:.1f}x\r")
+            sys.stderr.flush()
+        if done >= 1.0:
+            break
+        time.sleep(min(interval, max(0.0, work - elapsed)))
+
+    if fails:
+        print("Error while encoding: injected failure (fake ffmpeg)", file=sys.stderr)
+        return 1
+    for line in filter_lines(options.get("-vf", "") or options.get("-filter:v", ""),
+                             options.get("-af", ""), media, frames):
+        print(line, file=sys.stderr)
+    audio_filter = options.get("-af", "")
+    if "ebur128" in audio_filter and "ametadata" in audio_filter:
+        print("\n".join(ebur128_lines(media, float(inputs[0].get("-ss", 0.0)), duration)))
+
+    if options.get("-pass") == "1":
+        prefix = options.get("-passlogfile", "ffmpeg2pass")
+        for suffix in ("-0.log", "-0.log.mbtree"):
+            Path(prefix + suffix).write_text("fake first-pass statistics\n", encoding="utf-8")
+    if not null_output:
+        result = output_media(media, options, output_args, duration)
+        size = int(result.get("bit_rate", 0) * duration / 8
+                   + result.get("audio_tracks", 0) * result.get("audio_bit_rate", 0) * duration / 8)
+        write_output(output, result, int(size * config["size_scale"]))
+    return 0
+
+def probe_json(path: str, media: dict) -> dict:
+    duration = float(media["duration"])
+    streams = [{
+        "index": 0, "codec_type": "video", "codec_name": media["codec"],
+        "width": int(media["width"]), "height": int(media["height"]),
+        "r_frame_rate": str(media["fps"]), "avg_frame_rate": str(media["fps"]),
+        "pix_fmt": media["pix_fmt"], "color_space": media.get("color_space", "unknown"),
+        "color_range": media.get("color_range", "unknown"), "color_transfer": media.get("color_space", "unknown"),
+        "color_primaries": media.get("color_space", "unknown"), "field_order": "progressive",
+        "bit_rate": str(media.get("bit_rate", 0)), "duration": f"{duration:.6f}", "start_time": "0.000000",
+        "nb_frames": str(round(duration * (parse_rate(media["fps"]) or 30.0))),
+    }]
+    for track in range(int(media.get("audio_tracks", 0))):
+        streams.append({
+            "index": track + 1, "codec_type": "audio", "codec_name": media.get("audio_codec", "aac"),
+            "channels": 2, "sample_rate": "48000", "bit_rate": str(media.get("audio_bit_rate", 192000)),
+            "duration": f"{duration:.6f}", "start_time": "0.000000",
+            "tags": {"language": "eng"}, "disposition": {"default": int(track == 0)},
+        })
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = 0
+    if size <= 1024:
+        size = int(media.get("bit_rate", 0) * duration / 8)
+    return {"streams": streams, "chapters": [], "format": {
+        "format_name": "matroska,webm", "duration": f"{duration:.6f}", "size": str(size),
+        "bit_rate": str(media.get("bit_rate", 0)), "start_time": "0.000000"}}
+
+def run_ffprobe(args: List[str], config: dict) -> int:
+    if "-version" in args:
+        print(VERSION.replace("ffmpeg", "ffprobe", 1))
+        return 0
+    path = args[-1]
+    media = describe(path, config)
+    if media is None:
+        print(f"{path}: No such file or directory", file=sys.stderr)
+        return 1
+    if "-show_entries" in args and "packet" in args[args.index("-show_entries") + 1]:
+        # Keyframe scan: only keyframe packets are listed, which is all the caller keeps
+        start, end = 0.0, float(media["duration"])
+        if "-read_intervals" in args:
+            low, _, high = args[args.index("-read_intervals") + 1].partition("%")
+            start, end = float(low or 0.0), float(high or end)
+        gop = float(media.get("gop", 2.0)) or 2.0
+        keyframe = int(start / gop) * gop
+        while keyframe <= min(end, float(media["duration"])):
+            print(f"{keyframe:.6f},K__")
+            keyframe += gop
+        return 0
+    print(json.dumps(probe_json(path, media)))
+    return 0
+
+def main(argv: List[str]) -> int:
+    if len(argv) < 2 or argv[0] not in ("ffmpeg", "ffprobe"):
+        print("Usage: fakeff.py ffmpeg|ffprobe <config.json> [arguments...]", file=sys.stderr)
+        return 2
+    tool, config = argv[0], load_config(argv[1])
+    started = time.time()
+    returncode = run_ffmpeg(argv[2:], config) if tool == "ffmpeg" else run_ffprobe(argv[2:], config)
+    if config.get("log"):
+        record = {"tool": tool, "pid": os.getpid(), "args": argv[2:], "start": started,
+                  "end": time.time(), "returncode": returncode}
+        # One write per record; appends of a single short line do not interleave
+        with open(config["log"], "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    return returncode
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
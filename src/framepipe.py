@@ -0,0 +1,262 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from errors import VideoAnalysisError
+from runner import ProcessRunner
+
+logger = logging.getLogger("o3enc.framepipe")
+
+# Frames buffered per encoder before the producer is made to wait
+DEFAULT_QUEUE_FRAMES = 8
+
+# Bytes per pixel of packed formats
+PACKED_FORMATS = {
+    "gray": 1, "gray16le": 2, "rgb24": 3, "bgr24": 3, "rgba": 4, "bgra": 4,
+    "argb": 4, "abgr": 4, "rgb48le": 6, "bgr48le": 6, "rgba64le": 8,
+}
+
+# Planar YUV formats: (bytes per sample, horizontal chroma shift, vertical chroma shift)
+PLANAR_FORMATS = {
+    "yuv420p": (1, 1, 1), "yuv422p": (1, 1, 0), "yuv444p": (1, 0, 0),
+    "yuv420p10le": (2, 1, 1), "yuv422p10le": (2, 1, 0), "yuv444p10le": (2, 0, 0),
+    "yuv420p12le": (2, 1, 1), "yuv422p12le": (2, 1, 0), "yuv444p12le": (2, 0, 0),
+    "yuv420p16le": (2, 1, 1), "yuv444p16le": (2, 0, 0),
+}
+
+# YUV4MPEG2 'C' tags
+Y4M_COLORSPACES = {
+    "420jpeg": "yuv420p", "420paldv": "yuv420p", "420mpeg2": "yuv420p", "420": "yuv420p",
+    "422": "yuv422p", "444": "yuv444p", "mono": "gray", "mono16": "gray16le",
+    "420p10": "yuv420p10le", "422p10": "yuv422p10le", "444p10": "yuv444p10le",
+    "420p12": "yuv420p12le", "422p12": "yuv422p12le", "444p12": "yuv444p12le",
+    "420p16": "yuv420p16le", "444p16": "yuv444p16le",
+}
+
+@dataclass(slots=True)
+class FrameFormat:
+    width: int
+    height: int
+    pix_fmt: str
+    fps: Fraction
+    colorrange: str = "unknown"
+
+    def __post_init__(self):
+        if self.width <= 0 or self.height <= 0:
+            raise VideoAnalysisError(f"Invalid frame size: {self.width}x{self.height}")
+        if self.pix_fmt not in PACKED_FORMATS and self.pix_fmt not in PLANAR_FORMATS:
+            raise VideoAnalysisError(f"Unsupported pipe pixel format: {self.pix_fmt}")
+        if self.fps <= 0:
+            raise VideoAnalysisError("Invalid pipe frame rate")
+
+    @property
+    def frame_size(self) -> int:
+        if self.pix_fmt in PACKED_FORMATS:
+            return self.width * self.height * PACKED_FORMATS[self.pix_fmt]
+        sample, shift_x, shift_y = PLANAR_FORMATS[self.pix_fmt]
+        chroma_w = -(-self.width >> shift_x)
+        chroma_h = -(-self.height >> shift_y)
+        return (self.width * self.height + 2 * chroma_w * chroma_h) * sample
+
+    def input_args(self) -> List[str]:
+        """ffmpeg input options for raw frames arriving on stdin."""
+        return [
+            "-f", "rawvideo",
+            "-pix_fmt", self.pix_fmt,
+            "-s", f"{self.width}x{self.height}",
+            "-framerate", f"{self.fps.numerator}/{self.fps.denominator}",
+            "-i", "pipe:0"
+        ]
+
+    def video_info(self, frame_count: int = 0) -> dict:
+        """Video properties in the dict layout used by the encoder."""
+        fps = float(self.fps)
+        return {
+            "width": self.width,
+            "height": self.height,
+            "fps": fps,
+            "duration": frame_count / fps,
+            "codec": "rawvideo",
+            "pixfmt": self.pix_fmt,
+            "colorspace": "unknown",
+            "colortrc": "unknown",
+            "colorprim": "unknown",
+            "colorrange": self.colorrange,
+            "field_order": "progressive",
+            "bit_rate": int(self.frame_size * 8 * fps),
+            "size_mb": 0.0,
+            "video_index": 0
+        }
+
+def _parse_rate(value: str) -> Fraction:
+    try:
+        return Fraction(str(value).strip())
+    except (ValueError, ZeroDivisionError):
+        raise VideoAnalysisError(f"Invalid frame rate: {value}")
+
+def parse_frame_format(size: str, pix_fmt: str, fps: str) -> FrameFormat:
+    """Frame format from command line values such as '1920x1080', 'rgb24', '60000/1001'."""
+    try:
+        width, height = (int(value) for value in size.lower().split("x"))
+    except ValueError:
+        raise VideoAnalysisError(f"Invalid frame size: {size}")
+    return FrameFormat(width, height, pix_fmt, _parse_rate(fps))
+
+def iter_buffers(frames: Iterable, frame_format: FrameFormat, copy: bool = False) -> Iterator[memoryview]:
+    """Wrap frames from a generator (NumPy arrays, bytes, bytearrays) as flat byte views.
+
+    Frames are not copied unless they are non-contiguous or copy=True; a generator that
+    reuses one array for every frame must pass copy=True, because queued frames are
+    written to the encoders later.
+    """
+    expected = frame_format.frame_size
+    for number, frame in enumerate(frames):
+        view = memoryview(frame)
+        if copy or not view.c_contiguous:
+            view = memoryview(view.tobytes())
+        view = view.cast("B")
+        if view.nbytes != expected:
+            raise VideoAnalysisError(f"Frame {number} has {view.nbytes} bytes, expected {expected}")
+        yield view
+
+def read_raw_frames(stream: BinaryIO, frame_format: FrameFormat) -> Iterator[memoryview]:
+    """Split a raw video byte stream into frames."""
+    size = frame_format.frame_size
+    while True:
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        filled = 0
+        while filled < size:
+            count = stream.readinto(view[filled:])
+            if not count:
+                break
+            filled += count
+        if filled == 0:
+            return
+        if filled < size:
+            logger.warning(f"Dropping incomplete last frame ({filled} of {size} bytes)")
+            return
+        yield view
+
+def parse_y4m_header(line: bytes) -> FrameFormat:
+    tokens = line.strip().split(b" ")
+    if not tokens or tokens[0] != b"YUV4MPEG2":
+        raise VideoAnalysisError("Input is not a YUV4MPEG2 stream")
+    width = height = 0
+    fps = None
+    pix_fmt = "yuv420p"
+    colorrange = "unknown"
+    for token in tokens[1:]:
+        tag, value = chr(token[0]), token[1:].decode("ascii", "replace")
+        if tag == "W":
+            width = int(value)
+        elif tag == "H":
+            height = int(value)
+        elif tag == "F":
+            fps = _parse_rate(value.replace(":", "/"))
+        elif tag == "C":
+            if value not in Y4M_COLORSPACES:
+                raise VideoAnalysisError(f"Unsupported YUV4MPEG2 colorspace: {value}")
+            pix_fmt = Y4M_COLORSPACES[value]
+        elif tag == "X" and value.upper().startswith("COLORRANGE="):
+            colorrange = "pc" if value.split("=", 1)[1].upper() == "FULL" else "tv"
+    if fps is None:
+        raise VideoAnalysisError("YUV4MPEG2 header has no frame rate")
+    return FrameFormat(width, height, pix_fmt, fps, colorrange)
+
+def read_y4m(stream: BinaryIO) -> Tuple[FrameFormat, Iterator[memoryview]]:
+    """Parse a YUV4MPEG2 stream: the frame format and an iterator over its frames."""
+    frame_format = parse_y4m_header(stream.readline())
+    size = frame_format.frame_size
+
+    def frames() -> Iterator[memoryview]:
+        while True:
+            marker = stream.readline()
+            if not marker:
+                return
+            if not marker.startswith(b"FRAME"):
+                raise VideoAnalysisError("Corrupt YUV4MPEG2 stream: missing FRAME marker")
+            buffer = bytearray(size)
+            view = memoryview(buffer)
+            filled = 0
+            while filled < size:
+                count = stream.readinto(view[filled:])
+                if not count:
+                    logger.warning(f"Dropping incomplete last frame ({filled} of {size} bytes)")
+                    return
+                filled += count
+            yield view
+
+    return frame_format, frames()
+
+@dataclass(slots=True)
+class _Consumer:
+    name: str
+    queue: asyncio.Queue
+    alive: bool = True
+    frames: int = 0
+
+class FrameFanout:
+    """Feeds one frame stream to the stdin of several ffmpeg processes.
+
+    Every encoder has its own bounded queue on the runner loop, so the producer runs at
+    the pace of the slowest encoder and memory stays at depth frames per encoder. An
+    encoder that exits early is dropped without stalling the others.
+    """
+
+    def __init__(self, runner: ProcessRunner, depth: int = DEFAULT_QUEUE_FRAMES):
+        self.runner = runner
+        self.depth = max(1, depth)
+        self._consumers: List[_Consumer] = []
+
+    def add_consumer(self, name: str) -> Callable[[asyncio.StreamWriter], object]:
+        """Register an encoder; returns the stdin_feed to pass to ProcessRunner.start()."""
+        consumer = _Consumer(name, asyncio.Queue(self.depth))
+        self._consumers.append(consumer)
+
+        async def feed(stdin: asyncio.StreamWriter):
+            finished = False
+            try:
+                while True:
+                    frame = await consumer.queue.get()
+                    if frame is None:
+                        finished = True
+                        return
+                    stdin.write(frame)
+                    await stdin.drain()
+                    consumer.frames += 1
+            finally:
+                if not finished:
+                    logger.warning(f"[{name}] encoder stopped reading after {consumer.frames} frames")
+                consumer.alive = False
+                # Unblock a producer waiting on this queue
+                while not consumer.queue.empty():
+                    consumer.queue.get_nowait()
+
+        return feed
+
+    def frames_written(self, name: str) -> int:
+        return next(consumer.frames for consumer in self._consumers if consumer.name == name)
+
+    async def _put_all(self, frame) -> int:
+        live = [consumer for consumer in self._consumers if consumer.alive]
+        await asyncio.gather(*(consumer.queue.put(frame) for consumer in live))
+        return len(live)
+
+    def feed(self, frames: Iterable[memoryview],
+             on_frame: Optional[Callable[[int], None]] = None) -> int:
+        """Push every frame to all encoders (blocking) and signal end of stream; returns the frame count."""
+        count = 0
+        try:
+            for frame in frames:
+                if not self.runner.call(self._put_all(frame)):
+                    logger.error("All encoders stopped reading; ending the stream early")
+                    break
+                count += 1
+                if on_frame is not None:
+                    on_frame(count)
+        finally:
+            self.runner.call(self._put_all(None))
+        return count
@@ -0,0 +1,131 @@
+import json
+import logging
+import sqlite3
+import statistics
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import List, Tuple
+
+from passcache import stats_key
+
+logger = logging.getLogger("o3enc.history")
+
+# Recent runs a prediction is based on
+PREDICTION_SAMPLES = 20
+# Processing time per second of source for a preset with no history at all, per pass
+DEFAULT_SECONDS_PER_SECOND = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS encodes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    finished REAL NOT NULL,
+    input TEXT NOT NULL,
+    preset TEXT NOT NULL,
+    preset_key TEXT NOT NULL,
+    encoder TEXT NOT NULL,
+    two_pass INTEGER NOT NULL,
+    settings TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    fps REAL,
+    duration REAL,
+    codec TEXT,
+    elapsed REAL NOT NULL,
+    speed REAL,
+    success INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS encodes_preset_key ON encodes (preset_key, success);
+CREATE INDEX IF NOT EXISTS encodes_encoder ON encodes (encoder, two_pass, success);
+"""
+
+def preset_key(preset: dict) -> str:
+    """Presets with the same settings share history whatever they are called."""
+    return stats_key(preset={key: value for key, value in preset.items() if key != 'name'})
+
+def is_two_pass(preset: dict) -> bool:
+    return str(preset.get('2pass', 'true')).strip().lower() == 'true'
+
+def source_pixels(video_info: dict) -> float:
+    """Pixels in the whole source; processing time scales with it."""
+    return (float(video_info.get('width') or 0) * float(video_info.get('height') or 0)
+            * float(video_info.get('fps') or 0) * float(video_info.get('duration') or 0))
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m"
+
+class EncodeHistory:
+    """SQLite log of finished encodes, used to predict how long a job will take.
+
+    Predictions scale the median throughput (source pixels per second) of the last runs
+    of the same preset settings, then of the same encoder, to the new source. A
+    connection is opened per call, so one history can be shared between threads.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        if not self._ready:
+            connection.executescript(SCHEMA)
+            self._ready = True
+        return connection
+
+    def record(self, input_file: str, preset: dict, video_info: dict, elapsed: float,
+               success: bool, kind: str = "encode"):
+        """Store one finished preset run; kind is encode or copy."""
+        duration = float(video_info.get('duration') or 0)
+        try:
+            with closing(self._connect()) as connection, connection:
+                connection.execute(
+                    "INSERT INTO encodes (finished, input, preset, preset_key, encoder, two_pass, settings, kind,"
+                    " width, height, fps, duration, codec, elapsed, speed, success)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (time.time(), str(input_file), preset.get('name', ''), preset_key(preset),
+                     preset.get('encoder', ''), int(is_two_pass(preset)), json.dumps(preset, default=str), kind,
+                     video_info.get('width'), video_info.get('height'), video_info.get('fps'), duration,
+                     video_info.get('codec'), elapsed, duration / elapsed if elapsed > 0 else None, int(success))
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record encode history: {str(e)}")
+        except OSError as e:
+            logger.warning(f"Could not create encode history: {str(e)}")
+
+    def _throughputs(self, query: str, params: tuple) -> List[float]:
+        try:
+            with closing(self._connect()) as connection:
+                rows = connection.execute(query, params).fetchall()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Could not read encode history: {str(e)}")
+            return []
+        return [source_pixels({'width': w, 'height': h, 'fps': f, 'duration': d}) / elapsed
+                for w, h, f, d, elapsed in rows if elapsed and w and h and f and d]
+
+    def predict(self, preset: dict, video_info: dict) -> Tuple[float, str]:
+        """(seconds, basis) for encoding video_info with preset; basis is preset, encoder or default."""
+        pixels = source_pixels(video_info)
+        columns = "SELECT width, height, fps, duration, elapsed FROM encodes"
+        for basis, query, params in (
+            ("preset", f"{columns} WHERE preset_key = ? AND success = 1 AND kind = 'encode'"
+                       " ORDER BY finished DESC LIMIT ?", (preset_key(preset), PREDICTION_SAMPLES)),
+            ("encoder", f"{columns} WHERE encoder = ? AND two_pass = ? AND success = 1 AND kind = 'encode'"
+                        " ORDER BY finished DESC LIMIT ?",
+             (preset.get('encoder', ''), int(is_two_pass(preset)), PREDICTION_SAMPLES)),
+        ):
+            throughputs = self._throughputs(query, params)
+            if throughputs and pixels > 0:
+                return pixels / statistics.median(throughputs), basis
+        passes = 2 if is_two_pass(preset) else 1
+        return float(video_info.get('duration') or 0) * DEFAULT_SECONDS_PER_SECOND * passes, "default"
@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import fakeff
+
+# Drives simulated jobs through the whole pipeline (probe, sampling, passes, assembly,
+# verification) with fakeff.py standing in for ffmpeg, and reports the time each job
+# spent outside ffmpeg: process launches, scheduling, waiting on locks, Python work.
+#
+#   python loadtest.py --jobs 1000 --workers 8 --speed 2000 --fail-rate 0.01
+
+PRESETS = """o3enc load test presets
+preset_start:
+[two-pass]
+encoder = libx264
+container = mp4
+pixfmt = yuv420p
+options = -preset medium -b:v 5000k
+
+[single-pass]
+2pass = false
+encoder = libx265
+container = mkv
+pixfmt = yuv420p
+options = -preset fast -crf 24
+"""
+
+# Input names are loadjob<6 digits>.mkv; every step's command line names its job's input or outputs
+STEM_PATTERN = re.compile(r"loadjob\d{6}")
+
+def union_seconds(intervals: List[Tuple[float, float]]) -> float:
+    total, reach = 0.0, None
+    for start, end in sorted(intervals):
+        if reach is None or start > reach:
+            total += end - start
+            reach = end
+        elif end > reach:
+            total += end - reach
+            reach = end
+    return total
+
+def launch_cost(ffmpeg: Path, samples: int = 20) -> float:
+    """Median seconds to start the stand-in and have it exit; part of every step but not orchestration."""
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        subprocess.run([str(ffmpeg), "-version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+def read_steps(log_file: Path, stems: List[str]) -> Dict[str, List[dict]]:
+    """Fake tool invocations per job, matched on the input's unique file name."""
+    steps: Dict[str, List[dict]] = {stem: [] for stem in stems}
+    with open(log_file, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            match = STEM_PATTERN.search(" ".join(record["args"]))
+            if match and match.group() in steps:
+                steps[match.group()].append(record)
+    return steps
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="o3enc orchestration load test against a fake ffmpeg")
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4, help="jobs encoded at once")
+    parser.add_argument("--presets", type=int, choices=(1, 2), default=2, help="presets per job")
+    parser.add_argument("--parallel-encodes", type=int, default=1, help="presets of one job encoded at once")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of simulated source")
+    parser.add_argument("--speed", type=float, default=1000.0, help="simulated encode speed (x realtime)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="chance that a step writing a file fails")
+    parser.add_argument("--keep", action="store_true", help="keep the workspace for inspection")
+    args = parser.parse_args()
+
+    workspace = Path(tempfile.mkdtemp(prefix="o3enc-loadtest-"))
+    log_file = workspace / "fake-calls.jsonl"
+    config = dict(fakeff.DEFAULT_CONFIG, speed=args.speed, copy_speed=args.speed * 10,
+                  analysis_speed=args.speed * 10, progress_interval=0.05, fail_rate=args.fail_rate,
+                  log=str(log_file))
+    config["source"] = dict(fakeff.DEFAULT_CONFIG["source"], duration=args.duration)
+    ffmpeg, ffprobe = fakeff.write_launchers(workspace / "bin", config)
+    os.environ["O3ENC_FFMPEG"] = str(ffmpeg)
+    os.environ["O3ENC_FFPROBE"] = str(ffprobe)
+    # Keeps the pass, output and history caches from remembering simulated encodes
+    os.environ["O3ENC_CACHE_DIR"] = str(workspace / "cache")
+
+    # Imported after the environment is set; the o3enc logger stays unconfigured and silent
+    from api import EncodeJob, Session
+
+    preset_file = workspace / "presets.ini"
+    preset_file.write_text(PRESETS, encoding="utf-8")
+    inputs_dir, output_dir = workspace / "inputs", workspace / "outputs"
+    inputs_dir.mkdir()
+    output_dir.mkdir()
+    stems = [f"loadjob{index:06d}" for index in range(args.jobs)]
+    for stem in stems:
+        (inputs_dir / f"{stem}.mkv").touch()
+
+    baseline = launch_cost(ffmpeg)
+    log_file.unlink(missing_ok=True)
+
+    events = 0
+    events_lock = threading.Lock()
+
+    def on_progress(event: dict):
+        nonlocal events
+        with events_lock:
+            events += 1
+
+    walls: Dict[str, Tuple[float, float]] = {}
+    failures: List[str] = []
+    try:
+        with Session(preset_file, max_jobs=args.workers) as session:
+            presets = session.preset_names[:args.presets]
+
+            def run_job(stem: str):
+                job = EncodeJob(str(inputs_dir / f"{stem}.mkv"), presets, output_dir=output_dir / stem,
+                                parallel_encodes=args.parallel_encodes)
+                started = time.time()
+                result = session.encode(job, on_progress)
+                walls[stem] = (started, time.time())
+                if not result.success:
+                    failures.append(stem)
+
+            cpu_started = time.process_time()
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                list(executor.map(run_job, stems))
+            elapsed = time.monotonic() - started
+            cpu = time.process_time() - cpu_started
+
+        steps = read_steps(log_file, stems)
+        overheads, launches = [], []
+        for stem in stems:
+            busy = union_seconds([(record["start"], record["end"]) for record in steps[stem]])
+            wall = walls[stem][1] - walls[stem][0]
+            overheads.append(max(0.0, wall - busy))
+            launches.append(len(steps[stem]))
+        net = [max(0.0, overhead - count * baseline) for overhead, count in zip(overheads, launches)]
+
+        print(f"Jobs:              {args.jobs} ({len(failures)} failed), {args.workers} at once, "
+              f"{len(presets)} preset(s) each")
+        print(f"Wall time:         {elapsed:.1f}s ({args.jobs / elapsed:.1f} jobs/s)")
+        print(f"Tool runs per job: {statistics.mean(launches):.1f} "
+              f"(launch cost {baseline * 1000:.1f}ms each)")
+        print(f"Progress events:   {events}")
+        print(f"Overhead per job:  p50 {percentile(overheads, 0.5):.3f}s  p95 {percentile(overheads, 0.95):.3f}s  "
+              f"max {max(overheads):.3f}s")
+        print(f"  net of launches: p50 {percentile(net, 0.5):.3f}s  p95 {percentile(net, 0.95):.3f}s  "
+              f"max {max(net):.3f}s")
+        print(f"Python CPU:        {cpu:.1f}s ({cpu / args.jobs * 1000:.1f}ms per job)")
+    finally:
+        if args.keep:
+            print(f"Workspace kept: {workspace}")
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
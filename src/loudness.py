@@ -0,0 +1,139 @@
+import math
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+# BS.1770 / EBU Tech 3342 gating
+ABSOLUTE_GATE = -70.0
+INTEGRATED_RELATIVE_GATE = -10.0
+RANGE_RELATIVE_GATE = -20.0
+RANGE_LOW_PERCENTILE = 0.10
+RANGE_HIGH_PERCENTILE = 0.95
+
+# ebur128 reports the 400 ms momentary and 3 s short-term loudness every 100 ms
+BLOCKS_PER_SECOND = 10
+# Read before each shard so its first blocks see the same 3 s history as in one pass
+PREROLL_SECONDS = 3.5
+# Shorter shards spend too much of their time on the preroll
+MIN_SHARD_SECONDS = 60.0
+
+@dataclass(slots=True)
+class Shard:
+    """Part of the measured range; block numbers count 100 ms steps from the range start."""
+    first: int                   # first block kept
+    last: Optional[int]          # block after the last one kept, None up to the end
+    read_first: int              # block the process starts reading at (first minus preroll)
+
+    @property
+    def read_start(self) -> float:
+        return self.read_first / BLOCKS_PER_SECOND
+
+    def read_duration(self, total: float) -> Optional[float]:
+        if self.last is None:
+            return total - self.read_start
+        # A little past the last block, which then never depends on where reading stops
+        return min(total, (self.last + 2) / BLOCKS_PER_SECOND) - self.read_start
+
+def plan_shards(duration: float, count: int) -> List[Shard]:
+    """Split duration seconds into count shards on 100 ms block boundaries."""
+    blocks = int(duration * BLOCKS_PER_SECOND)
+    preroll = int(PREROLL_SECONDS * BLOCKS_PER_SECOND)
+    bounds = [blocks * index // count for index in range(count)]
+    shards = []
+    for index, first in enumerate(bounds):
+        last = bounds[index + 1] if index + 1 < count else None
+        shards.append(Shard(first=first, last=last, read_first=max(0, first - preroll)))
+    return shards
+
+def shard_command(ffmpeg: str, input_file: str, track_index: int, shard: Shard,
+                  range_start: float, range_duration: float, whole_file: bool) -> List[str]:
+    """ffmpeg command printing the ebur128 block loudness and true peaks of one shard to stdout."""
+    cmd = [ffmpeg, "-v", "error", "-nostats", "-ss", f"{range_start + shard.read_start:.6f}"]
+    if shard.last is not None or not whole_file:
+        cmd += ["-t", f"{shard.read_duration(range_duration):.6f}"]
+    cmd += ["-i", input_file, "-map", f"0:a:{track_index}",
+            "-af", "ebur128=metadata=1:peak=true,ametadata=mode=print:file=-", "-f", "null", "-"]
+    return cmd
+
+@dataclass(slots=True)
+class ShardReader:
+    """stdout line callback collecting the blocks of a shard from ametadata's print output."""
+    shard: Shard
+    momentary: List[float] = field(default_factory=list)
+    short_term: List[float] = field(default_factory=list)
+    peak: float = 0.0            # linear, highest true peak of any channel
+    _keep: bool = False
+
+    def __call__(self, line: str):
+        line = line.strip()
+        if line.startswith("frame:"):
+            # One metadata frame per 100 ms block, numbered from where the process started reading
+            try:
+                block = self.shard.read_first + int(line.split()[0][len("frame:"):])
+            except ValueError:
+                self._keep = False
+                return
+            self._keep = block >= self.shard.first and (self.shard.last is None or block < self.shard.last)
+            return
+        key, _, value = line.partition("=")
+        try:
+            if key == "lavfi.r128.M" and self._keep:
+                self.momentary.append(float(value))
+            elif key == "lavfi.r128.S" and self._keep:
+                self.short_term.append(float(value))
+            elif key.startswith("lavfi.r128.true_peaks_ch"):
+                # Running maximum; the preroll is part of the range as well
+                self.peak = max(self.peak, float(value))
+        except ValueError:
+            pass
+
+def _energy(loudness: float) -> float:
+    return 10 ** ((loudness + 0.691) / 10)
+
+def _loudness(energy: float) -> float:
+    return -0.691 + 10 * math.log10(energy)
+
+def integrated_loudness(momentary: List[float]) -> Optional[Tuple[float, float]]:
+    """Gated integrated loudness and its relative gate, from 400 ms blocks; None for silence."""
+    audible = [_energy(value) for value in momentary if value > ABSOLUTE_GATE]
+    if not audible:
+        return None
+    threshold = _loudness(sum(audible) / len(audible)) + INTEGRATED_RELATIVE_GATE
+    gated = [energy for energy in audible if _loudness(energy) > threshold]
+    if not gated:
+        return None
+    return _loudness(sum(gated) / len(gated)), threshold
+
+def loudness_range(short_term: List[float]) -> float:
+    """Spread between the 10th and 95th percentile of the gated 3 s blocks."""
+    audible = [value for value in short_term if value > ABSOLUTE_GATE]
+    if not audible:
+        return 0.0
+    threshold = _loudness(sum(_energy(value) for value in audible) / len(audible)) + RANGE_RELATIVE_GATE
+    gated = sorted(value for value in audible if value > threshold)
+    if len(gated) < 2:
+        return 0.0
+    low = gated[round((len(gated) - 1) * RANGE_LOW_PERCENTILE)]
+    high = gated[round((len(gated) - 1) * RANGE_HIGH_PERCENTILE)]
+    return high - low
+
+def merge_shards(readers: List[ShardReader]) -> Optional[dict]:
+    """Measurement of the whole range in the fields of loudnorm's first pass; None for silence.
+
+    Gating is over the set of blocks, so blocks from separate processes merge exactly.
+    target_offset is 0: it is only used by loudnorm's dynamic mode, which the second
+    pass falls back to when linear normalization would clip.
+    """
+    momentary = [value for reader in readers for value in reader.momentary]
+    integrated = integrated_loudness(momentary)
+    peak = max(reader.peak for reader in readers)
+    if integrated is None or peak <= 0.0:
+        return None
+    input_i, threshold = integrated
+    short_term = [value for reader in readers for value in reader.short_term]
+    return {
+        "input_i": round(input_i, 2),
+        "input_lra": round(loudness_range(short_term), 2),
+        "input_tp": round(20 * math.log10(peak), 2),
+        "input_thresh": round(threshold, 2),
+        "target_offset": 0.0,
+    }
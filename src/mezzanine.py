@@ -0,0 +1,115 @@
+import logging
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from runner import ProcessRunner
+
+logger = logging.getLogger("o3enc.mezzanine")
+
+# Length of the sample rendered to weigh the filter chain against reading an intermediate back
+MEASURE_SECONDS = 5.0
+# Reading the intermediate must win by this factor, timings of a short sample are noisy
+DECODE_MARGIN = 1.25
+# Intermediates up to this size are stored uncompressed; the page cache keeps most of them in memory
+RAW_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Scratch space kept free on top of the intermediate's estimated size
+FREE_SPACE_MARGIN = 1.2
+
+# Bits per pixel as stored by rawvideo
+PIXEL_BITS = {
+    "yuv420p": 12, "nv12": 12, "yuvj420p": 12,
+    "yuv422p": 16, "yuyv422": 16, "uyvy422": 16, "yuvj422p": 16,
+    "yuv444p": 24, "yuvj444p": 24, "rgb24": 24, "bgr24": 24, "gbrp": 24,
+    "yuv420p10le": 24, "p010le": 24, "yuv420p12le": 24,
+    "yuv422p10le": 32, "yuv422p12le": 32,
+    "yuv444p10le": 48, "yuv444p12le": 48, "gbrp10le": 48, "gbrp12le": 48,
+}
+DEFAULT_PIXEL_BITS = 24
+# Formats the utvideo encoder accepts; it decodes much faster than FFV1
+UTVIDEO_FORMATS = {"yuv420p", "yuv422p", "yuv444p", "gbrp", "gbrap"}
+
+# Filters that cost next to nothing; a chain of only these is never worth an intermediate
+CHEAP_FILTERS = {"format", "null", "setsar", "setdar", "copy"}
+
+MODES = {"auto", "true", "false"}
+
+@dataclass(slots=True)
+class MezzanineCodec:
+    name: str
+    args: List[str]
+    extension: str
+    # Expected size relative to raw frames
+    ratio: float
+
+RAW_CODEC = MezzanineCodec("rawvideo", ["-c:v", "rawvideo"], "nut", 1.0)
+UTVIDEO_CODEC = MezzanineCodec("utvideo", ["-c:v", "utvideo", "-pred", "median"], "mkv", 0.55)
+FFV1_CODEC = MezzanineCodec("ffv1", ["-c:v", "ffv1", "-level", "3", "-g", "1", "-slices", "16",
+                                     "-slicecrc", "0"], "mkv", 0.45)
+
+def raw_bytes(width: int, height: int, pix_fmt: str, frames: float) -> float:
+    return width * height * PIXEL_BITS.get(pix_fmt, DEFAULT_PIXEL_BITS) / 8 * frames
+
+def choose_codec(pix_fmt: str, frame_bytes_total: float) -> MezzanineCodec:
+    """Uncompressed for short clips, otherwise the fastest lossless codec taking the pixel format."""
+    if frame_bytes_total <= RAW_MAX_BYTES:
+        return RAW_CODEC
+    if pix_fmt in UTVIDEO_FORMATS:
+        return UTVIDEO_CODEC
+    return FFV1_CODEC
+
+def is_cheap_chain(filter_chain: str) -> bool:
+    names = [part.split("=", 1)[0].strip() for part in filter_chain.split(",") if part.strip()]
+    return all(name in CHEAP_FILTERS for name in names)
+
+def render_command(ffmpeg: str, input_args: List[str], video_map: str, filter_chain: str,
+                   codec: MezzanineCodec, output_file: Path, duration: Optional[float] = None,
+                   stats: bool = True) -> List[str]:
+    """ffmpeg command writing the filtered video alone to a lossless intermediate."""
+    cmd = [ffmpeg, "-y", "-loglevel", "warning", "-stats" if stats else "-nostats", *input_args]
+    if duration is not None:
+        cmd += ["-t", f"{duration:.3f}"]
+    cmd += ["-map", video_map, "-vf", filter_chain, "-an", "-sn", "-dn", *codec.args, str(output_file)]
+    return cmd
+
+@dataclass(slots=True)
+class FilterCost:
+    """Wall-clock seconds measured on the same sample."""
+    render_seconds: float    # decode the source, run the chain, write the intermediate
+    decode_seconds: float    # read the intermediate back
+
+    def worth_it(self, uses: int) -> bool:
+        """True when rendering once and reading back `uses` times beats filtering `uses` times.
+
+        Rendering is taken as the cost of one filtered read; the lossless write it includes
+        only makes the comparison more conservative.
+        """
+        if uses < 2:
+            return False
+        with_intermediate = self.render_seconds + uses * self.decode_seconds * DECODE_MARGIN
+        return with_intermediate < uses * self.render_seconds
+
+def measure_filter_cost(ffmpeg: str, runner: ProcessRunner, input_args: List[str], video_map: str,
+                        filter_chain: str, codec: MezzanineCodec, scratch_dir: Path,
+                        duration: float = MEASURE_SECONDS,
+                        on_start: Optional[Callable[[int], None]] = None) -> Optional[FilterCost]:
+    """Render a sample with the chain and read it back; None when either step fails."""
+    sample = scratch_dir / f"mezzanine-sample.{codec.extension}"
+    render = render_command(ffmpeg, input_args, video_map, filter_chain, codec, sample, duration, stats=False)
+    decode = [ffmpeg, "-v", "error", "-nostats", "-i", str(sample), "-map", "0:v:0", "-f", "null", "-"]
+    try:
+        timings = []
+        for cmd in (render, decode):
+            started = time.perf_counter()
+            result = runner.run(cmd, keep_output=False, on_start=on_start)
+            if result.returncode != 0:
+                logger.warning(f"Filter cost measurement failed (exit code {result.returncode})")
+                return None
+            timings.append(time.perf_counter() - started)
+    except OSError as e:
+        logger.warning(f"Filter cost measurement failed: {str(e)}")
+        return None
+    finally:
+        sample.unlink(missing_ok=True)
+    return FilterCost(render_seconds=timings[0], decode_seconds=timings[1])
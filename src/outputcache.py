@@ -0,0 +1,93 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from passcache import stats_key
+
+logger = logging.getLogger("o3enc.outputcache")
+
+# Read-modify-write of the index is serialized between encoders of one process
+_index_lock = threading.Lock()
+
+def output_fingerprint(**parts) -> str:
+    """Hash of everything that determines an encoded output."""
+    return stats_key(**parts)
+
+class OutputCache:
+    """Index of finished outputs by fingerprint, so an identical job reuses the earlier file.
+
+    An entry is trusted only while the output still has the size and modification time it
+    had when it was recorded.
+    """
+
+    def __init__(self, index_file: Path):
+        self.index_file = Path(index_file)
+
+    def _load(self) -> Dict[str, dict]:
+        if not self.index_file.exists():
+            return {}
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Could not read output cache index, starting fresh: {str(e)}")
+            return {}
+
+    def _save(self, entries: Dict[str, dict]):
+        temp_file = self.index_file.with_suffix(self.index_file.suffix + ".tmp")
+        try:
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, indent=2)
+            os.replace(temp_file, self.index_file)
+        except OSError as e:
+            logger.error(f"Failed to save output cache index: {str(e)}")
+
+    def lookup(self, fingerprint: str) -> Optional[Path]:
+        """Path of an unchanged earlier output with this fingerprint, if any."""
+        with _index_lock:
+            entries = self._load()
+            entry = entries.get(fingerprint)
+            if entry is None:
+                return None
+            path = Path(entry["path"])
+            try:
+                stat = path.stat()
+                if stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]:
+                    return path
+            except OSError:
+                pass
+            # Deleted or modified since it was recorded
+            del entries[fingerprint]
+            self._save(entries)
+            return None
+
+    def record(self, fingerprint: str, output_file: Path):
+        try:
+            stat = output_file.stat()
+        except OSError as e:
+            logger.warning(f"Could not record output {output_file}: {str(e)}")
+            return
+        with _index_lock:
+            entries = self._load()
+            entries[fingerprint] = {
+                "path": str(output_file.absolute()),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "created": time.strftime("%Y-%m-%d %H:%M:%S")
+            }
+            self._save(entries)
+
+def link_or_copy(source: Path, target: Path) -> str:
+    """Hard-link source to target, copying when the volume does not allow it; returns the method."""
+    try:
+        os.link(source, target)
+        return "linked"
+    except OSError:
+        shutil.copy2(source, target)
+        return "copied"
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+logger = logging.getLogger("o3enc.passcache")
+
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024 * 1024
+
+# Encoders whose first-pass statistics describe the content only, so a second pass may
+# use them with a different target bitrate
+BITRATE_INDEPENDENT_STATS = {"libx264", "libx265", "libvpx", "libvpx-vp9", "libaom-av1"}
+TARGET_BITRATE_FLAGS = {"-b:v", "-b"}
+
+def rate_control_options(encoder: str, options: str) -> List[str]:
+    """Preset options that shape first-pass statistics.
+
+    The target bitrate is left out for encoders that accept stats from another bitrate.
+    """
+    tokens = options.split()
+    if encoder not in BITRATE_INDEPENDENT_STATS:
+        return tokens
+    kept = []
+    skip = False
+    for token in tokens:
+        if skip:
+            skip = False
+        elif token in TARGET_BITRATE_FLAGS:
+            skip = True
+        else:
+            kept.append(token)
+    return kept
+
+def stats_key(**parts) -> str:
+    """Stable hash of everything that went into a first pass."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class FirstPassCache:
+    """Keeps 2-pass log files (.log, .mbtree, .cutree) between runs, keyed by stats_key().
+
+    Entries are directories named by key; the least recently used ones are removed once
+    the cache grows beyond max_bytes. An entry without files records that the encoder
+    wrote no statistics (e.g. NVENC, which does its own multipass), so pass 1 has nothing
+    to contribute and can be skipped as well.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _entry(self, key: str) -> Path:
+        return self.directory / key
+
+    def restore(self, key: str, prefix: Path) -> bool:
+        """Copy cached stats to prefix* (the -passlogfile prefix); False on a miss."""
+        entry = self._entry(key)
+        if not (entry / "complete").exists():
+            return False
+        try:
+            for cached in entry.iterdir():
+                if cached.name != "complete":
+                    shutil.copy2(cached, prefix.with_name(prefix.name + cached.name))
+            # Mark as recently used
+            os.utime(entry)
+        except OSError as e:
+            logger.warning(f"Could not restore cached first pass {key[:12]}: {str(e)}")
+            return False
+        logger.info(f"Reusing cached first-pass statistics {key[:12]}")
+        return True
+
+    def store(self, key: str, prefix: Path):
+        """Save the stats written under prefix; failures only cost the cache entry."""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            staging = Path(tempfile.mkdtemp(prefix=".staging-", dir=self.directory))
+            for log_file in prefix.parent.glob(f"{prefix.name}*"):
+                shutil.copy2(log_file, staging / log_file.name[len(prefix.name):])
+            (staging / "complete").touch()
+            with self._lock:
+                self.discard(key)
+                os.replace(staging, self._entry(key))
+            logger.info(f"Cached first-pass statistics {key[:12]}")
+        except OSError as e:
+            logger.warning(f"Could not cache first-pass statistics: {str(e)}")
+            return
+        self.prune()
+
+    def discard(self, key: str):
+        shutil.rmtree(self._entry(key), ignore_errors=True)
+
+    def prune(self):
+        """Drop the least recently used entries beyond max_bytes, and stale staging folders."""
+        with self._lock:
+            try:
+                entries = []
+                for entry in self.directory.iterdir():
+                    if entry.name.startswith(".staging-"):
+                        if time.time() - entry.stat().st_mtime > 24 * 3600:
+                            shutil.rmtree(entry, ignore_errors=True)
+                        continue
+                    size = sum(item.stat().st_size for item in entry.iterdir())
+                    entries.append((entry.stat().st_mtime, size, entry))
+            except OSError as e:
+                logger.warning(f"Could not scan first-pass cache: {str(e)}")
+                return
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import fakeff
+
+# Checks that a job preempted by the job service hands back what it holds. A batch job
+# encodes to a volume that takes one job at a time (like a NAS), then an urgent job for
+# the same volume arrives and pauses it; the urgent job must finish, then the batch job.
+# fakeff.py stands in for ffmpeg. Exits with 1 when either job does not finish in time.
+#
+#   python preempttest.py --timeout 60
+
+PRESETS = """o3enc preemption test presets
+preset_start:
+[single-pass]
+2pass = false
+encoder = libx264
+container = mkv
+pixfmt = yuv420p
+options = -preset fast -b:v 5000k
+"""
+
+async def wait_for(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+def main() -> int:
+    timeout = float(sys.argv[sys.argv.index("--timeout") + 1]) if "--timeout" in sys.argv else 60.0
+    workspace = Path(tempfile.mkdtemp(prefix="o3enc-preempttest-"))
+    # Each encode takes about 4 seconds
+    config = dict(fakeff.DEFAULT_CONFIG, speed=15.0, progress_interval=0.1)
+    ffmpeg, ffprobe = fakeff.write_launchers(workspace / "bin", config)
+    os.environ["O3ENC_FFMPEG"] = str(ffmpeg)
+    os.environ["O3ENC_FFPROBE"] = str(ffprobe)
+    os.environ["O3ENC_CACHE_DIR"] = str(workspace / "cache")
+
+    # Imported after the environment is set
+    from affinity import CpuAllocator
+    from api import Session
+    from core import run_batch
+    from service import TERMINAL_STATES, JobService
+    from storage import VolumeThrottle
+
+    preset_file = workspace / "presets.ini"
+    preset_file.write_text(PRESETS, encoding="utf-8")
+    for name in ("batch", "urgent"):
+        (workspace / f"{name}.mkv").touch()
+
+    try:
+        with Session(preset_file) as session:
+            # Every local volume takes one job at a time, as network volumes do
+            throttle = VolumeThrottle(local_limit=1)
+            cpu_allocator = CpuAllocator(1)
+
+            def job_runner(input_file, preset_names, output_dir, colorspace, colorrange,
+                           progress_callback, on_encoder, trim, priority):
+                presets = [session.preset(name) for name in preset_names]
+                return run_batch(input_file, presets, session.preset_manager, Path(output_dir),
+                                 colorspace, colorrange, session.disk_budget, throttle, progress_callback,
+                                 on_encoder, cpu_allocator, interactive=False, trim=trim)
+
+            async def scenario() -> bool:
+                service = JobService(job_runner, session.preset_names, max_concurrent=1)
+                await service.start()
+                try:
+                    batch = service.submit({"input": str(workspace / "batch.mkv"), "presets": ["single-pass"],
+                                            "output_dir": str(workspace / "out"), "priority": "batch"})
+                    # Preempt it in the middle of its encode, while it holds the volume slot
+                    encoding = await wait_for(lambda: any(event.get("stage") == "single"
+                                                          for event in batch.events), timeout)
+                    if not encoding:
+                        print(f"Batch job never started encoding ({batch.status})")
+                        return False
+                    urgent = service.submit({"input": str(workspace / "urgent.mkv"), "presets": ["single-pass"],
+                                             "output_dir": str(workspace / "out"), "priority": "urgent"})
+                    started = time.monotonic()
+                    if not await wait_for(lambda: urgent.status in TERMINAL_STATES, timeout):
+                        print(f"Urgent job did not finish within {timeout:.0f}s "
+                              f"(urgent {urgent.status}, batch {batch.status})")
+                        return False
+                    print(f"Urgent job {urgent.status} after {time.monotonic() - started:.1f}s")
+                    if not await wait_for(lambda: batch.status in TERMINAL_STATES, timeout):
+                        print(f"Batch job did not finish after the urgent one ({batch.status})")
+                        return False
+                    print(f"Batch job {batch.status} after {time.monotonic() - started:.1f}s")
+                    return urgent.status == "done" and batch.status == "done"
+                finally:
+                    await service.stop()
+
+            passed = asyncio.run(scenario())
+        print("PASS" if passed else "FAIL")
+        return 0 if passed else 1
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
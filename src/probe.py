@@ -0,0 +1,350 @@
+import json
+import logging
+from dataclasses import dataclass, field
+from fractions import Fraction
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from errors import VideoAnalysisError
+from runner import ProcessResult, ProcessRunner, shared_runner
+
+logger = logging.getLogger("o3enc.probe")
+
+def parse_bitrate(value: str) -> Optional[int]:
+    """Convert an FFmpeg bitrate string such as '12000k' or '8M' to bits per second."""
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    if not value:
+        return None
+    multipliers = {"k": 1000, "m": 1000 ** 2, "g": 1000 ** 3}
+    try:
+        if value[-1] in multipliers:
+            return int(float(value[:-1]) * multipliers[value[-1]])
+        return int(float(value))
+    except ValueError:
+        return None
+
+def parse_frame_rate(value: str) -> float:
+    """Parse an ffprobe rational such as '30000/1001' without eval(); 0.0 when invalid."""
+    try:
+        rate = Fraction(str(value))
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+    return float(rate) if rate > 0 else 0.0
+
+def _parse_float(value) -> Optional[float]:
+    try:
+        result = float(value)
+    except (TypeError, ValueError):
+        return None
+    return result if result == result else None  # NaN
+
+def _parse_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+@dataclass(slots=True)
+class VideoStream:
+    index: int                      # Position among video streams (0:v:N)
+    stream_index: int               # Absolute stream index in the file
+    codec: str
+    width: int
+    height: int
+    fps: float
+    r_frame_rate: str
+    pix_fmt: str = "unknown"
+    profile: str = "unknown"
+    color_space: str = "unknown"
+    color_transfer: str = "unknown"
+    color_primaries: str = "unknown"
+    color_range: str = "unknown"
+    field_order: str = "unknown"
+    bit_rate: Optional[int] = None
+    duration: Optional[float] = None
+    start_time: Optional[float] = None
+    nb_frames: Optional[int] = None
+    attached_pic: bool = False
+
+@dataclass(slots=True)
+class AudioStream:
+    index: int
+    stream_index: int
+    codec: str
+    channels: int = 0
+    sample_rate: Optional[int] = None
+    bit_rate: Optional[int] = None
+    language: str = "und"
+    title: str = ""
+    default: bool = False
+    duration: Optional[float] = None
+    start_time: Optional[float] = None
+
+    def as_track(self) -> dict:
+        """Plain dict used as the per-track audio_info entry."""
+        return {
+            "index": self.index,
+            "codec": self.codec,
+            "channels": self.channels,
+            "bit_rate": self.bit_rate,
+            "language": self.language,
+            "title": self.title,
+            "default": self.default
+        }
+
+@dataclass(slots=True)
+class SubtitleStream:
+    index: int
+    stream_index: int
+    codec: str
+    language: str = "und"
+    title: str = ""
+
+@dataclass(slots=True)
+class FormatInfo:
+    format_name: str = "unknown"
+    duration: Optional[float] = None
+    bit_rate: Optional[int] = None
+    size: Optional[int] = None
+    start_time: Optional[float] = None
+
+@dataclass(slots=True)
+class MediaInfo:
+    path: str
+    format: FormatInfo
+    video: List[VideoStream] = field(default_factory=list)
+    audio: List[AudioStream] = field(default_factory=list)
+    subtitle: List[SubtitleStream] = field(default_factory=list)
+    attachments: int = 0
+    chapters: int = 0
+
+    @property
+    def primary_video(self) -> Optional[VideoStream]:
+        """First real video stream (cover art is skipped)."""
+        for stream in self.video:
+            if not stream.attached_pic:
+                return stream
+        return None
+
+    @property
+    def duration(self) -> float:
+        """Video stream duration, falling back to the container duration."""
+        video = self.primary_video
+        if video is not None and video.duration:
+            return video.duration
+        if self.format.duration:
+            return self.format.duration
+        return 0.0
+
+    @property
+    def video_bit_rate(self) -> Optional[int]:
+        """Video bitrate, estimated from the container when the stream does not report it."""
+        video = self.primary_video
+        if video is None:
+            return None
+        if video.bit_rate:
+            return video.bit_rate
+        if not self.format.bit_rate or any(track.bit_rate is None for track in self.audio):
+            return None
+        estimate = self.format.bit_rate - sum(track.bit_rate for track in self.audio)
+        return estimate if estimate > 0 else None
+
+    def video_info(self) -> dict:
+        """Video properties in the dict layout used by the encoder."""
+        video = self.primary_video
+        if video is None:
+            raise VideoAnalysisError("No video stream found in input file")
+        size = self.format.size
+        if size is None:
+            try:
+                size = Path(self.path).stat().st_size
+            except OSError as e:
+                raise VideoAnalysisError(f"Failed to get file size: {e}")
+        return {
+            "width": video.width,
+            "height": video.height,
+            "fps": video.fps,
+            "duration": self.duration,
+            "codec": video.codec,
+            "pixfmt": video.pix_fmt,
+            "colorspace": video.color_space,
+            "colortrc": video.color_transfer,
+            "colorprim": video.color_primaries,
+            "colorrange": video.color_range,
+            "field_order": video.field_order,
+            "bit_rate": self.video_bit_rate,
+            "size_mb": size / (1024 * 1024),
+            "video_index": video.index
+        }
+
+class MediaProbe:
+    """Runs one ffprobe per file (-show_streams -show_format) and caches the parsed model."""
+
+    def __init__(self, ffprobe: str, runner: Optional[ProcessRunner] = None):
+        self.ffprobe = ffprobe
+        self.runner = runner or shared_runner()
+        self._cache: Dict[Tuple[str, int, int], MediaInfo] = {}
+
+    def probe(self, path: str) -> MediaInfo:
+        key = self._cache_key(path)
+        if key in self._cache:
+            return self._cache[key]
+        try:
+            result = self.runner.run(self._command(path))
+        except OSError as e:
+            raise VideoAnalysisError(f"Failed to run FFprobe: {e}")
+        return self._store(path, key, result)
+
+    async def probe_async(self, path: str) -> MediaInfo:
+        """Same as probe(), awaited on the runner loop so many probes can overlap."""
+        key = self._cache_key(path)
+        if key in self._cache:
+            return self._cache[key]
+        try:
+            result = await self.runner.execute(self._command(path))
+        except OSError as e:
+            raise VideoAnalysisError(f"Failed to run FFprobe: {e}")
+        return self._store(path, key, result)
+
+    def keyframes(self, path: str, video_index: int, start: float, end: float,
+                  origin: float = 0.0) -> List[float]:
+        """Keyframe timestamps of video stream 0:v:video_index between start and end seconds.
+
+        Reads packet flags only, nothing is decoded. Packet times are absolute, so
+        origin (the container start_time) is added to the interval and taken off the
+        results, which then count from the start of the file as ffmpeg's -ss does.
+        """
+        cmd = [
+            self.ffprobe,
+            "-v", "error",
+            "-select_streams", f"v:{video_index}",
+            "-read_intervals", f"{max(0.0, start + origin):.6f}%{end + origin:.6f}",
+            "-show_entries", "packet=pts_time,flags",
+            "-of", "csv=p=0",
+            str(path)
+        ]
+        try:
+            result = self.runner.run(cmd)
+        except OSError as e:
+            raise VideoAnalysisError(f"Failed to run FFprobe: {e}")
+        if result.returncode != 0:
+            raise VideoAnalysisError(f"FFprobe keyframe scan failed: {result.stderr}")
+        times = []
+        for line in result.stdout.splitlines():
+            pts_time, _, flags = line.strip().partition(",")
+            timestamp = _parse_float(pts_time)
+            if timestamp is None or "K" not in flags:
+                continue
+            if start <= timestamp - origin <= end:
+                times.append(timestamp - origin)
+        return sorted(times)
+
+    def _cache_key(self, path: str) -> Tuple[str, int, int]:
+        try:
+            stat = Path(path).stat()
+        except OSError as e:
+            raise VideoAnalysisError(f"Cannot access {path}: {e}")
+        return (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+
+    def _command(self, path: str) -> List[str]:
+        return [
+            self.ffprobe,
+            "-v", "error",
+            "-print_format", "json",
+            "-show_streams",
+            "-show_format",
+            "-show_chapters",
+            str(path)
+        ]
+
+    def _store(self, path: str, key: Tuple[str, int, int], result: ProcessResult) -> MediaInfo:
+        if result.returncode != 0:
+            logger.error(f"FFprobe failed: {result.stderr}")
+            raise VideoAnalysisError(f"FFprobe failed: {result.stderr}")
+
+        try:
+            data = json.loads(result.stdout)
+        except json.JSONDecodeError as e:
+            raise VideoAnalysisError(f"Failed to parse FFprobe output: {str(e)}")
+
+        media = self.parse(str(path), data)
+        self._cache[key] = media
+        return media
+
+    @staticmethod
+    def parse(path: str, data: dict) -> MediaInfo:
+        fmt = data.get("format", {})
+        media = MediaInfo(
+            path=path,
+            format=FormatInfo(
+                format_name=fmt.get("format_name", "unknown"),
+                duration=_parse_float(fmt.get("duration")),
+                bit_rate=parse_bitrate(fmt.get("bit_rate")),
+                size=_parse_int(fmt.get("size")),
+                start_time=_parse_float(fmt.get("start_time"))
+            ),
+            chapters=len(data.get("chapters", []))
+        )
+
+        for stream in data.get("streams", []):
+            codec_type = stream.get("codec_type")
+            tags = stream.get("tags", {})
+            disposition = stream.get("disposition", {})
+            duration = _parse_float(stream.get("duration"))
+            if duration is not None and duration <= 0:
+                duration = None
+
+            if codec_type == "video":
+                missing = [f for f in ("width", "height", "codec_name") if f not in stream]
+                if missing:
+                    raise VideoAnalysisError(f"Missing required video information: {', '.join(missing)}")
+                r_frame_rate = stream.get("r_frame_rate", "0/0")
+                media.video.append(VideoStream(
+                    index=len(media.video),
+                    stream_index=stream.get("index", 0),
+                    codec=stream["codec_name"],
+                    width=int(stream["width"]),
+                    height=int(stream["height"]),
+                    fps=parse_frame_rate(r_frame_rate) or parse_frame_rate(stream.get("avg_frame_rate")),
+                    r_frame_rate=r_frame_rate,
+                    pix_fmt=stream.get("pix_fmt", "unknown"),
+                    profile=stream.get("profile", "unknown"),
+                    color_space=stream.get("color_space", "unknown"),
+                    color_transfer=stream.get("color_transfer", "unknown"),
+                    color_primaries=stream.get("color_primaries", "unknown"),
+                    color_range=stream.get("color_range", "unknown"),
+                    field_order=stream.get("field_order", "unknown"),
+                    bit_rate=parse_bitrate(stream.get("bit_rate")),
+                    duration=duration,
+                    start_time=_parse_float(stream.get("start_time")),
+                    nb_frames=_parse_int(stream.get("nb_frames")),
+                    attached_pic=bool(disposition.get("attached_pic", 0))
+                ))
+            elif codec_type == "audio":
+                media.audio.append(AudioStream(
+                    index=len(media.audio),
+                    stream_index=stream.get("index", 0),
+                    codec=stream.get("codec_name", "unknown"),
+                    channels=_parse_int(stream.get("channels")) or 0,
+                    sample_rate=_parse_int(stream.get("sample_rate")),
+                    bit_rate=parse_bitrate(stream.get("bit_rate")),
+                    language=tags.get("language", "und"),
+                    title=tags.get("title", ""),
+                    default=bool(disposition.get("default", 0)),
+                    duration=duration,
+                    start_time=_parse_float(stream.get("start_time"))
+                ))
+            elif codec_type == "subtitle":
+                media.subtitle.append(SubtitleStream(
+                    index=len(media.subtitle),
+                    stream_index=stream.get("index", 0),
+                    codec=stream.get("codec_name", "unknown"),
+                    language=tags.get("language", "und"),
+                    title=tags.get("title", "")
+                ))
+            elif codec_type == "attachment":
+                media.attachments += 1
+
+        return media
@@ -0,0 +1,404 @@
+import asyncio
+import atexit
+import concurrent.futures
+import logging
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger("o3enc.runner")
+
+# Time a child gets to exit after the interrupt before it is killed (seconds)
+KILL_TIMEOUT = 10.0
+READ_CHUNK = 64 * 1024
+
+# ffmpeg ends its -stats lines with \r, so treat every line ending as a break
+LINE_BREAK = re.compile(rb"\r\n|\r|\n")
+
+@dataclass(slots=True)
+class ProcessResult:
+    args: List[str]
+    returncode: Optional[int]
+    stdout: str = ""
+    stderr: str = ""
+    timed_out: bool = False
+    cancelled: bool = False
+
+def _open_child(pid: int) -> Any:
+    """OS handle that keeps referring to this child after it exits, so a reused pid is never signalled."""
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            PROCESS_SUSPEND_RESUME = 0x0800
+            return ctypes.windll.kernel32.OpenProcess(PROCESS_SUSPEND_RESUME, False, pid) or None
+        if hasattr(os, "pidfd_open"):
+            return os.pidfd_open(pid)
+    except OSError:
+        pass
+    return None
+
+def _close_child(handle: Any):
+    if sys.platform == "win32":
+        import ctypes
+        ctypes.windll.kernel32.CloseHandle(handle)
+    else:
+        os.close(handle)
+
+def _suspend_child(pid: int, handle: Any, suspend: bool):
+    """SIGSTOP/SIGCONT, or NtSuspendProcess/NtResumeProcess on Windows (every thread of the child)."""
+    if sys.platform == "win32":
+        import ctypes
+        ntdll = ctypes.windll.ntdll
+        status = (ntdll.NtSuspendProcess if suspend else ntdll.NtResumeProcess)(handle)
+        if status != 0:
+            raise OSError(f"{'NtSuspendProcess' if suspend else 'NtResumeProcess'} failed ({status:#x})")
+        return
+    sig = signal.SIGSTOP if suspend else signal.SIGCONT
+    if handle is not None:
+        signal.pidfd_send_signal(handle, sig)
+    else:
+        os.kill(pid, sig)
+
+class RunningProcess:
+    """Handle to a child started by ProcessRunner.start(); usable from any thread."""
+
+    def __init__(self, args: List[str], loop: asyncio.AbstractEventLoop):
+        self.args = args
+        self.pid: Optional[int] = None
+        self._loop = loop
+        self._cancel = asyncio.Event()
+        self._future: Optional[concurrent.futures.Future] = None
+        # Child handle and suspension state, only touched on the runner loop
+        self._handle: Any = None
+        self._suspended = False
+        self._suspend_wanted = False
+
+    def cancel(self):
+        """Interrupt the child (SIGINT / CTRL_BREAK), killing it if it does not exit in time."""
+        def interrupt():
+            # A stopped child would not act on the interrupt
+            self._suspend_wanted = False
+            self._apply_suspension()
+            self._cancel.set()
+        self._loop.call_soon_threadsafe(interrupt)
+
+    def suspend(self):
+        """Stop the child where it is until resume(); also applies if it has not started yet."""
+        self._loop.call_soon_threadsafe(self._want_suspended, True)
+
+    def resume(self):
+        self._loop.call_soon_threadsafe(self._want_suspended, False)
+
+    def _want_suspended(self, suspend: bool):
+        self._suspend_wanted = suspend
+        self._apply_suspension()
+
+    def _started(self, pid: int):
+        self.pid = pid
+        self._handle = _open_child(pid)
+        self._apply_suspension()
+
+    def _apply_suspension(self):
+        if self.pid is None or self._suspend_wanted == self._suspended or self.done():
+            return
+        if sys.platform == "win32" and self._handle is None:
+            return
+        try:
+            _suspend_child(self.pid, self._handle, self._suspend_wanted)
+            self._suspended = self._suspend_wanted
+            logger.info(f"{'Suspended' if self._suspended else 'Resumed'} process {self.pid}")
+        except (OSError, AttributeError) as e:
+            logger.warning(f"Could not {'suspend' if self._suspend_wanted else 'resume'} process "
+                           f"{self.pid}: {str(e)}")
+
+    def _exited(self, _future: concurrent.futures.Future):
+        self._loop.call_soon_threadsafe(self._close_handle)
+
+    def _close_handle(self):
+        if self._handle is not None:
+            try:
+                _close_child(self._handle)
+            except OSError:
+                pass
+            self._handle = None
+
+    def done(self) -> bool:
+        return self._future is not None and self._future.done()
+
+    def wait(self, timeout: Optional[float] = None) -> ProcessResult:
+        try:
+            return self._future.result(timeout)
+        except KeyboardInterrupt:
+            # Children on Windows run in their own process group and do not see Ctrl+C
+            self.cancel()
+            self._future.result()
+            raise
+
+class ProcessRunner:
+    """Launches and supervises ffmpeg/ffprobe children from one background event loop.
+
+    Blocking callers use start()/run(); async code awaits execute() on the runner loop
+    through call()/submit().
+    """
+
+    def __init__(self, kill_timeout: float = KILL_TIMEOUT):
+        self.kill_timeout = kill_timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Every running child and its exit waiter, only touched on the runner loop
+        self._live: Dict[asyncio.subprocess.Process, asyncio.Task] = {}
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                name="o3enc-process-runner", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, coro):
+        """Run a coroutine on the runner loop and block until it finishes."""
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("ProcessRunner.call() used from the runner loop; await the coroutine instead")
+        future = self.submit(coro)
+        try:
+            return future.result()
+        except KeyboardInterrupt:
+            # Cancelling the coroutine stops the children it is waiting on
+            future.cancel()
+            raise
+
+    def start(self, cmd: List[str], **kwargs) -> RunningProcess:
+        """Start cmd in the background; kwargs are those of execute()."""
+        handle = RunningProcess(list(cmd), self.loop)
+        on_start = kwargs.pop("on_start", None)
+
+        def started(pid: int):
+            handle._started(pid)
+            if on_start is not None:
+                on_start(pid)
+
+        handle._future = self.submit(self.execute(cmd, cancel_event=handle._cancel, on_start=started, **kwargs))
+        handle._future.add_done_callback(handle._exited)
+        return handle
+
+    def run(self, cmd: List[str], **kwargs) -> ProcessResult:
+        return self.start(cmd, **kwargs).wait()
+
+    async def execute(self, cmd: List[str], *,
+                      stdout_callback: Optional[Callable[[str], None]] = None,
+                      stderr_callback: Optional[Callable[[str], None]] = None,
+                      capture: bool = True,
+                      keep_output: bool = True,
+                      timeout: Optional[float] = None,
+                      cancel_event: Optional[asyncio.Event] = None,
+                      on_start: Optional[Callable[[int], None]] = None,
+                      stdin_feed: Optional[Callable[[asyncio.StreamWriter], Awaitable[None]]] = None
+                      ) -> ProcessResult:
+        """Run one child to completion.
+
+        capture=False leaves stdout/stderr on the console (ffmpeg -stats line).
+        Callbacks receive decoded lines as they arrive and run on the runner loop, so
+        they must not block. keep_output=False keeps nothing in the result besides what
+        the callbacks store, for long-running encodes. on_start receives the pid
+        right after launch (CPU pinning, priority). stdin_feed is awaited with the
+        child's stdin and stdin is closed when it returns; it is cancelled if the child
+        exits first.
+        """
+        cmd = [str(arg) for arg in cmd]
+        if cancel_event is not None and cancel_event.is_set():
+            return ProcessResult(args=cmd, returncode=None, cancelled=True)
+
+        pipe = asyncio.subprocess.PIPE if capture else None
+        if stdin_feed is not None:
+            stdin = asyncio.subprocess.PIPE
+        else:
+            stdin = subprocess.DEVNULL if capture else None
+        options = {}
+        if sys.platform == "win32":
+            # Needed to deliver CTRL_BREAK_EVENT to this child only
+            options["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=stdin,
+            stdout=pipe, stderr=pipe,
+            **options
+        )
+        if on_start is not None:
+            try:
+                on_start(process.pid)
+            except Exception as e:
+                logger.error(f"Process start hook failed: {str(e)}")
+
+        stdout_chunks = [] if capture and keep_output else None
+        stderr_chunks = [] if capture and keep_output else None
+        pumps = []
+        if capture:
+            pumps.append(asyncio.create_task(self._pump(process.stdout, stdout_callback, stdout_chunks)))
+            pumps.append(asyncio.create_task(self._pump(process.stderr, stderr_callback, stderr_chunks)))
+
+        feeder = None
+        if stdin_feed is not None:
+            feeder = asyncio.create_task(self._feed(process.stdin, stdin_feed))
+
+        waiter = asyncio.create_task(process.wait())
+        self._live[process] = waiter
+        watched = {waiter}
+        cancel_waiter = None
+        if cancel_event is not None:
+            cancel_waiter = asyncio.create_task(cancel_event.wait())
+            watched.add(cancel_waiter)
+
+        timed_out = cancelled = False
+        try:
+            done, _ = await asyncio.wait(watched, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if waiter not in done:
+                cancelled = cancel_waiter is not None and cancel_waiter in done
+                timed_out = not cancelled
+                action = "Cancelling" if cancelled else "Timed out"
+                logger.info(f"{action}: {os.path.basename(cmd[0])} (pid {process.pid})")
+                await self._stop(process, waiter)
+        except asyncio.CancelledError:
+            await self._stop(process, waiter)
+            raise
+        finally:
+            self._live.pop(process, None)
+            if cancel_waiter is not None:
+                cancel_waiter.cancel()
+            if feeder is not None:
+                if process.returncode is not None:
+                    feeder.cancel()
+                await asyncio.gather(feeder, return_exceptions=True)
+            await asyncio.gather(*pumps, return_exceptions=True)
+
+        return ProcessResult(
+            args=cmd,
+            returncode=process.returncode,
+            stdout=b"".join(stdout_chunks).decode('utf-8', 'replace') if stdout_chunks else "",
+            stderr=b"".join(stderr_chunks).decode('utf-8', 'replace') if stderr_chunks else "",
+            timed_out=timed_out,
+            cancelled=cancelled
+        )
+
+    async def _feed(self, stdin: asyncio.StreamWriter,
+                    stdin_feed: Callable[[asyncio.StreamWriter], Awaitable[None]]):
+        try:
+            await stdin_feed(stdin)
+        except (ConnectionError, BrokenPipeError) as e:
+            logger.warning(f"Child stopped reading its input ({type(e).__name__})")
+        finally:
+            try:
+                stdin.close()
+            except (ConnectionError, BrokenPipeError, RuntimeError):
+                pass
+
+    def interrupt_all(self):
+        """Stop every running child without waiting; usable from a signal handler or any thread."""
+        with self._lock:
+            loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._stop_live)
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """Stop every running child and wait until they have exited (or timeout passes)."""
+        with self._lock:
+            loop = self._loop
+        if loop is None or loop.is_closed() or not loop.is_running():
+            return
+
+        async def stop_all():
+            await asyncio.gather(*self._stop_live(), return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(stop_all(), loop).result(timeout)
+        except concurrent.futures.TimeoutError:
+            logger.warning("Child processes still running at shutdown")
+
+    def _stop_live(self) -> List[asyncio.Task]:
+        if self._live:
+            logger.info(f"Stopping {len(self._live)} running process(es)")
+        return [asyncio.ensure_future(self._stop(process, waiter)) for process, waiter in list(self._live.items())]
+
+    async def _stop(self, process: asyncio.subprocess.Process, waiter: asyncio.Task):
+        """Interrupt first so ffmpeg can finalize, then kill."""
+        if process.returncode is not None:
+            return
+        try:
+            if sys.platform != "win32":
+                # A suspended child only acts on the interrupt once continued
+                process.send_signal(signal.SIGCONT)
+            process.send_signal(signal.CTRL_BREAK_EVENT if sys.platform == "win32" else signal.SIGINT)
+        except ProcessLookupError:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.kill_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Process {process.pid} did not exit after interrupt, killing it")
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await waiter
+
+    async def _pump(self, stream: asyncio.StreamReader, callback: Optional[Callable[[str], None]],
+                    chunks: Optional[list]):
+        pending = b""
+        while True:
+            data = await stream.read(READ_CHUNK)
+            if not data:
+                break
+            if chunks is not None:
+                chunks.append(data)
+            if callback is None:
+                continue
+            pending += data
+            *lines, pending = LINE_BREAK.split(pending)
+            for line in lines:
+                self._deliver(callback, line)
+        if callback is not None and pending:
+            self._deliver(callback, pending)
+
+    @staticmethod
+    def _deliver(callback: Callable[[str], None], line: bytes):
+        try:
+            callback(line.decode('utf-8', 'replace'))
+        except Exception as e:
+            logger.error(f"Output callback failed: {str(e)}")
+
+_shared_runner: Optional[ProcessRunner] = None
+_shared_lock = threading.Lock()
+
+def shared_runner() -> ProcessRunner:
+    """Process runner shared by every encoder, probe and verifier in this process."""
+    global _shared_runner
+    with _shared_lock:
+        if _shared_runner is None:
+            _shared_runner = ProcessRunner()
+            # The loop thread is a daemon; children must not outlive the interpreter
+            atexit.register(_shared_runner.shutdown, KILL_TIMEOUT + 1.0)
+        return _shared_runner
+
+def install_interrupt_handler(runner: ProcessRunner):
+    """Make Ctrl+C stop every child of the runner, then raise KeyboardInterrupt as usual.
+
+    Children run in their own process group on Windows and may be waited on by worker
+    threads (watch mode, encode graph steps), so the console interrupt alone does not
+    reach them. Only for the command line; library users keep their own handler.
+    """
+    def on_interrupt(signum, frame):
+        runner.interrupt_all()
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGINT, on_interrupt)
@@ -0,0 +1,364 @@
+import asyncio
+import collections
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from runner import ProcessRunner
+
+logger = logging.getLogger("o3enc.sampling")
+
+# Seek points spread over the file and frames decoded at each
+DEFAULT_SAMPLE_POINTS = 8
+SAMPLE_FRAMES = 3
+# Openings and end credits are skipped (fraction of the duration at each end)
+SAMPLE_MARGIN = 0.05
+
+# Automatic color settings are used without asking at or above this confidence
+COLOR_CONFIDENCE_THRESHOLD = 0.75
+
+# Names accepted by the colorspace filter's iall option
+COLORSPACE_FILTER_NAMES = {"bt470m", "bt470bg", "bt601-6-525", "bt601-6-625", "bt709",
+                           "smpte170m", "smpte240m", "bt2020"}
+# Primaries/transfer tags that identify the matrix when the matrix tag itself is missing
+MATRIX_FROM_TAGS = {
+    "bt709": "bt709", "bt470bg": "bt601-6-625", "smpte170m": "bt601-6-525",
+    "bt470m": "bt601-6-525", "smpte240m": "smpte240m", "bt2020": "bt2020",
+    "bt2020-10": "bt2020", "bt2020-12": "bt2020", "smpte2084": "bt2020", "arib-std-b67": "bt2020",
+}
+
+# cropdetect: black threshold (of 255) and frames accumulated per seek point
+CROP_LIMIT = 24
+CROP_FRAMES = 10
+# A crop rectangle must be found at this share of the seek points to be used
+CROP_MIN_AGREEMENT = 0.5
+# Crops trimming less than this share of the width and of the height are not worth it
+CROP_MIN_GAIN = 0.02
+
+# idet: frames per seek point (ten 3:2 pulldown cycles) and classification thresholds
+IDET_FRAMES = 50
+INTERLACED_SHARE = 0.15     # Combed frames above this share mean the source is not progressive
+TELECINE_REPEATED_SHARE = 0.15
+# Filters inserted for each scan type; {deinterlacer} is bwdif or yadif
+DEINTERLACE_FILTERS = {
+    "interlaced": "{deinterlacer}=mode=send_frame:parity={parity}:deint=all",
+    # Match fields back into film frames, clean up leftovers, then drop the duplicate frame of each cycle
+    "telecined": "fieldmatch=order={parity},{deinterlacer}=mode=send_frame:parity={parity}:deint=interlaced,decimate",
+}
+DEINTERLACERS = {"auto": "bwdif", "bwdif": "bwdif", "yadif": "yadif"}
+
+FRAME_LINE = re.compile(r"\bframe:\s*(\d+)")
+METADATA_LINE = re.compile(r"\b(lavfi\.[\w.]+)=(\S+)")
+CROP_LINE = re.compile(r"crop=(\d+):(\d+):(\d+):(\d+)")
+IDET_MULTI_LINE = re.compile(r"Multi frame detection:\s*TFF:\s*(\d+)\s*BFF:\s*(\d+)\s*"
+                             r"Progressive:\s*(\d+)\s*Undetermined:\s*(\d+)")
+IDET_REPEAT_LINE = re.compile(r"Repeated Fields:\s*Neither:\s*(\d+)\s*Top:\s*(\d+)\s*Bottom:\s*(\d+)")
+
+def sample_starts(duration: float, count: int = DEFAULT_SAMPLE_POINTS) -> List[float]:
+    """Seek positions spread evenly over the file, away from the very start and end."""
+    if duration <= 0 or count <= 1:
+        return [0.0]
+    span = duration * (1 - 2 * SAMPLE_MARGIN)
+    return [duration * SAMPLE_MARGIN + span * (index + 0.5) / count for index in range(count)]
+
+def parse_frame_metadata(lines: List[str]) -> List[Dict[str, str]]:
+    """Per-frame values printed by the metadata filter (lavfi.* keys)."""
+    frames: List[Dict[str, str]] = []
+    for line in lines:
+        if FRAME_LINE.search(line) and "pts" in line:
+            frames.append({})
+            continue
+        match = METADATA_LINE.search(line)
+        if match and frames:
+            frames[-1][match.group(1)] = match.group(2)
+    return frames
+
+class FrameSampler:
+    """Decodes a few frames at several seek points in parallel and runs a filter on them.
+
+    input_args(start) returns the ffmpeg input options seeking to start; sampling a file
+    never decodes more than frames * len(starts) frames.
+    """
+
+    def __init__(self, ffmpeg: str, runner: ProcessRunner, input_args: Callable[[float], List[str]],
+                 video_index: int = 0, max_workers: Optional[int] = None,
+                 on_start: Optional[Callable[[int], None]] = None):
+        self.ffmpeg = ffmpeg
+        self.runner = runner
+        self.input_args = input_args
+        self.video_index = video_index
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.on_start = on_start
+
+    def collect(self, video_filter: str, starts: List[float], frames: int = SAMPLE_FRAMES) -> List[List[str]]:
+        """Filter log lines per seek point; points that fail to decode give no lines."""
+        return self.runner.call(self.collect_async(video_filter, starts, frames))
+
+    async def collect_async(self, video_filter: str, starts: List[float],
+                            frames: int = SAMPLE_FRAMES) -> List[List[str]]:
+        limit = asyncio.Semaphore(self.max_workers)
+
+        async def sample(start: float) -> List[str]:
+            async with limit:
+                return await self._sample(video_filter, start, frames)
+
+        tasks = [asyncio.create_task(sample(start)) for start in starts]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def _sample(self, video_filter: str, start: float, frames: int) -> List[str]:
+        cmd = [
+            self.ffmpeg,
+            "-hide_banner",
+            "-nostats",
+            "-v", "info",
+            *self.input_args(start),
+            "-map", f"0:v:{self.video_index}",
+            "-frames:v", str(frames),
+            "-vf", video_filter,
+            "-an", "-sn",
+            "-f", "null", "-"
+        ]
+        lines: List[str] = []
+        try:
+            result = await self.runner.execute(cmd, stderr_callback=lines.append, keep_output=False,
+                                               on_start=self.on_start)
+        except OSError as e:
+            logger.warning(f"Sampling at {start:.1f}s failed: {str(e)}")
+            return []
+        if result.returncode != 0:
+            logger.warning(f"Sampling at {start:.1f}s failed (exit code {result.returncode})")
+            return []
+        return lines
+
+@dataclass(slots=True)
+class ColorEstimate:
+    colorspace: str             # colorspace filter name, or "auto" for no conversion
+    colorrange: str             # tv, pc or auto
+    confidence: float           # 0.0 - 1.0
+    frames: int = 0
+    reasons: List[str] = field(default_factory=list)
+
+    @property
+    def confident(self) -> bool:
+        return self.confidence >= COLOR_CONFIDENCE_THRESHOLD
+
+def _bit_depth(pix_fmt: str) -> int:
+    match = re.search(r"p(\d+)(?:le|be)?$", pix_fmt)
+    return int(match.group(1)) if match else 8
+
+def is_rgb_format(pix_fmt: str) -> bool:
+    return pix_fmt.startswith(("rgb", "bgr", "gbr", "argb", "abgr", "rgba", "bgra", "gray", "ya", "pal8"))
+
+def estimate_matrix(video_info: dict) -> tuple:
+    """(colorspace, confidence, reason) from tags, resolution and frame rate."""
+    if video_info.get("colorspace") in COLORSPACE_FILTER_NAMES:
+        return video_info["colorspace"], 1.0, "matrix tagged in the source"
+    for key in ("colorprim", "colortrc"):
+        tagged = MATRIX_FROM_TAGS.get(video_info.get(key, "unknown"))
+        if tagged:
+            return tagged, 0.95, f"{key} tag {video_info[key]}"
+
+    width, height = video_info.get("width", 0), video_info.get("height", 0)
+    fps = video_info.get("fps", 0.0)
+    if width >= 1280 or height >= 720:
+        return "bt709", 0.85, f"HD resolution {width}x{height}"
+    if height in (576, 288) or round(fps) in (25, 50):
+        return "bt601-6-625", 0.85, f"PAL-style SD {width}x{height} @ {fps:.2f} fps"
+    if height in (480, 486, 240) or round(fps * 1.001) in (30, 60):
+        return "bt601-6-525", 0.85, f"NTSC-style SD {width}x{height} @ {fps:.2f} fps"
+    return "bt601-6-625", 0.6, f"SD resolution {width}x{height}"
+
+def estimate_range(pix_fmt: str, stats: List[Dict[str, str]]) -> tuple:
+    """(colorrange, confidence, reason) from signalstats luma/chroma extremes."""
+    if pix_fmt.startswith("yuvj"):
+        return "pc", 0.99, f"full-range pixel format {pix_fmt}"
+    if not stats:
+        return "tv", 0.0, "no frames could be sampled"
+
+    scale = 2 ** (_bit_depth(pix_fmt) - 8)
+    outside = 0
+    spans_limits = False
+    for frame in stats:
+        try:
+            y_min = float(frame["lavfi.signalstats.YMIN"])
+            y_max = float(frame["lavfi.signalstats.YMAX"])
+            c_min = min(float(frame.get("lavfi.signalstats.UMIN", 128 * scale)),
+                        float(frame.get("lavfi.signalstats.VMIN", 128 * scale)))
+            c_max = max(float(frame.get("lavfi.signalstats.UMAX", 128 * scale)),
+                        float(frame.get("lavfi.signalstats.VMAX", 128 * scale)))
+        except (KeyError, ValueError):
+            continue
+        # Legal-range video stays inside 16-235 (luma) and 16-240 (chroma), give or take overshoot
+        if y_min < 12 * scale or y_max > 240 * scale or c_min < 12 * scale or c_max > 244 * scale:
+            outside += 1
+        if y_min <= 20 * scale and y_max >= 230 * scale:
+            spans_limits = True
+
+    share = outside / len(stats)
+    if share >= 0.2:
+        return "pc", min(0.99, 0.6 + share), f"{outside}/{len(stats)} frames outside limited range"
+    if outside:
+        return "tv", 0.6, f"{outside}/{len(stats)} frames overshoot limited range"
+    if spans_limits:
+        return "tv", 0.9, "blacks and whites sit at the limited-range limits"
+    return "tv", 0.6, "sampled frames never reach the range limits"
+
+def estimate_color(video_info: dict, stats: List[Dict[str, str]]) -> ColorEstimate:
+    """Combine the matrix and range guesses; the confidence is that of the weaker one."""
+    pix_fmt = video_info.get("pixfmt", "unknown")
+    if is_rgb_format(pix_fmt):
+        return ColorEstimate("auto", "auto", 0.95, len(stats), [f"RGB source ({pix_fmt}), no matrix to convert"])
+
+    colorspace, space_confidence, space_reason = estimate_matrix(video_info)
+    if video_info.get("colorrange") in ("tv", "pc"):
+        colorrange, range_confidence, range_reason = video_info["colorrange"], 1.0, "range tagged in the source"
+    else:
+        colorrange, range_confidence, range_reason = estimate_range(pix_fmt, stats)
+    return ColorEstimate(colorspace, colorrange, min(space_confidence, range_confidence),
+                         len(stats), [space_reason, range_reason])
+
+@dataclass(slots=True)
+class CropEstimate:
+    width: int
+    height: int
+    x: int
+    y: int
+    agreement: float = 1.0      # Share of seek points that found this rectangle
+    samples: int = 0
+
+    @property
+    def rect(self) -> Tuple[int, int, int, int]:
+        return self.width, self.height, self.x, self.y
+
+    @property
+    def filter(self) -> str:
+        return f"crop={self.width}:{self.height}:{self.x}:{self.y}"
+
+def crop_filter(limit: int = CROP_LIMIT) -> str:
+    # reset=0 accumulates over the frames of one seek point; round=2 keeps chroma aligned
+    return f"cropdetect=limit={limit}:round=2:reset=0"
+
+def last_crop(lines: List[str]) -> Optional[Tuple[int, int, int, int]]:
+    """Crop rectangle cropdetect settled on for one seek point."""
+    for line in reversed(lines):
+        match = CROP_LINE.search(line)
+        if match:
+            return tuple(int(value) for value in match.groups())
+    return None
+
+def vote_crop(width: int, height: int, rects: List[Tuple[int, int, int, int]]) -> Optional[CropEstimate]:
+    """Stable crop from per-seek-point rectangles, or None when no crop is worth applying.
+
+    The most common rectangle must win at least CROP_MIN_AGREEMENT of the usable samples.
+    It is then grown to cover every sample, so picture seen at any point is never cut;
+    dark scenes give smaller rectangles and do not shrink the result.
+    """
+    usable = [rect for rect in rects
+              if rect and rect[0] > 0 and rect[1] > 0 and rect[0] * rect[1] >= width * height / 4]
+    if len(usable) < 2:
+        return None
+    winner, votes = collections.Counter(usable).most_common(1)[0]
+    agreement = votes / len(usable)
+    if agreement < CROP_MIN_AGREEMENT:
+        logger.info(f"Crop detection unstable ({votes}/{len(usable)} samples agree), not cropping")
+        return None
+
+    left = min(rect[2] for rect in usable)
+    top = min(rect[3] for rect in usable)
+    right = max(rect[2] + rect[0] for rect in usable)
+    bottom = max(rect[3] + rect[1] for rect in usable)
+    # Even offsets and sizes, rounded outwards
+    left, top = left - left % 2, top - top % 2
+    right, bottom = min(width, right + right % 2), min(height, bottom + bottom % 2)
+    crop = CropEstimate(right - left, bottom - top, left, top, agreement, len(usable))
+    if crop.width > width * (1 - CROP_MIN_GAIN) and crop.height > height * (1 - CROP_MIN_GAIN):
+        return None
+    return crop
+
+_crop_cache: Dict[tuple, Optional[CropEstimate]] = {}
+_crop_lock = threading.Lock()
+
+def cached_crop(key: tuple) -> Tuple[bool, Optional[CropEstimate]]:
+    """(found, crop) for a source detected earlier in this process."""
+    with _crop_lock:
+        return key in _crop_cache, _crop_cache.get(key)
+
+def store_crop(key: tuple, crop: Optional[CropEstimate]):
+    with _crop_lock:
+        _crop_cache[key] = crop
+
+@dataclass(slots=True)
+class ScanEstimate:
+    kind: str                   # progressive, interlaced or telecined
+    field_order: str = "tff"    # tff or bff
+    interlaced_share: float = 0.0
+    repeated_share: float = 0.0
+    frames: int = 0
+
+    def filter(self, deinterlacer: str = "bwdif") -> str:
+        """Deinterlace/inverse telecine filters for this source; empty for progressive."""
+        template = DEINTERLACE_FILTERS.get(self.kind)
+        if template is None:
+            return ""
+        return template.format(deinterlacer=deinterlacer, parity=self.field_order)
+
+    @property
+    def fps_factor(self) -> float:
+        # decimate drops one frame in five
+        return 0.8 if self.kind == "telecined" else 1.0
+
+def parse_idet(lines: List[str]) -> Optional[Dict[str, int]]:
+    """Final idet counters of one seek point."""
+    counts: Dict[str, int] = {}
+    for line in lines:
+        multi = IDET_MULTI_LINE.search(line)
+        if multi:
+            counts.update(zip(("tff", "bff", "progressive", "undetermined"), map(int, multi.groups())))
+        repeat = IDET_REPEAT_LINE.search(line)
+        if repeat:
+            counts.update(zip(("neither", "top", "bottom"), map(int, repeat.groups())))
+    return counts if "tff" in counts else None
+
+def classify_scan(video_info: dict, samples: List[Optional[Dict[str, int]]]) -> ScanEstimate:
+    """Progressive, interlaced or telecined from idet counters summed over the seek points.
+
+    Falls back to the container field_order when no sample could be analysed.
+    """
+    totals = collections.Counter()
+    for counts in samples:
+        if counts:
+            totals.update(counts)
+    decided = totals["tff"] + totals["bff"] + totals["progressive"]
+    if decided == 0:
+        order = video_info.get("field_order", "unknown")
+        if order in ("tt", "tb"):
+            return ScanEstimate("interlaced", "tff")
+        if order in ("bb", "bt"):
+            return ScanEstimate("interlaced", "bff")
+        return ScanEstimate("progressive")
+
+    field_order = "tff" if totals["tff"] >= totals["bff"] else "bff"
+    interlaced_share = (totals["tff"] + totals["bff"]) / decided
+    fields = totals["neither"] + totals["top"] + totals["bottom"]
+    repeated_share = (totals["top"] + totals["bottom"]) / fields if fields else 0.0
+    fps = video_info.get("fps", 0.0)
+
+    # 3:2 pulldown at 29.97/30 fps combs two frames in five, each repeating a field of its
+    # neighbour; true interlaced video combs without repeating fields
+    ntsc_rate = round(fps * 1.001) == 30 or round(fps) == 30
+    if ntsc_rate and interlaced_share >= INTERLACED_SHARE and repeated_share >= TELECINE_REPEATED_SHARE:
+        kind = "telecined"
+    elif interlaced_share >= INTERLACED_SHARE:
+        kind = "interlaced"
+    else:
+        kind = "progressive"
+    return ScanEstimate(kind, field_order, interlaced_share, repeated_share, decided + totals["undetermined"])
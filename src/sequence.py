@@ -0,0 +1,298 @@
+import asyncio
+import collections
+import logging
+import os
+import re
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from fractions import Fraction
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from errors import VideoAnalysisError
+from probe import FormatInfo, MediaInfo, VideoStream
+
+logger = logging.getLogger("o3enc.sequence")
+
+SEQUENCE_EXTENSIONS = {".png": "png", ".tif": "tiff", ".tiff": "tiff", ".exr": "exr"}
+DEFAULT_SEQUENCE_FPS = "30"
+
+# Read-ahead limits for slow storage
+DEFAULT_PREFETCH_WORKERS = 8
+PREFETCH_BUDGET_BYTES = 1024 * 1024 * 1024
+MAX_PREFETCH_WINDOW = 64
+
+HEADER_BYTES = 64 * 1024
+
+NUMBERED_NAME = re.compile(r"^(.*?)(\d+)(\.[^.]+)$")
+PRINTF_NUMBER = re.compile(r"%(?:0(\d+))?d")
+
+PNG_FORMATS = {
+    (0, 8): "gray", (0, 16): "gray16be", (2, 8): "rgb24", (2, 16): "rgb48be",
+    (4, 8): "ya8", (4, 16): "ya16be", (6, 8): "rgba", (6, 16): "rgba64be",
+}
+TIFF_FORMATS = {
+    (1, 8): "gray", (1, 16): "gray16le", (3, 8): "rgb24", (3, 16): "rgb48le",
+    (4, 8): "rgba", (4, 16): "rgba64le",
+}
+EXR_FORMATS = {1: "grayf32le", 3: "gbrpf32le", 4: "gbrapf32le"}
+
+@dataclass(slots=True)
+class ImageSequence:
+    directory: Path
+    prefix: str
+    suffix: str
+    digits: int             # zero padding width, 0 when numbers are not padded
+    start_number: int
+    frame_count: int
+    codec: str
+    width: int
+    height: int
+    pix_fmt: str
+    fps: Fraction
+    first_size: int
+
+    @property
+    def name(self) -> str:
+        """Base name for outputs: the frame prefix, or the directory name for bare numbers."""
+        return self.prefix.rstrip("._- ") or self.directory.absolute().name or "sequence"
+
+    @property
+    def pattern(self) -> str:
+        number = f"%0{self.digits}d" if self.digits else "%d"
+        return str(self.directory / f"{self.prefix.replace('%', '%%')}{number}{self.suffix}")
+
+    def frame_path(self, number: int) -> Path:
+        return self.directory / f"{self.prefix}{number:0{self.digits}d}{self.suffix}"
+
+    def files(self) -> List[Path]:
+        return [self.frame_path(self.start_number + offset) for offset in range(self.frame_count)]
+
+    def input_args(self, prefetch: bool = False) -> List[str]:
+        rate = f"{self.fps.numerator}/{self.fps.denominator}"
+        if prefetch:
+            # File contents arrive on stdin in frame order; ffmpeg only decodes
+            return ["-f", f"{self.codec}_pipe", "-framerate", rate, "-i", "pipe:0"]
+        return ["-f", "image2", "-framerate", rate, "-start_number", str(self.start_number),
+                "-i", self.pattern]
+
+    def media_info(self) -> MediaInfo:
+        """Stream model equivalent to what ffprobe would report for the sequence."""
+        fps = float(self.fps)
+        duration = self.frame_count / fps
+        return MediaInfo(
+            path=self.pattern,
+            format=FormatInfo(
+                format_name="image2",
+                duration=duration,
+                size=self.first_size * self.frame_count,
+                start_time=0.0
+            ),
+            video=[VideoStream(
+                index=0,
+                stream_index=0,
+                codec=self.codec,
+                width=self.width,
+                height=self.height,
+                fps=fps,
+                r_frame_rate=f"{self.fps.numerator}/{self.fps.denominator}",
+                pix_fmt=self.pix_fmt,
+                field_order="progressive",
+                bit_rate=int(self.first_size * 8 * fps),
+                duration=duration,
+                start_time=0.0,
+                nb_frames=self.frame_count
+            )]
+        )
+
+def is_sequence_path(path: str) -> bool:
+    """Directory, printf pattern (frame_%04d.png) or numbered image file."""
+    candidate = Path(path)
+    if PRINTF_NUMBER.search(candidate.name):
+        return True
+    if candidate.is_dir():
+        return True
+    return (candidate.suffix.lower() in SEQUENCE_EXTENSIONS
+            and NUMBERED_NAME.match(candidate.name) is not None)
+
+def _scan(directory: Path) -> Dict[Tuple[str, str], Dict[int, str]]:
+    """Numbered image files in a directory, grouped by (prefix, suffix)."""
+    groups: Dict[Tuple[str, str], Dict[int, str]] = collections.defaultdict(dict)
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                match = NUMBERED_NAME.match(entry.name)
+                if match and match.group(3).lower() in SEQUENCE_EXTENSIONS:
+                    groups[(match.group(1), match.group(3))][int(match.group(2))] = match.group(2)
+    except OSError as e:
+        raise VideoAnalysisError(f"Cannot read sequence directory {directory}: {e}")
+    return groups
+
+def find_sequence(path: str, fps: str = DEFAULT_SEQUENCE_FPS) -> ImageSequence:
+    """Locate a frame sequence, count its frames and read the first frame header."""
+    candidate = Path(path)
+    pattern = PRINTF_NUMBER.search(candidate.name)
+    if pattern:
+        directory = candidate.parent
+        key = (candidate.name[:pattern.start()].replace("%%", "%"),
+               candidate.name[pattern.end():].replace("%%", "%"))
+        numbers = _scan(directory).get(key, {})
+    elif candidate.is_dir():
+        directory = candidate
+        groups = _scan(directory)
+        if not groups:
+            raise VideoAnalysisError(f"No numbered PNG/TIFF/EXR frames in {directory}")
+        key = max(groups, key=lambda group: len(groups[group]))
+        numbers = groups[key]
+    else:
+        match = NUMBERED_NAME.match(candidate.name)
+        if not match:
+            raise VideoAnalysisError(f"Not a numbered frame: {candidate}")
+        directory = candidate.parent
+        key = (match.group(1), match.group(3))
+        numbers = _scan(directory).get(key, {})
+    if not numbers:
+        raise VideoAnalysisError(f"No frames found for {path}")
+
+    prefix, suffix = key
+    start = min(numbers)
+    count = 1
+    while start + count in numbers:
+        count += 1
+    if count < len(numbers):
+        logger.warning(f"Sequence has a gap after frame {start + count - 1}; "
+                       f"only frames {start}-{start + count - 1} are used")
+    padded = [text for text in numbers.values() if len(text) > 1 and text.startswith("0")]
+    digits = len(padded[0]) if padded else 0
+
+    codec = SEQUENCE_EXTENSIONS[suffix.lower()]
+    first = directory / f"{prefix}{numbers[start]}{suffix}"
+    try:
+        with open(first, "rb") as f:
+            header = f.read(HEADER_BYTES)
+        first_size = first.stat().st_size
+    except OSError as e:
+        raise VideoAnalysisError(f"Cannot read first frame {first}: {e}")
+    width, height, pix_fmt = read_image_header(codec, header)
+
+    try:
+        rate = Fraction(str(fps).strip())
+    except (ValueError, ZeroDivisionError):
+        raise VideoAnalysisError(f"Invalid frame rate: {fps}")
+    if rate <= 0:
+        raise VideoAnalysisError(f"Invalid frame rate: {fps}")
+
+    sequence = ImageSequence(directory, prefix, suffix, digits, start, count, codec,
+                             width, height, pix_fmt, rate, first_size)
+    logger.info(f"Image sequence: {sequence.pattern} ({count} frames from {start}, "
+                f"{width}x{height} {pix_fmt})")
+    return sequence
+
+def read_image_header(codec: str, header: bytes) -> Tuple[int, int, str]:
+    """(width, height, pix_fmt) from the first bytes of a PNG, TIFF or EXR file."""
+    try:
+        if codec == "png":
+            return _png_header(header)
+        if codec == "tiff":
+            return _tiff_header(header)
+        return _exr_header(header)
+    except (struct.error, IndexError, ValueError) as e:
+        raise VideoAnalysisError(f"Unreadable {codec.upper()} header: {e}")
+
+def _png_header(header: bytes) -> Tuple[int, int, str]:
+    if header[:8] != b"\x89PNG\r\n\x1a\n" or header[12:16] != b"IHDR":
+        raise ValueError("not a PNG file")
+    width, height, depth, color_type = struct.unpack(">IIBB", header[16:26])
+    if color_type == 3:
+        return width, height, "pal8"
+    return width, height, PNG_FORMATS.get((color_type, depth), "rgb24")
+
+def _tiff_header(header: bytes) -> Tuple[int, int, str]:
+    order = {b"II": "<", b"MM": ">"}.get(header[:2])
+    if order is None or struct.unpack(order + "H", header[2:4])[0] != 42:
+        raise ValueError("not a TIFF file")
+    offset = struct.unpack(order + "I", header[4:8])[0]
+    (entries,) = struct.unpack(order + "H", header[offset:offset + 2])
+    fields = {}
+    for number in range(entries):
+        start = offset + 2 + number * 12
+        tag, kind, count = struct.unpack(order + "HHI", header[start:start + 8])
+        if kind == 3:       # SHORT
+            value = struct.unpack(order + "H", header[start + 8:start + 10])[0]
+            if count > 2:   # Values live elsewhere; the first one is enough
+                pointer = struct.unpack(order + "I", header[start + 8:start + 12])[0]
+                value = struct.unpack(order + "H", header[pointer:pointer + 2])[0]
+        elif kind == 4:     # LONG
+            value = struct.unpack(order + "I", header[start + 8:start + 12])[0]
+        else:
+            continue
+        fields[tag] = value
+    width, height = fields[256], fields[257]
+    bits, samples = fields.get(258, 8), fields.get(277, 1)
+    return width, height, TIFF_FORMATS.get((samples, bits), "rgb24")
+
+def _exr_header(header: bytes) -> Tuple[int, int, str]:
+    if header[:4] != b"\x76\x2f\x31\x01":
+        raise ValueError("not an OpenEXR file")
+    position = 8
+    window = None
+    channels = 0
+    while position < len(header) and header[position] != 0:
+        name_end = header.index(b"\0", position)
+        type_end = header.index(b"\0", name_end + 1)
+        name = header[position:name_end]
+        (size,) = struct.unpack("<i", header[type_end + 1:type_end + 5])
+        value = header[type_end + 5:type_end + 5 + size]
+        if name == b"dataWindow":
+            window = struct.unpack("<iiii", value[:16])
+        elif name == b"channels":
+            # name\0 + pixel type, linear, reserved, x/y sampling (16 bytes) per channel
+            cursor = 0
+            while cursor < len(value) and value[cursor] != 0:
+                cursor = value.index(b"\0", cursor) + 17
+                channels += 1
+        position = type_end + 5 + size
+    if window is None:
+        raise ValueError("no dataWindow attribute")
+    x_min, y_min, x_max, y_max = window
+    return x_max - x_min + 1, y_max - y_min + 1, EXR_FORMATS.get(channels, "gbrapf32le")
+
+def _read_file(path: Path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+class SequencePrefetcher:
+    """Reads upcoming frames on a thread pool and streams them to ffmpeg's stdin in order.
+
+    The read-ahead window is sized from the first frame so buffered frames stay within
+    PREFETCH_BUDGET_BYTES. first/count select a frame range (offsets into the sequence).
+    """
+
+    def __init__(self, sequence: ImageSequence, workers: int = DEFAULT_PREFETCH_WORKERS,
+                 first: int = 0, count: Optional[int] = None):
+        self.files = sequence.files()[first:None if count is None else first + count]
+        self.workers = max(1, workers)
+        self.window = max(2, min(MAX_PREFETCH_WINDOW, PREFETCH_BUDGET_BYTES // max(1, sequence.first_size)))
+
+    async def feed(self, stdin: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="o3enc-prefetch")
+        files = iter(self.files)
+        pending = collections.deque()
+        try:
+            for path in files:
+                pending.append(loop.run_in_executor(pool, _read_file, path))
+                if len(pending) >= self.window:
+                    break
+            while pending:
+                data = await pending.popleft()
+                path = next(files, None)
+                if path is not None:
+                    pending.append(loop.run_in_executor(pool, _read_file, path))
+                stdin.write(data)
+                await stdin.drain()
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False, cancel_futures=True)
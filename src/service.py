@@ -0,0 +1,510 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from errors import O3EncoderError
+from sequence import find_sequence, is_sequence_path
+
+logger = logging.getLogger("o3enc.service")
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+MAX_REQUEST_BYTES = 1024 * 1024
+TERMINAL_STATES = {"done", "failed", "cancelled"}
+# Lower rank runs first; a queued job pauses a running job of a lower priority when no slot is free
+PRIORITIES = {"urgent": 0, "normal": 1, "batch": 2}
+DEFAULT_PRIORITY = "normal"
+
+HTTP_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found",
+                405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+                500: "Internal Server Error"}
+
+class ServiceError(O3EncoderError):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+@dataclass
+class JobRecord:
+    id: str
+    input_file: str
+    presets: List[str]
+    output_dir: Optional[str] = None
+    colorspace: str = "auto"
+    colorrange: str = "auto"
+    # (start, end) seconds of the input to encode; end None means to the end
+    trim: Optional[Tuple[float, Optional[float]]] = None
+    priority: str = DEFAULT_PRIORITY
+    status: str = "queued"
+    # "user" (held until resumed) or "scheduler" (preempted, resumed when a slot is free)
+    paused_by: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    error: Optional[str] = None
+    estimate: Optional[float] = None
+    results: Dict[str, dict] = field(default_factory=dict)
+    events: List[dict] = field(default_factory=list)
+    encoder: Any = None
+    subscribers: List[asyncio.Queue] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "input": self.input_file,
+            "presets": self.presets,
+            "output_dir": self.output_dir,
+            "trim": list(self.trim) if self.trim else None,
+            "priority": self.priority,
+            "status": self.status,
+            "paused_by": self.paused_by,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+            "estimate": self.estimate,
+            "progress": self.events[-1] if self.events else None,
+            "results": self.results
+        }
+
+def serialize_results(results: Dict[str, dict]) -> Dict[str, dict]:
+    """JSON-safe view of run_batch() results."""
+    serialized = {}
+    for name, result in results.items():
+        entry = {
+            "success": result['success'],
+            "output_file": str(result['output_file']),
+            "error": result.get('error')
+        }
+        passthrough = result.get('passthrough')
+        if passthrough:
+            entry["passthrough"] = {key: passthrough[key] for key in ('video_copy', 'audio_copy', 'remux')}
+        verification = result.get('verification')
+        if verification is not None:
+            entry["verification"] = {
+                "passed": verification.passed,
+                "checks": [{"name": c.name, "passed": c.passed, "detail": c.detail}
+                           for c in verification.checks]
+            }
+        serialized[name] = entry
+    return serialized
+
+class JobService:
+    """In-process job queue: runs submitted jobs with a concurrency limit and fans out progress events.
+
+    Queued jobs start by priority (urgent, normal, batch). With an estimator (input, preset
+    names -> expected seconds) jobs of one priority start longest first, so short jobs fill
+    the gaps at the end instead of a long one starting last. When every slot is taken, a
+    queued job pauses the lowest-priority running job below it and takes its slot; the
+    paused job continues once a slot is free again. Paused jobs keep their temp files but
+    hand back their volume slots, disk reservations and CPU partitions until they continue.
+    """
+
+    def __init__(self, job_runner: Callable[..., Dict[str, dict]], preset_names: List[str],
+                 max_concurrent: int = 1,
+                 estimator: Optional[Callable[[str, List[str]], float]] = None,
+                 preempt: bool = True):
+        self.job_runner = job_runner
+        self.preset_names = preset_names
+        self.max_concurrent = max(1, max_concurrent)
+        self.estimator = estimator
+        self.preempt = preempt
+        self.jobs: Dict[str, JobRecord] = {}
+        self._ids = itertools.count(1)
+        # Heap of (priority rank, -estimate, id, job)
+        self._queue: List[Tuple[int, float, int, JobRecord]] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._estimating: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        self._stopping = True
+        for job in self.jobs.values():
+            if job.started is not None and job.status not in TERMINAL_STATES and job.encoder is not None:
+                job.encoder.cancel()
+        tasks = [*self._running.values(), *self._estimating]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def submit(self, request: dict) -> JobRecord:
+        if not isinstance(request, dict):
+            raise ServiceError(400, "Request body must be a JSON object")
+        input_file = request.get("input")
+        presets = request.get("presets")
+        if not isinstance(input_file, str) or not input_file:
+            raise ServiceError(400, "'input' must be a file path")
+        if not Path(input_file).is_file():
+            # Image sequences are found the way run_batch will look them up
+            if not is_sequence_path(input_file):
+                raise ServiceError(400, f"Input file not found: {input_file}")
+            try:
+                find_sequence(input_file)
+            except O3EncoderError as e:
+                raise ServiceError(400, str(e))
+        if isinstance(presets, str):
+            presets = [presets]
+        if not isinstance(presets, list) or not presets or not all(isinstance(p, str) for p in presets):
+            raise ServiceError(400, "'presets' must be a list of preset names")
+        unknown = [p for p in presets if p not in self.preset_names]
+        if unknown:
+            raise ServiceError(400, f"Unknown presets: {', '.join(unknown)}")
+        trim = request.get("trim")
+        if trim is not None:
+            if (not isinstance(trim, list) or len(trim) != 2
+                    or not isinstance(trim[0], (int, float))
+                    or not (trim[1] is None or isinstance(trim[1], (int, float)))):
+                raise ServiceError(400, "'trim' must be [start, end] in seconds (end may be null)")
+            trim = (float(trim[0]), None if trim[1] is None else float(trim[1]))
+        priority = request.get("priority", DEFAULT_PRIORITY)
+        if priority not in PRIORITIES:
+            raise ServiceError(400, f"'priority' must be one of: {', '.join(PRIORITIES)}")
+
+        job = JobRecord(
+            id=str(next(self._ids)),
+            input_file=input_file,
+            presets=presets,
+            output_dir=request.get("output_dir"),
+            colorspace=request.get("colorspace", "auto"),
+            colorrange=request.get("colorrange", "auto"),
+            trim=trim,
+            priority=priority
+        )
+        self.jobs[job.id] = job
+        self._publish(job, {"event": "queued"})
+        if self.estimator is None:
+            self._enqueue(job)
+        else:
+            task = asyncio.create_task(self._estimate(job))
+            self._estimating.add(task)
+            task.add_done_callback(self._estimating.discard)
+        logger.info(f"Job {job.id} submitted: {input_file} ({', '.join(presets)}, {priority})")
+        return job
+
+    def _enqueue(self, job: JobRecord):
+        if job.status != "queued":
+            # Cancelled or held while being estimated
+            return
+        # Longest expected job first within a priority, submission order among equals
+        heapq.heappush(self._queue, (PRIORITIES[job.priority], -(job.estimate or 0.0), int(job.id), job))
+        self._schedule()
+
+    async def _estimate(self, job: JobRecord):
+        try:
+            job.estimate = await self._loop.run_in_executor(
+                None, self.estimator, job.input_file, job.presets)
+        except O3EncoderError as e:
+            logger.warning(f"Could not estimate job {job.id}: {str(e)}")
+        self._enqueue(job)
+
+    def get(self, job_id: str) -> JobRecord:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise ServiceError(404, f"Unknown job: {job_id}")
+        return job
+
+    def cancel(self, job_id: str) -> JobRecord:
+        job = self.get(job_id)
+        if job.status in TERMINAL_STATES:
+            raise ServiceError(409, f"Job {job_id} is already {job.status}")
+        if job.started is None:
+            # The scheduler drops cancelled jobs when they reach the top of the queue
+            self._finish(job, "cancelled")
+        elif job.status != "cancelling":
+            job.status = "cancelling"
+            job.paused_by = None
+            # Otherwise cancelled as soon as run_batch() hands the encoder over
+            if job.encoder is not None:
+                job.encoder.cancel()
+        logger.info(f"Job {job_id} cancellation requested")
+        return job
+
+    def pause(self, job_id: str) -> JobRecord:
+        """Hold a job until resume(): a queued job is not started, a running one is suspended."""
+        job = self.get(job_id)
+        if job.status == "paused" and job.paused_by == "scheduler":
+            job.paused_by = "user"
+            self._publish(job, {"event": "paused", "by": "user"})
+        elif job.status in ("queued", "running"):
+            self._pause(job, "user")
+            # The slot it held is free now
+            self._schedule()
+        else:
+            raise ServiceError(409, f"Job {job_id} is {job.status}")
+        logger.info(f"Job {job_id} paused")
+        return job
+
+    def resume(self, job_id: str) -> JobRecord:
+        """Release a held job; it continues (or starts) as soon as the scheduler has a slot for it."""
+        job = self.get(job_id)
+        if job.status != "paused" or job.paused_by != "user":
+            raise ServiceError(409, f"Job {job_id} is not paused")
+        if job.started is None:
+            job.status, job.paused_by = "queued", None
+            self._publish(job, {"event": "queued"})
+            self._enqueue(job)
+        else:
+            job.paused_by = "scheduler"
+            self._schedule()
+        logger.info(f"Job {job_id} resume requested")
+        return job
+
+    def _pause(self, job: JobRecord, by: str):
+        job.status, job.paused_by = "paused", by
+        if job.encoder is not None:
+            job.encoder.suspend()
+        self._publish(job, {"event": "paused", "by": by})
+
+    def _schedule(self):
+        """Fill free slots by priority, pausing outranked running jobs when none is free."""
+        while not self._stopping:
+            candidate = self._next_candidate()
+            if candidate is None:
+                return
+            active = [job for job in self.jobs.values() if job.status in ("running", "cancelling")]
+            if len(active) >= self.max_concurrent:
+                victims = [job for job in active if job.status == "running"
+                           and PRIORITIES[job.priority] > PRIORITIES[candidate.priority]]
+                if not self.preempt or not victims:
+                    return
+                # Lowest priority first, then the one that started last
+                victim = max(victims, key=lambda job: (PRIORITIES[job.priority], job.started))
+                logger.info(f"Job {victim.id} ({victim.priority}) paused for job {candidate.id} "
+                            f"({candidate.priority})")
+                self._pause(victim, "scheduler")
+            if candidate.status == "paused":
+                candidate.status, candidate.paused_by = "running", None
+                if candidate.encoder is not None:
+                    candidate.encoder.resume()
+                self._publish(candidate, {"event": "resumed"})
+            else:
+                heapq.heappop(self._queue)
+                # Running from here on, so the next pass of the loop counts it
+                candidate.status = "running"
+                candidate.started = time.time()
+                self._publish(candidate, {"event": "started"})
+                self._running[candidate.id] = asyncio.create_task(self._run(candidate))
+
+    def _next_candidate(self) -> Optional[JobRecord]:
+        """Top of the queue or a job paused by the scheduler, whichever ranks first."""
+        while self._queue and self._queue[0][-1].status != "queued":
+            heapq.heappop(self._queue)
+        # A paused job goes before queued ones of its priority; its work is partly done
+        options = [((PRIORITIES[job.priority], 0, 0.0, int(job.id)), job) for job in self.jobs.values()
+                   if job.status == "paused" and job.paused_by == "scheduler"]
+        if self._queue:
+            rank, estimate, number, job = self._queue[0]
+            options.append(((rank, 1, estimate, number), job))
+        return min(options, key=lambda option: option[0])[1] if options else None
+
+    def subscribe(self, job: JobRecord) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in job.events:
+            queue.put_nowait(event)
+        if job.status in TERMINAL_STATES:
+            queue.put_nowait(None)
+        else:
+            job.subscribers.append(queue)
+        return queue
+
+    def _publish(self, job: JobRecord, event: dict):
+        event = {"job": job.id, "time": time.time(), **event}
+        job.events.append(event)
+        for queue in job.subscribers:
+            queue.put_nowait(event)
+
+    def _finish(self, job: JobRecord, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        job.encoder = None
+        self._publish(job, {"event": status, "error": error})
+        for queue in job.subscribers:
+            queue.put_nowait(None)
+        job.subscribers.clear()
+
+    async def _run(self, job: JobRecord):
+        try:
+            await self._execute(job)
+        finally:
+            self._running.pop(job.id, None)
+            self._schedule()
+
+    async def _execute(self, job: JobRecord):
+        def on_progress(progress: dict):
+            self._loop.call_soon_threadsafe(self._publish, job, {"event": "progress", **progress})
+
+        def on_encoder(encoder):
+            job.encoder = encoder
+            # Paused or cancelled before the encoder existed
+            if job.status == "cancelling":
+                encoder.cancel()
+            elif job.status == "paused":
+                encoder.suspend()
+
+        try:
+            results = await self._loop.run_in_executor(
+                None, lambda: self.job_runner(
+                    job.input_file, job.presets, job.output_dir, job.colorspace, job.colorrange,
+                    on_progress, on_encoder, job.trim, job.priority
+                )
+            )
+        except Exception as e:
+            cancelled = job.status == "cancelling"
+            self._finish(job, "cancelled" if cancelled else "failed", None if cancelled else str(e))
+            return
+
+        job.results = serialize_results(results)
+        if job.status == "cancelling":
+            self._finish(job, "cancelled")
+        elif all(result["success"] for result in job.results.values()):
+            self._finish(job, "done")
+        else:
+            self._finish(job, "failed", "One or more presets failed")
+
+class HttpFrontend:
+    """Minimal HTTP/1.1 front end over TCP or a Unix socket.
+
+    GET    /presets              list preset names
+    GET    /jobs                 list jobs
+    POST   /jobs                 submit {"input", "presets", "output_dir"?, "colorspace"?, "colorrange"?, "trim"?,
+                                         "priority"?}
+    GET    /jobs/<id>            job status and results
+    DELETE /jobs/<id>            cancel (also POST /jobs/<id>/cancel)
+    POST   /jobs/<id>/pause      hold a queued job or suspend a running one
+    POST   /jobs/<id>/resume     release a held job
+    GET    /jobs/<id>/events     progress events as newline-delimited JSON until the job ends
+    """
+
+    def __init__(self, service: JobService):
+        self.service = service
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, body = await self._read_request(reader)
+            await self._route(method, path, body, writer)
+        except ServiceError as e:
+            await self._send_json(writer, e.status, {"error": str(e)})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Request failed: {str(e)}")
+            await self._send_json(writer, 500, {"error": str(e)})
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Tuple[str, str, Optional[dict]]:
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        parts = request_line.split()
+        if len(parts) != 3:
+            raise ServiceError(400, "Malformed request line")
+        method, target = parts[0].upper(), parts[1]
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ("\r\n", "\n", ""):
+                break
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        body = None
+        try:
+            length = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            raise ServiceError(400, "Invalid Content-Length")
+        if length < 0:
+            raise ServiceError(400, "Invalid Content-Length")
+        if length > MAX_REQUEST_BYTES:
+            raise ServiceError(413, "Request body too large")
+        if length:
+            raw = await reader.readexactly(length)
+            try:
+                body = json.loads(raw.decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                raise ServiceError(400, "Request body must be JSON")
+        return method, urlsplit(target).path.rstrip("/") or "/", body
+
+    async def _route(self, method: str, path: str, body: Optional[dict], writer: asyncio.StreamWriter):
+        segments = [s for s in path.split("/") if s]
+        if segments == ["presets"] and method == "GET":
+            return await self._send_json(writer, 200, {"presets": self.service.preset_names})
+        if segments == ["jobs"]:
+            if method == "GET":
+                return await self._send_json(writer, 200, {"jobs": [job.to_dict() for job in self.service.jobs.values()]})
+            if method == "POST":
+                job = self.service.submit(body if body is not None else {})
+                return await self._send_json(writer, 201, job.to_dict())
+            raise ServiceError(405, f"{method} not allowed on /jobs")
+        if len(segments) >= 2 and segments[0] == "jobs":
+            job_id = segments[1]
+            tail = segments[2:]
+            if not tail and method == "GET":
+                return await self._send_json(writer, 200, self.service.get(job_id).to_dict())
+            if (not tail and method == "DELETE") or (tail == ["cancel"] and method == "POST"):
+                return await self._send_json(writer, 200, self.service.cancel(job_id).to_dict())
+            if tail == ["pause"] and method == "POST":
+                return await self._send_json(writer, 200, self.service.pause(job_id).to_dict())
+            if tail == ["resume"] and method == "POST":
+                return await self._send_json(writer, 200, self.service.resume(job_id).to_dict())
+            if tail == ["events"] and method == "GET":
+                return await self._stream_events(writer, self.service.get(job_id))
+        raise ServiceError(404, f"No route for {method} {path}")
+
+    async def _stream_events(self, writer: asyncio.StreamWriter, job: JobRecord):
+        queue = self.service.subscribe(job)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                     b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            data = (json.dumps(event) + "\n").encode('utf-8')
+            writer.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: dict):
+        data = json.dumps(payload).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                f"Connection: close\r\n\r\n")
+        writer.write(head.encode('latin-1') + data)
+        await writer.drain()
+
+async def serve(service: JobService, address: str = DEFAULT_ADDRESS):
+    """Serve until cancelled. address is 'host:port' or 'unix:/path/to/socket'."""
+    frontend = HttpFrontend(service)
+    await service.start()
+    if address.startswith("unix:"):
+        if sys.platform == "win32":
+            raise ServiceError(400, "Unix sockets are not available on Windows")
+        socket_path = address[len("unix:"):]
+        Path(socket_path).unlink(missing_ok=True)
+        server = await asyncio.start_unix_server(frontend.handle, path=socket_path)
+    else:
+        host, _, port = address.rpartition(":")
+        server = await asyncio.start_server(frontend.handle, host or "127.0.0.1", int(port))
+    logger.info(f"Job service listening on {address} ({service.max_concurrent} concurrent job(s))")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
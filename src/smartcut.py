@@ -0,0 +1,104 @@
+import logging
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("o3enc.smartcut")
+
+# Whole GOPs shorter than this in total are not worth splitting the range for (seconds)
+MIN_COPY_SECONDS = 2.0
+
+# Containers for the pieces of a trimmed output. MPEG-TS repeats the H.264/HEVC parameter
+# sets in-band, so copied and re-encoded pieces decode after concatenation even when
+# their encoder settings differ slightly
+ANNEXB_CODECS = {"h264", "hevc", "mpeg2video"}
+
+# ffprobe profile names and the -profile:v value that makes each encoder produce them
+ENCODER_PROFILES = {
+    "libx264": {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main",
+                "High": "high", "High 10": "high10", "High 4:2:2": "high422",
+                "High 4:4:4 Predictive": "high444"},
+    "libx265": {"Main": "main", "Main 10": "main10", "Main 12": "main12"},
+}
+
+# Preset options the pieces replace with values taken from the source
+PIECE_OVERRIDES = {"-pix_fmt", "-profile", "-profile:v"}
+
+@dataclass(slots=True)
+class CutPlan:
+    start: float
+    end: float
+    copy_start: float    # First keyframe at or after start
+    copy_end: float      # Last keyframe at or before end
+
+    @property
+    def copied(self) -> float:
+        return self.copy_end - self.copy_start
+
+    @property
+    def encoded(self) -> float:
+        return (self.end - self.start) - self.copied
+
+    def pieces(self) -> List[Tuple[str, float, float]]:
+        """(kind, start, end) in output order; kind is encode or copy."""
+        pieces = []
+        if self.copy_start > self.start:
+            pieces.append(("encode", self.start, self.copy_start))
+        pieces.append(("copy", self.copy_start, self.copy_end))
+        if self.end > self.copy_end:
+            pieces.append(("encode", self.copy_end, self.end))
+        return pieces
+
+def plan_cut(keyframes: List[float], start: float, end: float, fps: float,
+             min_copy: float = MIN_COPY_SECONDS) -> Optional[CutPlan]:
+    """Split start..end at the keyframes closest inside it; None when too little can be copied.
+
+    A keyframe within half a frame of a cut point counts as on it, so no
+    one-frame piece is encoded for timestamp rounding.
+    """
+    tolerance = 0.5 / fps if fps > 0 else 0.0
+    inside = [time for time in keyframes if start - tolerance <= time <= end + tolerance]
+    if len(inside) < 2:
+        return None
+    copy_start, copy_end = inside[0], inside[-1]
+    if copy_start - start <= tolerance:
+        start = copy_start
+    if end - copy_end <= tolerance:
+        end = copy_end
+    if copy_end - copy_start < min_copy:
+        return None
+    return CutPlan(start=start, end=end, copy_start=copy_start, copy_end=copy_end)
+
+def piece_encode_options(encoder: str, options: str, pix_fmt: str, profile: str) -> List[str]:
+    """Preset options for an encoded piece, with the source pixel format and profile forced.
+
+    A profile the encoder has no name for is left to the encoder; the piece is probed
+    afterwards either way.
+    """
+    args, words = [], options.split()
+    index = 0
+    while index < len(words):
+        if words[index] in PIECE_OVERRIDES:
+            index += 2
+            continue
+        args.append(words[index])
+        index += 1
+    args += ["-pix_fmt", pix_fmt]
+    encoder_profile = ENCODER_PROFILES.get(encoder, {}).get(profile)
+    if encoder_profile:
+        args += ["-profile:v", encoder_profile]
+    return args
+
+def piece_extension(codec: str) -> str:
+    return "ts" if codec in ANNEXB_CODECS else "mkv"
+
+def parse_timestamp(value: str) -> float:
+    """Seconds from '90', '90.5', '1:30' or '00:01:30.5'; raises ValueError."""
+    parts = str(value).strip().split(":")
+    if len(parts) > 3 or not all(part.strip() for part in parts):
+        raise ValueError(f"Invalid time: {value}")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    if seconds < 0:
+        raise ValueError(f"Invalid time: {value}")
+    return seconds
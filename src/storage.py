@@ -0,0 +1,271 @@
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from errors import EncodingError
+from probe import parse_bitrate
+
+logger = logging.getLogger("o3enc.storage")
+
+# Headroom added on top of bitrate based size estimates
+SIZE_SAFETY_FACTOR = 1.15
+# Free space always left untouched on every volume
+MIN_FREE_BYTES = 512 * 1024 * 1024
+# Rough per-frame size of 2-pass statistics (log + mbtree)
+PASSLOG_BYTES_PER_FRAME = 2048
+
+# How often a suspended job tries again to take back what it handed in (seconds)
+LEASE_POLL_SECONDS = 0.2
+
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "sshfs", "fuse.sshfs", "9p", "afpfs", "davfs"}
+
+@dataclass(slots=True)
+class JobEstimate:
+    output_bytes: int
+    scratch_bytes: int
+
+def estimate_job(preset: dict, video_info: dict, audio_tracks: int = 1) -> JobEstimate:
+    """Estimate output and scratch size of one preset from its bitrates and the source duration."""
+    duration = float(video_info.get('duration') or 0)
+    options = preset.get('options', '')
+    tokens = options.split()
+
+    video_bitrate = None
+    for flag in ('-b:v', '-b', '-maxrate:v', '-maxrate'):
+        if flag in tokens[:-1]:
+            video_bitrate = parse_bitrate(tokens[tokens.index(flag) + 1])
+            if video_bitrate:
+                break
+
+    if video_bitrate is None:
+        # Quality based rate control: scale the source bitrate by the pixel count change
+        source_bitrate = video_info.get('bit_rate')
+        if not source_bitrate and duration > 0:
+            source_bitrate = video_info.get('size_mb', 0) * 1024 * 1024 * 8 / duration
+        pixel_ratio = 1.0
+        try:
+            if preset.get('height'):
+                pixel_ratio = (int(preset['height']) / video_info['height']) ** 2
+        except (ValueError, TypeError, ZeroDivisionError, KeyError):
+            pass
+        video_bitrate = int((source_bitrate or 0) * pixel_ratio)
+
+    audio_bitrate = (parse_bitrate(preset.get('audio_bitrate')) or 0) * audio_tracks
+    output_bytes = int((video_bitrate + audio_bitrate) * duration / 8 * SIZE_SAFETY_FACTOR)
+
+    scratch_bytes = 0
+    if str(preset.get('2pass', 'true')).strip().lower() == 'true':
+        frames = duration * float(video_info.get('fps') or 0)
+        scratch_bytes = int(frames * PASSLOG_BYTES_PER_FRAME)
+    return JobEstimate(output_bytes=output_bytes, scratch_bytes=scratch_bytes)
+
+def _existing_path(path: Path) -> Path:
+    path = Path(path).absolute()
+    while not path.exists() and path.parent != path:
+        path = path.parent
+    return path
+
+def volume_id(path: Path) -> int:
+    """Device id of the volume a (possibly not yet existing) path will be written to."""
+    return os.stat(_existing_path(path)).st_dev
+
+def is_network_volume(path: Path) -> bool:
+    path = _existing_path(path)
+    if sys.platform == "win32":
+        drive = os.path.splitdrive(str(path))[0]
+        if drive.startswith("\\\\"):
+            return True
+        try:
+            import ctypes
+            DRIVE_REMOTE = 4
+            return ctypes.windll.kernel32.GetDriveTypeW(f"{drive}\\") == DRIVE_REMOTE
+        except (ImportError, AttributeError, OSError):
+            return False
+
+    # Longest matching mount point decides the filesystem type
+    try:
+        with open("/proc/mounts", encoding="utf-8") as f:
+            mounts = [line.split()[1:3] for line in f if len(line.split()) >= 3]
+    except OSError:
+        return False
+    best, fstype = "", ""
+    target = str(path)
+    for mount_point, mount_type in mounts:
+        if (target == mount_point or target.startswith(mount_point.rstrip("/") + "/")) \
+                and len(mount_point) > len(best):
+            best, fstype = mount_point, mount_type
+    return fstype in NETWORK_FILESYSTEMS
+
+class Lease:
+    """Something a running step holds that it hands back while its job is suspended.
+
+    Used as a context manager for the life of the step. acquire() with an abort check
+    waits until the resource is free again, and returns False if abort() turns true first.
+    """
+
+    def __init__(self):
+        self.held = False
+        self._lock = threading.Lock()
+
+    def acquire(self, abort: Optional[Callable[[], bool]] = None) -> bool:
+        raise NotImplementedError
+
+    def _give(self):
+        raise NotImplementedError
+
+    def release(self):
+        with self._lock:
+            if not self.held:
+                return
+            self.held = False
+        self._give()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class SpaceLease(Lease):
+    """Output and scratch space reserved for one step."""
+
+    def __init__(self, budget: 'DiskBudget', output_dir: Path, temp_dir: Path, estimate: JobEstimate):
+        super().__init__()
+        self.budget = budget
+        self.output_dir = output_dir
+        self.temp_dir = temp_dir
+        self.estimate = estimate
+
+    def acquire(self, abort: Optional[Callable[[], bool]] = None) -> bool:
+        """Without abort, fails at once when the space is not there."""
+        while True:
+            try:
+                self.budget.reserve(self.output_dir, self.estimate.output_bytes)
+                try:
+                    self.budget.reserve(self.temp_dir, self.estimate.scratch_bytes)
+                except EncodingError:
+                    self.budget.release(self.output_dir, self.estimate.output_bytes)
+                    raise
+            except EncodingError:
+                if abort is None:
+                    raise
+                if abort():
+                    return False
+                time.sleep(LEASE_POLL_SECONDS)
+                continue
+            self.held = True
+            return True
+
+    def _give(self):
+        self.budget.release(self.temp_dir, self.estimate.scratch_bytes)
+        self.budget.release(self.output_dir, self.estimate.output_bytes)
+
+class VolumeLease(Lease):
+    """Slots on the volumes one step reads and writes."""
+
+    def __init__(self, semaphores: List[threading.BoundedSemaphore]):
+        super().__init__()
+        self.semaphores = semaphores
+
+    def acquire(self, abort: Optional[Callable[[], bool]] = None) -> bool:
+        """Without abort, waits for as long as it takes."""
+        acquired = []
+        try:
+            for semaphore in self.semaphores:
+                while not semaphore.acquire(timeout=LEASE_POLL_SECONDS):
+                    if abort is not None and abort():
+                        return False
+                acquired.append(semaphore)
+        finally:
+            if len(acquired) < len(self.semaphores):
+                for semaphore in reversed(acquired):
+                    semaphore.release()
+        self.held = True
+        return True
+
+    def _give(self):
+        for semaphore in reversed(self.semaphores):
+            semaphore.release()
+
+class DiskBudget:
+    """Tracks space reserved by queued and running jobs so concurrent jobs cannot overcommit a volume."""
+
+    def __init__(self, min_free_bytes: int = MIN_FREE_BYTES):
+        self.min_free_bytes = min_free_bytes
+        self._reserved: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def available(self, path: Path) -> int:
+        volume = volume_id(path)
+        free = shutil.disk_usage(_existing_path(path)).free
+        with self._lock:
+            return free - self._reserved.get(volume, 0) - self.min_free_bytes
+
+    def reserve(self, path: Path, size: int):
+        volume = volume_id(path)
+        free = shutil.disk_usage(_existing_path(path)).free
+        with self._lock:
+            available = free - self._reserved.get(volume, 0) - self.min_free_bytes
+            if size > available:
+                raise EncodingError(
+                    f"Not enough disk space on {_existing_path(path)}: "
+                    f"need {size / 1024 ** 3:.2f} GB, {max(available, 0) / 1024 ** 3:.2f} GB available"
+                )
+            self._reserved[volume] = self._reserved.get(volume, 0) + size
+        logger.info(f"Reserved {size / 1024 ** 2:.0f} MB on {_existing_path(path)}")
+
+    def release(self, path: Path, size: int):
+        volume = volume_id(path)
+        with self._lock:
+            self._reserved[volume] = max(0, self._reserved.get(volume, 0) - size)
+
+    def reservation(self, output_dir: Path, temp_dir: Path, estimate: JobEstimate) -> SpaceLease:
+        """Output and scratch space for the duration of one job, reserved when entered."""
+        return SpaceLease(self, output_dir, temp_dir, estimate)
+
+    def check(self, requirements: Iterable[tuple]):
+        """Check (path, bytes) pairs for a whole batch before anything is launched."""
+        totals: Dict[int, List] = {}
+        for path, size in requirements:
+            volume = volume_id(path)
+            entry = totals.setdefault(volume, [path, 0])
+            entry[1] += size
+        for path, size in totals.values():
+            available = self.available(path)
+            if size > available:
+                raise EncodingError(
+                    f"Not enough disk space on {_existing_path(path)}: "
+                    f"batch needs {size / 1024 ** 3:.2f} GB, "
+                    f"{max(available, 0) / 1024 ** 3:.2f} GB available"
+                )
+
+class VolumeThrottle:
+    """Limits how many jobs write to the same volume at once; network volumes get a lower limit."""
+
+    def __init__(self, local_limit: Optional[int] = None, slow_limit: int = 1):
+        self.local_limit = local_limit or os.cpu_count() or 1
+        self.slow_limit = slow_limit
+        self._semaphores: Dict[int, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, path: Path) -> tuple:
+        volume = volume_id(path)
+        with self._lock:
+            if volume not in self._semaphores:
+                limit = self.slow_limit if is_network_volume(path) else self.local_limit
+                logger.info(f"Volume {_existing_path(path)}: up to {limit} concurrent job(s)")
+                self._semaphores[volume] = threading.BoundedSemaphore(limit)
+            return volume, self._semaphores[volume]
+
+    def acquire(self, paths: Iterable[Path]) -> VolumeLease:
+        """A slot on every volume of paths, taken when entered."""
+        # Always take volumes in the same order so jobs sharing two volumes cannot deadlock
+        semaphores = dict(self._semaphore(path) for path in paths)
+        return VolumeLease([semaphores[volume] for volume in sorted(semaphores)])
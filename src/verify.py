@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import math
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from errors import O3EncoderError
+from probe import MediaProbe
+from runner import ProcessRunner
+
+logger = logging.getLogger("o3enc.verify")
+
+# Allowed difference between output and source duration (seconds)
+DURATION_TOLERANCE = 0.5
+# Allowed audio/video start offset and end drift (seconds)
+SYNC_START_TOLERANCE = 0.1
+SYNC_END_TOLERANCE = 0.25
+# Allowed frame count difference, as seconds of video
+FRAME_TOLERANCE_SECONDS = 0.1
+
+@dataclass(slots=True)
+class CheckResult:
+    name: str
+    passed: bool
+    detail: str
+
+@dataclass(slots=True)
+class VerificationJob:
+    output_file: Path
+    expected_duration: float
+    expected_fps: float
+
+@dataclass(slots=True)
+class VerificationResult:
+    output_file: Path
+    checks: List[CheckResult] = field(default_factory=list)
+
+    @property
+    def passed(self) -> bool:
+        return all(check.passed for check in self.checks)
+
+    @property
+    def failures(self) -> List[CheckResult]:
+        return [check for check in self.checks if not check.passed]
+
+class OutputVerifier:
+    """Checks finished outputs against the source: duration, frame count, A/V sync and a full decode."""
+
+    def __init__(self, ffmpeg: str, prober: MediaProbe, max_workers: Optional[int] = None,
+                 runner: Optional[ProcessRunner] = None):
+        self.ffmpeg = ffmpeg
+        self.prober = prober
+        self.runner = runner or prober.runner
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    def verify_all(self, jobs: Dict[str, VerificationJob]) -> Dict[str, VerificationResult]:
+        """Verify every output concurrently, one decode process per output."""
+        if not jobs:
+            return {}
+        return self.runner.call(self._verify_all(jobs))
+
+    def verify(self, job: VerificationJob) -> VerificationResult:
+        return self.runner.call(self.verify_async(job))
+
+    async def _verify_all(self, jobs: Dict[str, VerificationJob]) -> Dict[str, VerificationResult]:
+        limit = asyncio.Semaphore(self.max_workers)
+
+        async def verify_one(job: VerificationJob) -> VerificationResult:
+            async with limit:
+                return await self.verify_async(job)
+
+        results = await asyncio.gather(*(verify_one(job) for job in jobs.values()))
+        return dict(zip(jobs, results))
+
+    async def verify_async(self, job: VerificationJob) -> VerificationResult:
+        result = VerificationResult(output_file=job.output_file)
+        logger.info(f"Verifying output: {job.output_file}")
+
+        try:
+            media = await self.prober.probe_async(str(job.output_file))
+        except O3EncoderError as e:
+            result.checks.append(CheckResult("probe", False, str(e)))
+            return result
+
+        video = media.primary_video
+        if video is None:
+            result.checks.append(CheckResult("probe", False, "no video stream in output"))
+            return result
+
+        # Duration against the source
+        duration = media.duration
+        diff = abs(duration - job.expected_duration)
+        result.checks.append(CheckResult(
+            "duration", job.expected_duration <= 0 or diff <= DURATION_TOLERANCE,
+            f"{duration:.2f}s (expected {job.expected_duration:.2f}s)"
+        ))
+
+        # A/V sync: every audio track must start and end with the video
+        result.checks.extend(self._check_sync(media))
+
+        # Full decode catches corruption and gives the exact frame count
+        frames, errors = await self._decode(job.output_file)
+        result.checks.append(CheckResult(
+            "decode", not errors,
+            "clean" if not errors else "; ".join(errors[:3])
+        ))
+        if frames is None:
+            result.checks.append(CheckResult("frame_count", False, "decoder reported no frames"))
+        elif job.expected_duration > 0 and job.expected_fps > 0:
+            expected_frames = round(job.expected_duration * job.expected_fps)
+            tolerance = max(2, math.ceil(job.expected_fps * FRAME_TOLERANCE_SECONDS))
+            result.checks.append(CheckResult(
+                "frame_count", abs(frames - expected_frames) <= tolerance,
+                f"{frames} frames (expected {expected_frames})"
+            ))
+
+        status = "passed" if result.passed else "FAILED"
+        logger.info(f"Verification {status}: {job.output_file}")
+        return result
+
+    def _check_sync(self, media) -> List[CheckResult]:
+        video = media.primary_video
+        checks = []
+        for track in media.audio:
+            if (video.start_time is None or track.start_time is None
+                    or video.duration is None or track.duration is None):
+                checks.append(CheckResult(f"av_sync[{track.index}]", True,
+                                          "not measurable from stream timestamps"))
+                continue
+            start_offset = track.start_time - video.start_time
+            end_drift = (track.start_time + track.duration) - (video.start_time + video.duration)
+            passed = (abs(start_offset) <= SYNC_START_TOLERANCE
+                      and abs(end_drift) <= SYNC_END_TOLERANCE)
+            checks.append(CheckResult(
+                f"av_sync[{track.index}]", passed,
+                f"start offset {start_offset * 1000:+.0f} ms, end drift {end_drift * 1000:+.0f} ms"
+            ))
+        return checks
+
+    async def _decode(self, output_file: Path):
+        cmd = [
+            self.ffmpeg,
+            "-v", "error",
+            "-nostats",
+            "-progress", "pipe:1",
+            "-i", str(output_file),
+            "-map", "0:v",
+            "-map", "0:a?",
+            "-f", "null", "-"
+        ]
+        try:
+            process = await self.runner.execute(cmd)
+        except OSError as e:
+            return None, [f"decoder failed to start: {e}"]
+
+        frames = None
+        for line in process.stdout.splitlines():
+            if line.startswith("frame="):
+                try:
+                    frames = int(line.split("=", 1)[1])
+                except ValueError:
+                    pass
+
+        errors = [line.strip() for line in process.stderr.splitlines() if line.strip()]
+        if process.returncode != 0 and not errors:
+            errors.append(f"decoder exited with code {process.returncode}")
+        return frames, errors
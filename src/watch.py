@@ -0,0 +1,268 @@
+import configparser
+import fnmatch
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from affinity import BACKGROUND_PRIORITY, ProcessPriority, parse_priority
+from errors import O3EncoderError, PresetError
+
+logger = logging.getLogger("o3enc.watch")
+
+DEFAULT_PATTERNS = ["*.mp4", "*.mkv", "*.mov", "*.avi", "*.webm", "*.m2ts", "*.ts"]
+
+@dataclass(slots=True)
+class WatchSettings:
+    workers: int = 1
+    queue_size: int = 4
+    poll_interval: float = 5.0
+    stable_time: float = 10.0
+    state_file: Path = Path("watch_state.json")
+    priority: ProcessPriority = field(default_factory=lambda: BACKGROUND_PRIORITY)
+    pin_cpus: bool = True
+
+@dataclass(slots=True)
+class WatchRule:
+    name: str
+    input_dir: Path
+    output_dir: Path
+    presets: List[str]
+    patterns: List[str] = field(default_factory=lambda: list(DEFAULT_PATTERNS))
+    recursive: bool = False
+    colorspace: str = "auto"
+    colorrange: str = "auto"
+
+    def matches(self, path: Path) -> bool:
+        name = path.name.lower()
+        return any(fnmatch.fnmatch(name, pattern.lower()) for pattern in self.patterns)
+
+def load_watch_config(config_file: Path) -> Tuple[WatchSettings, List[WatchRule]]:
+    """Read watch.ini: a [settings] section plus one [folder:<name>] section per watched folder."""
+    if not Path(config_file).exists():
+        raise PresetError(f"Watch configuration not found: {config_file}")
+
+    config = configparser.ConfigParser()
+    try:
+        config.read(config_file, encoding='utf-8')
+    except configparser.Error as e:
+        raise PresetError(f"Failed to read watch configuration: {str(e)}")
+
+    base_dir = Path(config_file).parent
+    settings = WatchSettings(state_file=base_dir / "watch_state.json")
+    if config.has_section("settings"):
+        section = config["settings"]
+        try:
+            settings.workers = max(1, section.getint("workers", fallback=settings.workers))
+            settings.queue_size = max(0, section.getint("queue_size", fallback=settings.queue_size))
+            settings.poll_interval = section.getfloat("poll_interval", fallback=settings.poll_interval)
+            settings.stable_time = section.getfloat("stable_time", fallback=settings.stable_time)
+            settings.pin_cpus = section.getboolean("pin_cpus", fallback=settings.pin_cpus)
+            if section.get("nice") or section.get("ionice"):
+                settings.priority = parse_priority(section.get("nice"), section.get("ionice"),
+                                                   settings.priority)
+        except ValueError as e:
+            raise PresetError(f"Invalid watch setting: {str(e)}")
+        if section.get("state_file"):
+            settings.state_file = base_dir / section.get("state_file")
+
+    rules = []
+    for section_name in config.sections():
+        if not section_name.startswith("folder:"):
+            continue
+        section = config[section_name]
+        name = section_name.split(":", 1)[1].strip()
+        try:
+            input_dir = Path(section["input"])
+            presets = [p.strip() for p in section["presets"].split(",") if p.strip()]
+        except KeyError as e:
+            raise PresetError(f"Watch folder [{name}] is missing {str(e)}")
+        if not presets:
+            raise PresetError(f"Watch folder [{name}] has no presets")
+        patterns = [p.strip() for p in section.get("pattern", "").split(",") if p.strip()]
+        rules.append(WatchRule(
+            name=name,
+            input_dir=input_dir,
+            output_dir=Path(section.get("output", str(input_dir / "encoded"))),
+            presets=presets,
+            patterns=patterns or list(DEFAULT_PATTERNS),
+            recursive=section.getboolean("recursive", fallback=False),
+            colorspace=section.get("colorspace", "auto"),
+            colorrange=section.get("colorrange", "auto")
+        ))
+
+    if not rules:
+        raise PresetError("No [folder:...] sections found in watch configuration")
+    return settings, rules
+
+class WatchState:
+    """Persistent record of processed files so a restart does not encode them again."""
+
+    def __init__(self, state_file: Path):
+        self.state_file = Path(state_file)
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        if self.state_file.exists():
+            try:
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Could not read watch state, starting fresh: {str(e)}")
+
+    def is_handled(self, path: Path, size: int, mtime: float) -> bool:
+        """True when this exact file version already finished (successfully or not)."""
+        with self._lock:
+            entry = self._entries.get(str(path))
+        if not entry or entry.get("status") == "running":
+            return False
+        return entry.get("size") == size and entry.get("mtime") == mtime
+
+    def update(self, path: Path, size: int, mtime: float, status: str, outputs: Optional[Dict[str, str]] = None):
+        with self._lock:
+            self._entries[str(path)] = {
+                "size": size,
+                "mtime": mtime,
+                "status": status,
+                "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "outputs": outputs or {}
+            }
+            self._save()
+
+    def _save(self):
+        temp_file = self.state_file.with_suffix(self.state_file.suffix + ".tmp")
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, indent=2)
+            os.replace(temp_file, self.state_file)
+        except OSError as e:
+            logger.error(f"Failed to save watch state: {str(e)}")
+
+class WatchDaemon:
+    """Polls watched folders, waits for files to stop growing and feeds a bounded worker pool."""
+
+    def __init__(self, rules: List[WatchRule], job_runner: Callable[[str, WatchRule], Dict[str, dict]],
+                 settings: WatchSettings, estimator: Optional[Callable[[str, WatchRule], float]] = None):
+        self.rules = rules
+        self.job_runner = job_runner
+        self.settings = settings
+        # Expected seconds per file; files that become ready together are queued longest first
+        self.estimator = estimator
+        self._estimates: Dict[Tuple[Path, int, float], float] = {}
+        self.state = WatchState(settings.state_file)
+        # path -> (size, mtime, time the size/mtime were first seen unchanged)
+        self._pending: Dict[Path, Tuple[int, float, float]] = {}
+        self._in_flight: Dict[Path, Future] = {}
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        logger.info(f"Watching {len(self.rules)} folder(s) with {self.settings.workers} worker(s)")
+        for rule in self.rules:
+            rule.output_dir.mkdir(parents=True, exist_ok=True)
+            logger.info(f"[{rule.name}] {rule.input_dir} -> {rule.output_dir} ({', '.join(rule.presets)})")
+
+        with ThreadPoolExecutor(max_workers=self.settings.workers) as executor:
+            try:
+                while not self._stop.is_set():
+                    self._reap()
+                    self._scan(executor)
+                    self._stop.wait(self.settings.poll_interval)
+            finally:
+                # Do not start queued jobs on shutdown; running ones finish
+                for path, future in list(self._in_flight.items()):
+                    if future.cancel():
+                        logger.info(f"Dropped queued file: {path}")
+
+    def _reap(self):
+        for path, future in list(self._in_flight.items()):
+            if future.done():
+                del self._in_flight[path]
+
+    def _capacity(self) -> int:
+        return self.settings.workers + self.settings.queue_size - len(self._in_flight)
+
+    def _scan(self, executor: ThreadPoolExecutor):
+        now = time.monotonic()
+        seen = set()
+        ready = []
+        for rule in self.rules:
+            if not rule.input_dir.exists():
+                continue
+            walker = rule.input_dir.rglob("*") if rule.recursive else rule.input_dir.glob("*")
+            for path in sorted(walker):
+                # Never pick up our own outputs when they are written inside the watched folder
+                if not path.is_file() or not rule.matches(path) or rule.output_dir in path.parents:
+                    continue
+                seen.add(path)
+                if path in self._in_flight:
+                    continue
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                if self.state.is_handled(path, stat.st_size, stat.st_mtime):
+                    continue
+
+                previous = self._pending.get(path)
+                if previous is None or previous[:2] != (stat.st_size, stat.st_mtime):
+                    # New or still being written: restart the stability timer
+                    self._pending[path] = (stat.st_size, stat.st_mtime, now)
+                    continue
+                if now - previous[2] < self.settings.stable_time:
+                    continue
+                ready.append((path, stat, rule))
+
+        if self.estimator is not None and len(ready) > 1:
+            ready.sort(key=lambda item: self._estimate(*item), reverse=True)
+        for path, stat, rule in ready[:max(0, self._capacity())]:
+            del self._pending[path]
+            self._estimates.pop((path, stat.st_size, stat.st_mtime), None)
+            logger.info(f"[{rule.name}] Queued: {path}")
+            self.state.update(path, stat.st_size, stat.st_mtime, "running")
+            self._in_flight[path] = executor.submit(self._process, path, stat.st_size, stat.st_mtime, rule)
+
+        # Forget files that disappeared before becoming stable
+        for path in list(self._pending):
+            if path not in seen:
+                del self._pending[path]
+        for key in list(self._estimates):
+            if key[0] not in self._pending:
+                del self._estimates[key]
+
+    def _estimate(self, path: Path, stat: os.stat_result, rule: WatchRule) -> float:
+        # Files waiting for capacity are estimated once, not on every scan
+        key = (path, stat.st_size, stat.st_mtime)
+        if key not in self._estimates:
+            try:
+                self._estimates[key] = self.estimator(str(path), rule)
+            except O3EncoderError as e:
+                logger.warning(f"Could not estimate {path}: {str(e)}")
+                self._estimates[key] = 0.0
+        return self._estimates[key]
+
+    def _process(self, path: Path, size: int, mtime: float, rule: WatchRule):
+        try:
+            results = self.job_runner(str(path), rule)
+        except O3EncoderError as e:
+            logger.error(f"[{rule.name}] Failed: {path}: {str(e)}")
+            self.state.update(path, size, mtime, "failed")
+            return
+        except Exception as e:
+            logger.error(f"[{rule.name}] Unexpected error on {path}: {str(e)}")
+            self.state.update(path, size, mtime, "failed")
+            return
+
+        succeeded = all(
+            result['success'] and (result.get('verification') is None or result['verification'].passed)
+            for result in results.values()
+        )
+        outputs = {name: str(result['output_file']) for name, result in results.items() if result['success']}
+        self.state.update(path, size, mtime, "done" if succeeded else "failed", outputs)
+        logger.info(f"[{rule.name}] {'Finished' if succeeded else 'Finished with errors'}: {path}")